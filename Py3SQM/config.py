@@ -55,10 +55,17 @@ _data_supplier = (
 )
 _device_addr = "/dev/ttyUSB_SQMsensor"  # Default IP address of the ethernet device (if not automatically found)
 _measures_to_promediate = 1  # Take the mean of N measures
+_streaming_mean = False  # Filter the N measures as they come (for large N).
 _delay_between_measures = 30  # Delay between two measures. In seconds.
 _cache_measures = 1  # Get X measures before writing on screen/file
 _plot_each = 1  # Call the plot function each X measures.
 
+# Outputs of the measures (see pysqm/sinks.py): "file", "mysql", "datacenter",
+# "plot", "sqlite" or "module.Class" for your own Sink. An entry can also be
+# (name, {options}), eg. ("sqlite", {"path": "/data/sqm.sqlite", "batch_size": 100}).
+# None: file and plot, plus mysql if _use_mysql.
+_sinks = None
+
 _use_mysql = False  # Set to True if you want to store data on a MySQL db.
 _mysql_host = None  # Host (ip:port / localhost) of the MySQL engine.
 _mysql_user = None  # User with write permission on the db.
@@ -66,6 +73,10 @@ _mysql_pass = None  # Password for that user.
 _mysql_database = None  # Name of the database.
 _mysql_dbtable = None  # Name of the table
 _mysql_port = None  # Port of the MySQL server.
+_mysql_batch_size = 10  # Rows sent to the db in each INSERT.
+_mysql_spool_file = None  # Rows not sent yet (db down). None: in current data dir.
+_datacenter_outbox = None  # Datacenter messages not sent yet. None: current data dir.
+_datacenter_outbox_size = 8 * 1024 * 1024  # Stop queueing beyond this (bytes).
 
 _local_timezone = +1  # UTC+1
 _computer_timezone = +0  # UTC
@@ -86,6 +97,16 @@ current_data_directory = monthly_data_directory
 current_graph_directory = monthly_data_directory
 # Summary with statistics for the night
 summary_data_directory = monthly_data_directory
+# Statistics of each night, the summary file is exported from it
+_statistics_db = summary_data_directory + "/Statistics.sqlite"
+# Rewrite the whole summary file after each night (else: python -m pysqm.statsdb)
+_statistics_csv = False
+# How the current data file follows the daily one: "hardlink", "symlink" or "append" (copy)
+_current_file_mode = "hardlink"
+_fsync_interval = 60  # Seconds between forcing data files to disk. 0 = every write
+# Moon, twilight and sunset times, computed once per night. None = keep in memory only
+_ephem_cache_file = monthly_data_directory + "/ephem_cache.json"
+_ephem_cache_size = 400  # Entries kept (3 per night)
 
 
 """
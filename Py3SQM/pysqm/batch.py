@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+
+"""
+PySQM batch statistics
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import multiprocessing
+import numpy as np
+from datetime import datetime
+
+# Read configuration
+import pysqm.settings as settings
+
+if __name__ != "__main__":
+    config = settings.GlobalConfig.config
+
+
+def find_datafiles(directories):
+    """
+    All data files under the given directories
+    (statistics files excluded)
+    """
+    filenames = []
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if name.endswith(".dat") and not name.startswith("Statistics_"):
+                    filenames.append(os.path.join(root, name))
+    return sorted(set(os.path.abspath(name) for name in filenames))
+
+
+def load_archive(filenames):
+    """
+    Header of the last file and rows of all the given files, in time
+    order. The same rows are in the monthly and the daily files,
+    so they are kept only once
+    """
+    from pysqm.datafile import DTYPE, read_datafile
+
+    header = []
+    parts = []
+    for filename in filenames:
+        try:
+            header, rows = read_datafile(filename)
+        except (OSError, ValueError) as ex:
+            print("Warning: skipping " + filename + " (" + str(ex) + ")")
+        else:
+            parts.append(rows)
+
+    if len(parts) == 0:
+        return header, np.empty(0, dtype=DTYPE)
+
+    rows = np.concatenate(parts)
+    first = np.unique(rows["utc"], return_index=True)[1]
+    return header, rows[first]
+
+
+def corrected(rows):
+    """
+    Rows with the calibration offset applied, if so configured
+    (as in SQMData.process_rawdata)
+    """
+    try:
+        config._plot_corrected_data
+    except AttributeError:
+        config._plot_corrected_data = False
+    if config._plot_corrected_data:
+        rows["nsb"] += config._plot_corrected_data * config._offset_calibration
+    return rows
+
+
+def split_nights(rows):
+    """
+    Split rows (in time order) into nights. A night is named after
+    the local date at its start, as in SQMData.check_number_of_nights.
+    Returns a list of (night, rows) with night a datetime.date
+    """
+    if len(rows) == 0:
+        return []
+    nights = (rows["local"] - np.timedelta64(12, "h")).astype("datetime64[D]")
+    starts = np.flatnonzero(nights[1:] != nights[:-1]) + 1
+    return [
+        (part_nights[0].astype(object), part)
+        for part_nights, part in zip(np.split(nights, starts), np.split(rows, starts))
+    ]
+
+
+def night_statistics(task):
+    """
+    Statistics of one night, as SQMData.data_statistics computes them.
+    Runs in a worker process: task holds the night, its rows and the
+    twilight times, so no ephemerids are computed here
+    """
+    from pysqm.plot import SQMData
+
+    night, rows, twilight_prev_set, twilight_next_rise = task
+
+    class Twilights(object):
+        pass
+
+    Ephem = Twilights()
+    Ephem.twilight_prev_set = np.datetime64(twilight_prev_set, "ms")
+    Ephem.twilight_next_rise = np.datetime64(twilight_next_rise, "ms")
+
+    NSBData = SQMData.__new__(SQMData)
+    NSBData.Statistics = SQMData.Statistics()
+    NSBData.all_night_dt = rows["utc"]
+    NSBData.all_night_sb = rows["nsb"]
+    NSBData.all_night_temp = rows["temperature"]
+    try:
+        NSBData.data_statistics(Ephem)
+    except ValueError as ex:
+        print("Warning: no statistics for " + str(night) + " (" + str(ex) + ")")
+        return night, None
+
+    return night, NSBData.Statistics
+
+
+def rebuild_statistics(directories=None, processes=None):
+    """
+    Compute the statistics of every night in the data directories,
+    in parallel, store them in one transaction and export the
+    statistics file
+    """
+    from pysqm.plot import Ephemerids, stats_filename
+    from pysqm.ephemcache import ephem_cache
+    from pysqm.statsdb import StatsStore
+
+    if directories is None:
+        directories = [config.monthly_data_directory, config.daily_data_directory]
+
+    header, rows = load_archive(find_datafiles(directories))
+    nights = split_nights(corrected(rows))
+    print("%d rows in %d nights" % (len(rows), len(nights)))
+
+    # Twilights in this process, so the ephemerids cache is shared
+    cache = ephem_cache()
+    cache.autosave = False
+    Ephem = Ephemerids()
+    tasks = []
+    for night, night_rows in nights:
+        Ephem.calculate_twilight(thedate=night)
+        tasks.append(
+            (night, night_rows, Ephem.twilight_prev_set, Ephem.twilight_next_rise)
+        )
+    cache.autosave = True
+    cache.save()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(night_statistics, tasks, chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = [(night, Stat) for night, Stat in results if Stat is not None]
+    Store = StatsStore()
+    Store.upsert_many(results)
+    Store.export_csv()
+    Store.close()
+    print("Statistics of %d nights written to %s" % (len(results), stats_filename()))
+
+
+def night_data(night, rows, serial_number):
+    """
+    SQMData of one night, filled from its rows at once
+    (sun altitudes included) instead of line by line
+    """
+    from pysqm.plot import SQMData
+    from pysqm.sun import sun_altitude
+    from pysqm.common import define_ephem_observatory
+
+    Observatory = define_ephem_observatory()
+    altitudes = sun_altitude(
+        rows["utc"], float(Observatory.lat), float(Observatory.lon)
+    )
+    days = rows["local"].astype("datetime64[D]")
+    hours = (rows["local"] - days) // np.timedelta64(1, "h")
+
+    Data = SQMData.__new__(SQMData)
+    Data.Night = night
+    Data.serial_number = serial_number
+    Data.all_night_dt = list(rows["utc"].astype(object))
+    Data.all_night_sb = rows["nsb"]
+    Data.all_night_temp = rows["temperature"]
+    Data.premidnight = SQMData.premidnight()
+    Data.aftermidnight = SQMData.aftermidnight()
+    for part, selection in [
+        (Data.premidnight, hours > 12),
+        (Data.aftermidnight, hours <= 12),
+    ]:
+        local = rows["local"][selection]
+        part.utcdates = list(rows["utc"][selection].astype(object))
+        part.localdates = list(local.astype(object))
+        part.temperatures = rows["temperature"][selection]
+        part.tick_counts = rows["counts"][selection]
+        part.frequencies = rows["frequency"][selection]
+        part.night_sbs = rows["nsb"][selection]
+        part.sun_altitude = altitudes[selection]
+        part.label_dates = [
+            str(day).replace("-", "")
+            for day in np.unique(local.astype("datetime64[D]"))
+        ]
+    return Data
+
+
+# Figure reused by each worker process for all its nights
+_template = None
+
+
+def render_night(task):
+    """
+    Render the daily graph of one night. Runs in a worker process
+    """
+    global _template
+    from pysqm.plot import Ephemerids, TemplatePlot, output_filenames
+
+    night, rows, serial_number, ephemerids = task
+    if _template is None:
+        _template = TemplatePlot()
+
+    Ephem = Ephemerids.__new__(Ephemerids)
+    vars(Ephem).update(ephemerids)
+    try:
+        _template.draw(night_data(night, rows, serial_number), Ephem)
+        output_filename = output_filenames(night)[1]
+        _template.save_figure(output_filename)
+    except Exception as ex:
+        print("Warning: cannot plot " + str(night) + " (" + str(ex) + ")")
+        return None
+    return output_filename
+
+
+def render_nights(first, last, directories=None, processes=None):
+    """
+    Render the daily graphs of the nights from first to last
+    (datetime.date, both included) in parallel. The data is read
+    and split once, and the ephemerids come from the cache
+    """
+    import time
+    from pysqm.plot import Ephemerids
+    from pysqm.datafile import header_value
+    from pysqm.ephemcache import ephem_cache
+
+    if directories is None:
+        directories = [config.monthly_data_directory, config.daily_data_directory]
+
+    start = time.time()
+    header, rows = load_archive(find_datafiles(directories))
+    serial_number = header_value(header, "SQM serial number")
+    nights = [
+        (night, night_rows)
+        for night, night_rows in split_nights(corrected(rows))
+        if first <= night <= last
+    ]
+
+    # Ephemerids in this process, so the cache is shared
+    cache = ephem_cache()
+    cache.autosave = False
+    Ephem = Ephemerids()
+    tasks = []
+    for night, night_rows in nights:
+        Ephem.calculate_moon_ephems(thedate=night)
+        Ephem.calculate_twilight(thedate=night)
+        # Plain floats and datetimes, ephem angles do not pickle
+        ephemerids = dict(
+            (name, value if isinstance(value, datetime) else float(value))
+            for name, value in vars(Ephem).items()
+            if name != "Observatory"
+        )
+        tasks.append((night, night_rows, serial_number, ephemerids))
+    cache.autosave = True
+    cache.save()
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        plots = pool.map(render_night, tasks, chunksize=4)
+    finally:
+        pool.close()
+        pool.join()
+
+    plots = [output_filename for output_filename in plots if output_filename]
+    elapsed = time.time() - start
+    print(
+        "%d plots in %.1f s (%.2f plots/s)"
+        % (len(plots), elapsed, len(plots) / max(elapsed, 1e-6))
+    )
+    return plots
+
+
+"""
+The following code rebuilds the statistics of the whole archive:
+python -m pysqm.batch -c config.py
+or renders the daily graphs of a range of nights:
+python -m pysqm.batch -c config.py --plots 2024-05-01 2024-05-31
+"""
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default="config.py")
+    parser.add_argument("--plots", nargs=2, metavar=("FIRST", "LAST"), default=None)
+    InputArguments = parser.parse_args()
+    settings.GlobalConfig.read_config_file(InputArguments.config)
+    import pysqm.batch
+
+    if InputArguments.plots is None:
+        pysqm.batch.rebuild_statistics()
+    else:
+        first, last = [
+            datetime.strptime(day, "%Y-%m-%d").date() for day in InputArguments.plots
+        ]
+        pysqm.batch.render_nights(first, last)
@@ -23,9 +23,30 @@ along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
 ____________________________
 '''
 
+import sys
 import math
-import ephem
+import time
 import datetime
+import importlib.util
+
+def lazy_import(name):
+    '''
+    Import a module on first use (first attribute access) instead of
+    now. Keeps slow imports out of the startup path
+    '''
+    if name in sys.modules:
+        return(sys.modules[name])
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named '+str(name))
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return(module)
+
+ephem = lazy_import('ephem')
 
 # Read the config variables from config.py
 import pysqm.settings as settings
@@ -84,22 +105,63 @@ class observatory(object):
         Sun = ephem.Sun(OBS)
         return(Sun.alt)
 
+    def next_night(self,OBS,timeutc):
+        '''
+        Start and end (UTC) of the night in progress, or of the next one.
+        Looked up in a table of the coming nights, computed once (and
+        cached, see pysqm.ephemcache), so no ephemerids are needed
+        between one night and the next
+        '''
+        try:
+            schedule = self.schedule
+        except AttributeError:
+            schedule = []
+        schedule = [limits for limits in schedule if limits[1]>timeutc]
+        if len(schedule)==0:
+            from pysqm.ephemcache import night_limits
+            night = (self.local_datetime(timeutc)-datetime.timedelta(hours=12)).date()
+            schedule = [night_limits(OBS,night+datetime.timedelta(days=k),\
+             config._observatory_horizon) for k in range(8)]
+            schedule = [limits for limits in schedule if limits[1]>timeutc]
+        self.schedule = schedule
+        return(schedule[0])
+
     def next_sunset(self,OBS):
-        # Next sunset calculation
-        previous_horizon = OBS.horizon
-        OBS.horizon = str(config._observatory_horizon)
-        next_setting = OBS.next_setting(ephem.Sun()).datetime()
+        # Start of the next night
+        timeutc = self.read_datetime()
+        try:
+            next_setting = self.next_night(OBS,timeutc)[0]
+        except ephem.CircumpolarError:
+            return('the Sun sets')
         next_setting = next_setting.strftime("%Y-%m-%d %H:%M:%S")
-        OBS.horizon = previous_horizon
         return(next_setting)
 
     def is_nighttime(self,OBS):
         # Is nightime (sun below a given altitude)
         timeutc = self.read_datetime()
-        if self.calculate_sun_altitude(OBS,timeutc)*180./math.pi>config._observatory_horizon:
-            return False
-        else:
-            return True
+        try:
+            start,end = self.next_night(OBS,timeutc)
+        except ephem.CircumpolarError:
+            # Polar day or night, the Sun does not cross the horizon
+            if self.calculate_sun_altitude(OBS,timeutc)*180./math.pi>config._observatory_horizon:
+                return False
+            else:
+                return True
+        return(start<=timeutc)
+
+    def sleep_until_night(self,OBS,max_sleep=3600):
+        '''
+        Sleep until the next night starts. Sleeps at most max_sleep
+        seconds at once, so a clock set meanwhile (eg. by NTP on a Pi
+        without RTC) is noticed
+        '''
+        timeutc = self.read_datetime()
+        try:
+            start,end = self.next_night(OBS,timeutc)
+            seconds = (start-timeutc).total_seconds()
+        except ephem.CircumpolarError:
+            seconds = 300
+        time.sleep(min(max(seconds,1),max_sleep))
 
 
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""
+PySQM data file loader
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import time
+import tempfile
+import numpy as np
+
+# Columns of a data row, as described in the file header
+DTYPE = np.dtype(
+    [
+        ("utc", "datetime64[ms]"),
+        ("local", "datetime64[ms]"),
+        ("temperature", np.float64),
+        ("counts", np.float64),
+        ("frequency", np.float64),
+        ("nsb", np.float64),
+    ]
+)
+NFIELDS = len(DTYPE.names)
+
+
+def split_header(content):
+    """
+    Split the header (the lines starting with #) from the data rows.
+    Returns the header lines as str and the rest of the file as bytes
+    """
+    end = 0
+    while content.startswith(b"#", end):
+        newline = content.find(b"\n", end)
+        if newline < 0:
+            end = len(content)
+            break
+        end = newline + 1
+
+    header = content[:end].decode("utf-8", errors="replace").splitlines()
+    return header, content[end:]
+
+
+def parse_rows(body):
+    """
+    Parse data rows into a structured array of DTYPE.
+    Rows are split with bytes operations and each column is converted
+    at once by NumPy, instead of field by field in Python
+    """
+    body = body.replace(b" ", b"").replace(b"\r", b"")
+    lines = body.split()
+
+    if b"#" in body or body.count(b";") != (NFIELDS - 1) * len(lines):
+        # Comments or incomplete rows somewhere, keep the complete ones
+        lines = [
+            line
+            for line in lines
+            if line.count(b";") == NFIELDS - 1 and not line.startswith(b"#")
+        ]
+
+    rows = np.empty(len(lines), dtype=DTYPE)
+    if len(lines) == 0:
+        return rows
+
+    fields = np.array(b";".join(lines).split(b";")).reshape(-1, NFIELDS)
+    for k, name in enumerate(DTYPE.names):
+        rows[name] = fields[:, k].astype(DTYPE[name])
+
+    return rows
+
+
+def read_datafile(filename):
+    """
+    Read a data file in one go.
+    Returns the header lines and the rows as a structured array
+    """
+    datafile = open(filename, "rb")
+    content = datafile.read()
+    datafile.close()
+
+    header, body = split_header(content)
+    return header, parse_rows(body)
+
+
+def header_value(header, key):
+    """
+    Value of a header entry, eg. header_value(header, 'SQM serial number')
+    """
+    for line in header:
+        if line.startswith("# " + key + ":"):
+            return line.split(":", 1)[1].strip()
+    return None
+
+
+def sample_datafile(filename, nights=30):
+    """
+    Write a synthetic monthly data file: one row a minute,
+    ten hours a night
+    """
+    from pysqm.common import RAWHeaderContent
+
+    rng = np.random.RandomState(0)
+    datafile = open(filename, "w")
+    datafile.write(RAWHeaderContent.replace("$SERIAL_NUMBER", "1234"))
+    start = np.datetime64("2024-05-01T03:00:00.000")
+    for night in range(nights):
+        nsb = 19.5 + rng.uniform(-1, 1)
+        temperature = 15 + rng.uniform(-5, 5)
+        for minute in range(600):
+            utc = start + np.timedelta64(night, "D") + np.timedelta64(minute, "m")
+            local = utc - np.timedelta64(5, "h")
+            nsb += rng.normal(0, 0.02)
+            temperature += rng.normal(0, 0.01)
+            frequency = 10 ** ((19.0 - nsb) / 2.5) * 25
+            datafile.write(
+                "%s;%s;%.2f;0.000;%.3f;%.3f\n"
+                % (utc, local, temperature, frequency, nsb)
+            )
+    datafile.close()
+
+
+def legacy_parse(filename):
+    """
+    Parse a data file the way SQMData did before this loader:
+    readlines, per-line checks, then per-field conversions
+    """
+    from pysqm.plot import SQMData
+    from pysqm.common import format_value_list
+
+    Data = SQMData.__new__(SQMData)
+    Data.load_rawdata(filename)
+    rows = []
+    for line in format_value_list(Data.raw_data):
+        rows.append(
+            (
+                Data.process_datetimes(line[0]),
+                Data.process_datetimes(line[1]),
+                float(line[2]),
+                float(line[3]),
+                float(line[4]),
+                float(line[5]),
+            )
+        )
+    return rows
+
+
+def benchmark(nights=30, repeat=3):
+    """
+    Compare the time to parse a month-long monthly file
+    with both loaders
+    """
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "benchmark.dat")
+    sample_datafile(filename, nights)
+
+    def best_time(function):
+        times = []
+        for k in range(repeat):
+            start = time.perf_counter()
+            result = function(filename)
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    legacy_time, legacy_rows = best_time(legacy_parse)
+    fast_time, (header, rows) = best_time(read_datafile)
+    os.remove(filename)
+    os.rmdir(directory)
+
+    assert len(rows) == len(legacy_rows)
+    assert np.allclose(rows["nsb"], [row[5] for row in legacy_rows])
+
+    print("%d rows (%d nights)" % (len(rows), nights))
+    print("  readlines + per-field parsing: %.3f s" % legacy_time)
+    print("  read_datafile:                 %.3f s" % fast_time)
+    print("  speedup: %.1fx" % (legacy_time / fast_time))
+
+
+"""
+The following code runs the benchmark:
+python -m pysqm.datafile -c config.py
+"""
+if __name__ == "__main__":
+    import pysqm.settings as settings
+
+    InputArguments = settings.ArgParser()
+    settings.GlobalConfig.read_config_file(InputArguments.config)
+    benchmark()
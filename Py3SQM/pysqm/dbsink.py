@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""
+PySQM database sink
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import sys
+
+# Read configuration
+import pysqm.settings as settings
+
+if __name__ != "__main__":
+    config = settings.GlobalConfig.config
+
+    # Optional settings, for config files that predate them
+    try:
+        config._mysql_batch_size
+    except AttributeError:
+        config._mysql_batch_size = 10
+    try:
+        config._mysql_spool_file
+    except AttributeError:
+        config._mysql_spool_file = None  # in the current data directory
+
+
+def mysql_connect():
+    """
+    DB-API connection to the configured MySQL/MariaDB server, with
+    mysqlclient (MySQLdb, which provides _mysql) or else PyMySQL
+    """
+    try:
+        import MySQLdb as driver
+    except ImportError:
+        import pymysql as driver
+
+    options = dict(
+        host=config._mysql_host,
+        user=config._mysql_user,
+        passwd=config._mysql_pass,
+        db=config._mysql_database,
+        connect_timeout=10,
+    )
+    if config._mysql_port is not None:
+        options["port"] = int(config._mysql_port)
+    return driver.connect(**options)
+
+
+def placeholder(connection):
+    """
+    Parameter marker of the driver behind a DB-API connection
+    (%s for MySQLdb and PyMySQL, ? for sqlite3)
+    """
+    for cls in type(connection).__mro__:
+        driver = sys.modules.get(cls.__module__.split(".")[0])
+        if hasattr(driver, "paramstyle"):
+            return "?" if driver.paramstyle == "qmark" else "%s"
+    return "%s"
+
+
+def parse_row(formatted_data):
+    """
+    Values of one data row (as written to the data files): UTC and
+    local times as strings, temperature, counts, frequency and
+    sky brightness as floats
+    """
+    values = formatted_data.strip().split(";")
+    if len(values) != 6:
+        raise ValueError("expected 6 fields, got %d" % len(values))
+    return values[:2] + [float(value) for value in values[2:]]
+
+
+class DatabaseSink(object):
+    """
+    Sends the data rows to a database table, several rows per
+    INSERT, over a connection kept open between batches. Rows that
+    cannot be sent (database down, network lost) are kept in a
+    spool file and sent first once the database is back.
+
+    connect is any function returning a DB-API connection, so a
+    local SQLite database can stand in for MySQL (see check()).
+    """
+
+    def __init__(self, connect=None, table=None, batch_size=None, spool_path=None):
+        self.connect = mysql_connect if connect is None else connect
+        self.table = str(config._mysql_dbtable if table is None else table)
+        self.batch_size = config._mysql_batch_size if batch_size is None else batch_size
+        if spool_path is None:
+            spool_path = config._mysql_spool_file
+        if spool_path is None:
+            spool_path = os.path.join(config.current_data_directory, "MySQL_spool.dat")
+        self.spool_path = spool_path
+        self.connection = None
+        self.pending = []  # rows not sent yet
+
+    def add(self, formatted_data):
+        """
+        Queue data rows, sending them once there is a whole batch
+        """
+        for line in formatted_data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                parse_row(line)
+            except ValueError as ex:
+                # Would make every batch fail, and stay in the spool
+                print("Warning: not sending row to the database (%s)" % str(ex))
+                continue
+            self.pending.append(line + "\n")
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def spooled(self):
+        # Rows left in the spool file by earlier failures
+        if not os.path.exists(self.spool_path):
+            return []
+        rows = []
+        spool_file = open(self.spool_path, "r")
+        for line in spool_file:
+            try:
+                parse_row(line)
+            except ValueError:
+                continue  # blank, or left half written by a crash
+            rows.append(line)
+        spool_file.close()
+        return rows
+
+    def spool(self, rows):
+        # Append rows to the spool file
+        spool_file = open(self.spool_path, "a")
+        spool_file.writelines(rows)
+        spool_file.flush()
+        os.fsync(spool_file.fileno())
+        spool_file.close()
+
+    def insert(self, rows):
+        # Insert rows in one transaction, over the open connection
+        if self.connection is None:
+            self.connection = self.connect()
+        marker = placeholder(self.connection)
+        values = ", ".join([marker] * 6)
+        query = "INSERT INTO " + self.table + " VALUES (NULL, " + values + ")"
+        cursor = self.connection.cursor()
+        try:
+            cursor.executemany(query, [parse_row(row) for row in rows])
+            self.connection.commit()
+        finally:
+            cursor.close()
+
+    def flush(self):
+        """
+        Send the spooled and pending rows. Returns True if the
+        database has them all
+        """
+        pending = self.pending
+        self.pending = []
+
+        spooled = []
+        if os.path.exists(self.spool_path):
+            # Still down: only add the new rows, the spool is read
+            # once the database answers again
+            try:
+                if self.connection is None:
+                    self.connection = self.connect()
+            except Exception as ex:
+                return self.keep(pending, ex)
+            spooled = self.spooled()
+        rows = spooled + pending
+        if len(rows) == 0:
+            return True
+
+        # A dropped connection is only noticed when used: retry once
+        for attempt in range(2):
+            try:
+                self.insert(rows)
+            except Exception as ex:
+                self.disconnect()
+                error = ex
+            else:
+                if os.path.exists(self.spool_path):
+                    os.remove(self.spool_path)
+                return True
+        return self.keep(pending, error)
+
+    def keep(self, rows, error):
+        # Rows not sent go to the spool file, after the ones already there
+        print(
+            "DB Error. Exception: %s. %d rows added to %s"
+            % (str(error), len(rows), self.spool_path)
+        )
+        if rows:
+            self.spool(rows)
+        return False
+
+    def disconnect(self):
+        # Drop the connection, a new one is made for the next batch
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+        self.connection = None
+
+    def close(self):
+        """
+        Send what is left and close the connection, eg. at the end
+        of the night
+        """
+        self.flush()
+        self.disconnect()
+
+
+def check(directory=None):
+    """
+    Run the sink against a local SQLite database, with an outage
+    in the middle. Returns True if every row arrives exactly once
+    """
+    import sqlite3
+    import tempfile
+
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "check.sqlite")
+    database = sqlite3.connect(path)
+    database.execute(
+        "CREATE TABLE data (id INTEGER PRIMARY KEY, utc TEXT, local TEXT, "
+        "temperature REAL, counts REAL, frequency REAL, nsb REAL)"
+    )
+    database.commit()
+
+    status = {"up": True}
+
+    class StandIn(sqlite3.Connection):
+        # Fails while the database is down, even if already open
+        def cursor(self, *args):
+            if not status["up"]:
+                raise sqlite3.OperationalError("database is down")
+            return sqlite3.Connection.cursor(self, *args)
+
+    def connect():
+        if not status["up"]:
+            raise sqlite3.OperationalError("database is down")
+        return sqlite3.connect(path, factory=StandIn)
+
+    Sink = DatabaseSink(
+        connect=connect,
+        table="data",
+        batch_size=4,
+        spool_path=os.path.join(directory, "spool.dat"),
+    )
+    rows = [
+        "2024-05-01T22:%02d:00.000;2024-05-02T00:%02d:00.000;"
+        "12.50;0.000;3.210;%.3f\n" % (k, k, 20 + k / 100.0)
+        for k in range(30)
+    ]
+    for k, row in enumerate(rows):
+        status["up"] = not 8 <= k < 20
+        Sink.add(row)
+    Sink.close()
+
+    stored = database.execute("SELECT utc FROM data ORDER BY utc").fetchall()
+    database.close()
+    expected = [row.split(";")[0] for row in rows]
+    return [utc for (utc,) in stored] == expected and not os.path.exists(
+        Sink.spool_path
+    )
+
+
+"""
+The following code sends the rows left in the spool file:
+python -m pysqm.dbsink -c config.py
+or checks the sink against a local SQLite database:
+python -m pysqm.dbsink --check
+"""
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default="config.py")
+    parser.add_argument("--check", action="store_true")
+    InputArguments = parser.parse_args()
+    settings.GlobalConfig.read_config_file(InputArguments.config)
+    import pysqm.dbsink
+
+    if InputArguments.check:
+        if not pysqm.dbsink.check():
+            print("Rows lost or duplicated")
+            sys.exit(1)
+        print("All rows stored once")
+    else:
+        Sink = pysqm.dbsink.DatabaseSink()
+        if not Sink.flush():
+            sys.exit(1)
+        Sink.disconnect()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+PySQM ephemerids cache
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+
+# Read configuration
+import pysqm.settings as settings
+
+if __name__ != "__main__":
+    config = settings.GlobalConfig.config
+
+    # Optional settings, for config files that predate them
+    try:
+        config._ephem_cache_file
+    except AttributeError:
+        config._ephem_cache_file = None
+    try:
+        config._ephem_cache_size
+    except AttributeError:
+        config._ephem_cache_size = 400
+
+
+class EphemCache(object):
+    """
+    Moon, twilight and night times only change once per night, so
+    they are computed once per (site, night, horizon) and kept here.
+    Least recently used entries are dropped beyond maxsize. With a
+    path, the cache is also kept in a JSON file, so a restart (or a
+    season computed ahead by precompute()) does not redo them.
+    Shared by the main loop and the plot thread, hence the lock.
+    """
+
+    def __init__(self, maxsize=None, path=None):
+        self.maxsize = config._ephem_cache_size if maxsize is None else maxsize
+        self.path = path
+        self.entries = OrderedDict()  # key -> dict of values
+        self.lock = threading.Lock()  # guards entries, changed and the file
+        self.changed = False
+        self.autosave = True  # save as soon as an entry is added
+        self.load()
+
+    def key(self, Observatory, kind, night, horizon):
+        """
+        Cache key of one kind of ephemerids for a site and night
+        """
+        return "%s %.6f %.6f %.1f %s %s" % (
+            kind,
+            float(Observatory.lat),
+            float(Observatory.lon),
+            float(Observatory.elev),
+            str(night),
+            str(horizon),
+        )
+
+    def get(self, key, compute):
+        """
+        Cached values for key, computing and storing them if missing.
+        compute returns a dict of floats and datetimes
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return dict(self.entries[key])
+
+        # Not under the lock, so a slow computation holds up nobody
+        values = compute()
+        self.put(key, values)
+        return values
+
+    def put(self, key, values):
+        """
+        Store the values of key, saving the cache file if autosave
+        """
+        with self.lock:
+            self.entries[key] = dict(values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.changed = True
+        if self.autosave:
+            self.save()
+
+    def load(self):
+        """
+        Read the cache file, if there is a usable one
+        """
+        if self.path is None:
+            return
+        try:
+            cache_file = open(self.path, "r")
+            saved = json.load(cache_file)
+            cache_file.close()
+        except (OSError, ValueError):
+            return
+        if not isinstance(saved, list):
+            return
+
+        with self.lock:
+            for entry in saved:
+                try:
+                    key, values = entry
+                    self.entries[key] = dict(
+                        (name, decode_value(value)) for name, value in values.items()
+                    )
+                except (TypeError, ValueError, AttributeError):
+                    continue  # malformed, computed again when needed
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        """
+        Write the cache file if anything was added. Written to a
+        temporary file first, so a crash never leaves half a cache
+        """
+        with self.lock:
+            if self.path is None or not self.changed:
+                return
+            saved = [
+                [key, dict((name, encode_value(v)) for name, v in values.items())]
+                for key, values in self.entries.items()
+            ]
+            tmp = self.path + ".tmp"
+            cache_file = open(tmp, "w")
+            json.dump(saved, cache_file)
+            cache_file.close()
+            os.replace(tmp, self.path)
+            self.changed = False
+
+
+def encode_value(value):
+    # datetimes as ISO strings, anything else (ephem angles) as float
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return float(value)
+
+
+def decode_value(value):
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+    return value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def ephem_cache():
+    """
+    The cache shared by the whole program
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EphemCache(path=config._ephem_cache_file)
+    return _cache
+
+
+def night_limits(Observatory, night, horizon):
+    """
+    Start and end (UTC datetimes) of the night of the given date: the
+    Sun's center going below horizon degrees and coming back up.
+    Raises ephem.CircumpolarError if it does not (polar day or night)
+    """
+    import ephem
+
+    def compute():
+        previous_horizon = Observatory.horizon
+        previous_date = Observatory.date
+        try:
+            Observatory.horizon = str(horizon)
+            # Local noon of that day
+            Observatory.date = ephem.date(
+                datetime(night.year, night.month, night.day, 12)
+                - timedelta(hours=config._local_timezone)
+            )
+            start = Observatory.next_setting(ephem.Sun(), use_center=True)
+            Observatory.date = start
+            end = Observatory.next_rising(ephem.Sun(), use_center=True)
+        finally:
+            Observatory.horizon = previous_horizon
+            Observatory.date = previous_date
+        return {
+            "start": start.datetime().replace(microsecond=0),
+            "end": end.datetime().replace(microsecond=0),
+        }
+
+    cache = ephem_cache()
+    key = cache.key(Observatory, "night", night, horizon)
+    limits = cache.get(key, compute)
+    return limits["start"], limits["end"]
+
+
+def precompute(first_night=None, nights=120):
+    """
+    Compute the moon, twilight and night times of a whole season
+    ahead, eg. before leaving a station without network access,
+    and save them in the cache file
+    """
+    import ephem
+    from pysqm.plot import Ephemerids
+
+    if first_night is None:
+        first_night = date.today()
+
+    cache = ephem_cache()
+    cache.autosave = False
+    Ephem = Ephemerids()
+    for k in range(nights):
+        night = first_night + timedelta(days=k)
+        Ephem.calculate_moon_ephems(thedate=night)
+        Ephem.calculate_twilight(thedate=night)
+        try:
+            night_limits(Ephem.Observatory, night, config._observatory_horizon)
+        except ephem.CircumpolarError:
+            pass  # no sunset or sunrise that night
+
+    cache.autosave = True
+    cache.save()
+
+
+"""
+The following code fills the cache file for the coming nights:
+python -m pysqm.ephemcache -c config.py
+"""
+if __name__ == "__main__":
+    InputArguments = settings.ArgParser()
+    settings.GlobalConfig.read_config_file(InputArguments.config)
+    import pysqm.ephemcache
+
+    print("Computing ephemerids of the next 120 nights ...")
+    pysqm.ephemcache.precompute()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+PySQM startup import budget
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import sys
+import subprocess
+
+# Modules that must not be loaded before the first measure
+DEFERRED = [
+    "matplotlib",
+    "numpy",
+    "ephem",
+    "_mysql",
+    "MySQLdb",
+    "pymysql",
+    "pysqm.plot",
+    "pysqm.email",
+]
+
+
+def measure(configfilename):
+    """
+    Import what pysqm.main imports before the first measure, in a
+    new interpreter with -X importtime. Returns the cumulative time
+    (seconds) of each top-level import and the set of modules loaded
+    """
+    code = (
+        "import pysqm.settings as settings\n"
+        "settings.GlobalConfig.read_config_file(%r)\n"
+        "config = settings.GlobalConfig.config\n"
+        # The modules pysqm.main imports, keep in step with it
+        "import pysqm.read\n"
+        "import pysqm.scheduler\n"
+        "import pysqm.sinks\n"
+        "if config._device_type.replace('_', '-') == 'SQM-LE':\n"
+        "    import socket\n"
+        "else:\n"
+        "    import serial\n"
+        # and the sinks of config._sinks, created before the first measure
+        "pysqm.sinks.load_sinks(None)\n" % os.path.abspath(configfilename)
+    )
+    package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [package_directory] + [environment.get("PYTHONPATH", "")]
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        env=environment,
+        universal_newlines=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError("Import failed:\n" + process.stderr)
+
+    # import time: self [us] | cumulative | imported package
+    toplevel = {}
+    loaded = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        loaded.add(name.strip())
+        if not name[1:].startswith(" "):
+            toplevel[name.strip()] = int(cumulative_us) / 1e6
+    return toplevel, loaded
+
+
+def check(configfilename, budget=1.0, show=10):
+    """
+    Print the slowest startup imports and check that they fit in
+    the budget (seconds) without loading any DEFERRED module.
+    Returns True if they do
+    """
+    toplevel, loaded = measure(configfilename)
+    total = sum(toplevel.values())
+
+    slowest = sorted(toplevel.items(), key=lambda item: item[1], reverse=True)
+    for name, seconds in slowest[:show]:
+        print("%8.3f s  %s" % (seconds, name))
+    print("%8.3f s  total (budget %.3f s)" % (total, budget))
+
+    early = [name for name in DEFERRED if name in loaded]
+    if early:
+        print("Loaded at startup, should be deferred: " + ", ".join(early))
+    return total <= budget and not early
+
+
+"""
+The following code checks the startup imports:
+python -m pysqm.importtime -c config.py [--budget SECONDS]
+"""
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default="config.py")
+    parser.add_argument("--budget", type=float, default=1.0)
+    InputArguments = parser.parse_args()
+    if not check(InputArguments.config, InputArguments.budget):
+        sys.exit(1)
@@ -43,22 +43,11 @@ settings.GlobalConfig.read_config_file(configfilename)
 config = settings.GlobalConfig.config
 
 ### Load now the rest of the modules
+### (pysqm.plot loads matplotlib, it is only imported when plotting;
+### keep pysqm.importtime in step with these imports)
 from pysqm.read import *
-import pysqm.plot
-
-'''
-This import section is only for software build purposes.
-Dont worry if some of these are missing in your setup.
-'''
-
-def relaxed_import(themodule):
-    try: exec('import '+str(themodule))
-    except: pass
-
-relaxed_import('socket')
-relaxed_import('serial')
-relaxed_import('_mysql')
-relaxed_import('pysqm.email')
+from pysqm.scheduler import MeasureClock
+from pysqm.sinks import Pipeline, load_sinks
 
 
 '''
@@ -72,8 +61,6 @@ if config._device_type == 'SQM-LE':
     import socket
 elif config._device_type == 'SQM-LU':
     import serial
-if config._use_mysql == True:
-    import _mysql
 
 
 # Create directories if needed
@@ -100,28 +87,34 @@ def loop():
     '''
     Ephem is used to calculate moon position (if above horizon)
     and to determine start-end times of the measures
+
+    Measures are taken on a fixed clock. Their outputs (config._sinks:
+    data files, MySQL, datacenter, plots ...) run in background
+    threads, each with its own queue, so a slow output does not
+    delay the next measure
     '''
     observ = define_ephem_observatory()
     niter = 0
     DaytimePrint=True
+    clock = MeasureClock(config._delay_between_measures)
+    config._send_to_datacenter = False ### Not enabled by default
+    outputs = Pipeline(load_sinks(mydevice))
     print('Starting readings ...')
     while 1<2:
         ''' The programs works as a daemon '''
         utcdt = mydevice.read_datetime()
         #print (str(mydevice.local_datetime(utcdt))),
         if mydevice.is_nighttime(observ):
-            # If we are in a new night, create the new file.
-            config._send_to_datacenter = False ### Not enabled by default
-            try:
-                assert(config._send_to_datacenter == True)
-                assert(niter == 0)
-                mydevice.save_data_datacenter("NEWFILE")
-            except: pass
+            # Wait for the next tick of the measures clock
+            missed = clock.wait()
+            if missed>0:
+                print(('Warning: '+str(missed)+' measures skipped (slow reading)'))
 
-            StartDateTime = datetime.datetime.now()
-            niter += 1
+            # If we are in a new night, start it in every output.
+            if niter == 0:
+                outputs.start_night()
 
-            mydevice.define_filenames()
+            niter += 1
 
             ''' Get values from the photometer '''
             try:
@@ -142,31 +135,12 @@ def loop():
                 timeutc_mean,timelocal_mean,temp_sensor,\
                 freq_sensor,ticks_uC,sky_brightness)
 
-            try:
-                assert(config._use_mysql == True)
-                mydevice.save_data_mysql(formatted_data)
-            except: pass
-
-            try:
-                assert(config._send_to_datacenter == True)
-                mydevice.save_data_datacenter(formatted_data)
-            except: pass
-
-            mydevice.data_cache(formatted_data,number_measures=config._cache_measures,niter=niter)
-
-            if niter%config._plot_each == 0:
-                ''' Each X minutes, plot a new graph '''
-                try: pysqm.plot.make_plot(send_emails=False,write_stats=False)
-                except:
-                    print('Warning: Error plotting data.')
-                    print((sys.exc_info()))
+            ''' Hand the measure to the outputs '''
+            outputs.measure(formatted_data)
 
             if DaytimePrint==False:
                 DaytimePrint=True
 
-            MainDeltaSeconds = (datetime.datetime.now()-StartDateTime).total_seconds()
-            time.sleep(max(1,config._delay_between_measures-MainDeltaSeconds))
-
         else:
             ''' Daytime, print info '''
             if DaytimePrint==True:
@@ -175,27 +149,11 @@ def loop():
                 print(('. Daytime. Waiting until '+str(mydevice.next_sunset(observ))))
                 DaytimePrint=False
             if niter>0:
-                mydevice.flush_cache()
-                if config._send_data_by_email==True:
-                    try: pysqm.plot.make_plot(send_emails=True,write_stats=True)
-                    except:
-                        print('Warning: Error plotting data / sending email.')
-                        print((sys.exc_info()))
-
-                else:
-                    try: pysqm.plot.make_plot(send_emails=False,write_stats=True)
-                    except:
-                        print('Warning: Error plotting data.')
-                        print((sys.exc_info()))
-
+                # Close the night once the outputs have all its measures
+                outputs.end_night()
+                outputs.report()
+                clock.reset()
                 niter = 0
 
-            # Send data that is still in the datacenter buffer
-            try:
-                assert(config._send_to_datacenter == True)
-                mydevice.save_data_datacenter("")
-            except: pass
-
-            time.sleep(300)
-
-
+            # Wake up when the night starts
+            mydevice.sleep_until_night(observ)
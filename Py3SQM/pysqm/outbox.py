@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+"""
+PySQM datacenter outbox
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import time
+import socket
+
+# Read configuration
+import pysqm.settings as settings
+
+if __name__ != "__main__":
+    config = settings.GlobalConfig.config
+
+    # Optional settings, for config files that predate them
+    try:
+        config._datacenter_outbox
+    except AttributeError:
+        config._datacenter_outbox = None  # in the current data directory
+    try:
+        config._datacenter_outbox_size
+    except AttributeError:
+        config._datacenter_outbox_size = 8 * 1024 * 1024
+
+
+class Outbox(object):
+    """
+    Messages waiting to be sent, kept on disk so they survive a
+    restart. Messages (one line each) are appended to numbered
+    segment files; the position up to which the datacenter has them
+    is kept in a separate file, and written only after a successful
+    send. Fully sent segments are removed.
+
+    Once max_bytes are waiting, new messages are refused (as the old
+    in-memory buffer did beyond 10000 lines).
+    """
+
+    def __init__(self, directory=None, segment_size=1024 * 1024, max_bytes=None):
+        if directory is None:
+            directory = config._datacenter_outbox
+        if directory is None:
+            directory = os.path.join(config.current_data_directory, "Outbox")
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.segment_size = segment_size
+        if max_bytes is None:
+            max_bytes = config._datacenter_outbox_size
+        self.max_bytes = max_bytes
+        self.segment_file = None  # segment being appended to
+
+        self.committed = self.read_pointer()
+        segments = self.segments()
+        if segments:
+            self.repair(segments[-1])
+        self.size = self.waiting()
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, "%08d.out" % segment)
+
+    def segments(self):
+        # Numbers of the segment files not fully sent, in order
+        return sorted(
+            int(name[:-4])
+            for name in os.listdir(self.directory)
+            if name.endswith(".out") and int(name[:-4]) >= self.committed[0]
+        )
+
+    def read_pointer(self):
+        # (segment, byte offset) of the first message not sent yet
+        try:
+            pointer_file = open(os.path.join(self.directory, "committed"), "r")
+            segment, offset = [int(value) for value in pointer_file.read().split()]
+            pointer_file.close()
+        except (OSError, ValueError):
+            return (0, 0)
+        return (segment, offset)
+
+    def waiting(self):
+        # Bytes appended and not sent yet
+        size = 0
+        for segment in self.segments():
+            size += os.path.getsize(self.segment_path(segment))
+            if segment == self.committed[0]:
+                size -= self.committed[1]
+        return size
+
+    def repair(self, segment):
+        # Drop a message left half written by a crash
+        path = self.segment_path(segment)
+        segment_file = open(path, "rb+")
+        content = segment_file.read()
+        end = content.rfind(b"\n") + 1
+        if end < len(content):
+            segment_file.truncate(end)
+        segment_file.close()
+
+    def append(self, message):
+        """
+        Add a message (without line breaks but the final one).
+        Returns False if the outbox is full and it was dropped
+        """
+        data = (message.rstrip("\n") + "\n").encode()
+        if self.size + len(data) > self.max_bytes:
+            return False
+
+        if self.segment_file is None or self.segment_file.tell() >= self.segment_size:
+            self.close()
+            segments = self.segments()
+            segment = segments[-1] if segments else self.committed[0]
+            path = self.segment_path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_size:
+                segment += 1
+            self.segment_file = open(self.segment_path(segment), "ab")
+
+        self.segment_file.write(data)
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        self.size += len(data)
+        return True
+
+    def read(self, limit):
+        """
+        Up to limit messages not sent yet, and the position after
+        them (to be committed once they are sent)
+        """
+        messages = []
+        segment, offset = self.committed
+        segments = self.segments()
+        for number in segments:
+            if number != segment:
+                segment, offset = number, 0
+            segment_file = open(self.segment_path(segment), "rb")
+            segment_file.seek(offset)
+            for line in segment_file:
+                if len(messages) == limit:
+                    break
+                messages.append(line)
+                offset += len(line)
+            segment_file.close()
+            if len(messages) == limit:
+                break
+        return messages, (segment, offset)
+
+    def commit(self, position):
+        """
+        Mark the messages before position as sent
+        """
+        tmp = os.path.join(self.directory, "committed.tmp")
+        pointer_file = open(tmp, "w")
+        pointer_file.write("%d %d\n" % position)
+        pointer_file.flush()
+        os.fsync(pointer_file.fileno())
+        pointer_file.close()
+        os.replace(tmp, os.path.join(self.directory, "committed"))
+
+        for segment in self.segments():
+            if segment < position[0]:
+                os.remove(self.segment_path(segment))
+        self.committed = position
+        self.size = self.waiting()
+
+    def close(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+
+
+class Sender(object):
+    """
+    Sends the outbox to the datacenter, many messages per connection.
+    After a failure the next attempts are spaced out (up to
+    max_delay seconds), and each call sends at most max_batches
+    batches, so a long backlog does not hold up the measures.
+    """
+
+    def __init__(
+        self, host, port, batch_size=500, max_batches=10, timeout=10, max_delay=600
+    ):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self.delay = 0
+        self.retry_at = 0
+
+    def ship(self, messages):
+        # One connection for a whole batch
+        client = socket.create_connection((self.host, self.port), self.timeout)
+        try:
+            client.sendall(b"".join(messages))
+            client.shutdown(socket.SHUT_RDWR)
+        finally:
+            client.close()
+
+    def send(self, Outbox):
+        """
+        Send what is waiting in the outbox. Returns True if it is
+        empty afterwards
+        """
+        if time.time() < self.retry_at:
+            return False
+
+        for batch in range(self.max_batches):
+            messages, position = Outbox.read(self.batch_size)
+            if len(messages) == 0:
+                return True
+            try:
+                self.ship(messages)
+            except OSError:
+                self.delay = min(self.max_delay, max(30, 2 * self.delay))
+                self.retry_at = time.time() + self.delay
+                return False
+            Outbox.commit(position)
+            self.delay = 0
+
+        return len(Outbox.read(1)[0]) == 0
+
+
+def check(directory=None):
+    """
+    Send through a local TCP stand-in for the datacenter, with an
+    outage and a restart in the middle. Returns True if every
+    message arrives, in order
+    """
+    import tempfile
+    import threading
+    import socketserver
+
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    received = []
+
+    class Datacenter(socketserver.StreamRequestHandler):
+        def handle(self):
+            received.extend(line.decode() for line in self.rfile)
+
+    # A free port, nobody listening on it yet
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    host, port = probe.getsockname()
+    probe.close()
+
+    messages = ["DEV;;D;;%d;line %d\n" % (k, k) for k in range(2000)]
+    Box = Outbox(directory, segment_size=4096, max_bytes=1024 * 1024)
+    MySender = Sender(host, port, batch_size=100, max_batches=3)
+
+    # Datacenter down: everything stays in the outbox
+    for message in messages[:1200]:
+        Box.append(message)
+    if MySender.send(Box) or len(received) > 0:
+        return False
+
+    socketserver.TCPServer.allow_reuse_address = True
+    server = socketserver.TCPServer((host, port), Datacenter)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    # Up again: a few batches go, then the program "crashes"
+    MySender.retry_at = 0
+    MySender.send(Box)
+    Box.close()
+
+    # Restart: the rest is replayed from disk
+    Box = Outbox(directory, segment_size=4096, max_bytes=1024 * 1024)
+    MySender = Sender(host, port, batch_size=100, max_batches=100)
+    for message in messages[1200:]:
+        Box.append(message)
+    done = MySender.send(Box)
+    Box.close()
+
+    # Let the server read the last connection
+    time.sleep(0.5)
+    server.shutdown()
+    server.server_close()
+    left = [name for name in os.listdir(directory) if name.endswith(".out")]
+    return done and received == messages and len(left) <= 1
+
+
+"""
+The following code checks the outbox against a local datacenter:
+python -m pysqm.outbox -c config.py
+"""
+if __name__ == "__main__":
+    InputArguments = settings.ArgParser()
+    settings.GlobalConfig.read_config_file(InputArguments.config)
+    import pysqm.outbox
+
+    if not pysqm.outbox.check():
+        print("Messages lost, duplicated or out of order")
+        raise SystemExit(1)
+    print("All messages delivered in order")
@@ -78,7 +78,16 @@ class Ephemerids(object):
         return newdatetime
 
     def calculate_moon_ephems(self, thedate):
-        # Moon ephemerids
+        # Moon ephemerids, computed once per night and site
+        from pysqm.ephemcache import ephem_cache
+
+        cache = ephem_cache()
+        key = cache.key(self.Observatory, "moon", thedate, 0)
+        self.__dict__.update(
+            cache.get(key, lambda: self.compute_moon_ephems(thedate))
+        )
+
+    def compute_moon_ephems(self, thedate):
         self.Observatory.horizon = "0"
         self.Observatory.date = str(self.end_of_the_day(thedate))
 
@@ -120,6 +129,18 @@ class Ephemerids(object):
             self.Observatory.next_setting(ephem.Moon())
         )
 
+        return dict(
+            (name, getattr(self, name))
+            for name in [
+                "moon_phase",
+                "moon_maxelev",
+                "moon_prev_rise",
+                "moon_prev_set",
+                "moon_next_rise",
+                "moon_next_set",
+            ]
+        )
+
     def calculate_twilight(self, thedate, twilight=-18):
         """
         Changing the horizon forces ephem to
@@ -127,7 +148,17 @@ class Ephemerids(object):
         -6: civil,
         -12: nautical,
         -18: astronomical,
+        Computed once per night, site and twilight.
         """
+        from pysqm.ephemcache import ephem_cache
+
+        cache = ephem_cache()
+        key = cache.key(self.Observatory, "twilight", thedate, twilight)
+        self.__dict__.update(
+            cache.get(key, lambda: self.compute_twilight(thedate, twilight))
+        )
+
+    def compute_twilight(self, thedate, twilight):
         self.Observatory.horizon = str(twilight)
         self.Observatory.date = str(self.end_of_the_day(thedate))
 
@@ -144,6 +175,16 @@ class Ephemerids(object):
             self.Observatory.next_setting(ephem.Sun(), use_center=True)
         )
 
+        return dict(
+            (name, getattr(self, name))
+            for name in [
+                "twilight_prev_rise",
+                "twilight_prev_set",
+                "twilight_next_rise",
+                "twilight_next_set",
+            ]
+        )
+
 
 class SQMData(object):
     # Split pre and after-midnight data
@@ -245,6 +286,7 @@ class SQMData(object):
 
     def process_rawdata(self, Ephem):
         from pysqm.common import format_value_list
+        from pysqm.sun import sun_altitude
 
         """
         Get the important information from the raw_data
@@ -252,6 +294,13 @@ class SQMData(object):
         """
         self.raw_data = format_value_list(self.raw_data)
 
+        # Sun altitude of every row at once, instead of an ephem.Sun per row
+        sun_altitudes = sun_altitude(
+            np.array([line[0] for line in self.raw_data], dtype="datetime64[ms]"),
+            float(Ephem.Observatory.lat),
+            float(Ephem.Observatory.lon),
+        )
+
         for k, line in enumerate(self.raw_data):
             # DateTime extraction
             utcdatetime = self.process_datetimes(line[0])
@@ -262,9 +311,6 @@ class SQMData(object):
             if calc_localdatetime != localdatetime:
                 return 1
 
-            # Set the datetime for astronomical calculations.
-            Ephem.Observatory.date = ephem.date(utcdatetime)
-
             # Date in str format: 20130115
             label_date = str(localdatetime.date()).replace("-", "")
 
@@ -282,9 +328,6 @@ class SQMData(object):
                 config._plot_corrected_data = False
             if config._plot_corrected_data:
                 night_sb += config._plot_corrected_data * config._offset_calibration
-            # Define sun in pyephem
-            Sun = ephem.Sun(Ephem.Observatory)
-
             self.premidnight.label_date = []
             self.aftermidnight.label_dates = []
 
@@ -295,7 +338,7 @@ class SQMData(object):
                 self.premidnight.tick_counts.append(tick_counts)
                 self.premidnight.frequencies.append(frequency)
                 self.premidnight.night_sbs.append(night_sb)
-                self.premidnight.sun_altitude.append(Sun.alt)
+                self.premidnight.sun_altitude.append(sun_altitudes[k])
                 if label_date not in self.premidnight.label_dates:
                     self.premidnight.label_dates.append(label_date)
             else:
@@ -305,7 +348,7 @@ class SQMData(object):
                 self.aftermidnight.tick_counts.append(tick_counts)
                 self.aftermidnight.frequencies.append(frequency)
                 self.aftermidnight.night_sbs.append(night_sb)
-                self.aftermidnight.sun_altitude.append(Sun.alt)
+                self.aftermidnight.sun_altitude.append(sun_altitudes[k])
                 if label_date not in self.aftermidnight.label_dates:
                     self.aftermidnight.label_dates.append(label_date)
 
@@ -434,9 +477,148 @@ class SQMData(object):
         Stat.max_temperature = np.max(self.astronomical_night_temp)
 
 
+class GrowingArray(object):
+    """
+    NumPy array with spare capacity at the end, so appending k values
+    costs O(k) (amortized) instead of copying everything read so far
+    """
+
+    def __init__(self, capacity=1024):
+        self.data = np.empty(capacity)
+        self.size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=float)
+        needed = self.size + np.size(values)
+        if needed > np.size(self.data):
+            grown = np.empty(max(needed, 2 * np.size(self.data)))
+            grown[: self.size] = self.data[: self.size]
+            self.data = grown
+        self.data[self.size : needed] = values
+        self.size = needed
+
+    def view(self):
+        return self.data[: self.size]
+
+
+class IncrementalSQMData(SQMData):
+    """
+    Long-lived SQMData for the night in progress. update() reads only
+    the rows appended to the file since the last call, so plotting
+    every few measures costs O(new rows) instead of O(night).
+    """
+
+    def __init__(self, filename, Ephem):
+        self.filename = filename
+        self.reset()
+        self.update(Ephem)
+
+    def reset(self):
+        """
+        Forget everything read, eg. when the file is replaced
+        by the one for a new night
+        """
+        self.offset = 0  # bytes of the file already read
+        self.file_id = None
+        self.partial = b""  # incomplete last line
+        self.serial_number = None
+        self.Night = None
+        self.all_night_sb = []
+        self.all_night_dt = []
+        self.all_night_temp = []
+
+        # Per-instance containers, the class-level ones are shared
+        self.premidnight = SQMData.premidnight()
+        self.aftermidnight = SQMData.aftermidnight()
+        self.Statistics = SQMData.Statistics()
+        for variable in [
+            "utcdates",
+            "localdates",
+            "sun_altitudes",
+            "temperatures",
+            "tick_counts",
+            "frequencies",
+            "night_sbs",
+            "label_dates",
+            "sun_altitude",
+        ]:
+            setattr(self.premidnight, variable, [])
+            setattr(self.aftermidnight, variable, [])
+
+        # Plot-ready copies, grown in place
+        for part in [self.premidnight, self.aftermidnight]:
+            part.series = {
+                "localdates": GrowingArray(),
+                "sun_altitude": GrowingArray(),
+                "night_sbs": GrowingArray(),
+            }
+
+    def update(self, Ephem):
+        """
+        Read the rows appended since the last call.
+        Returns the number of new rows, or None if the file was
+        replaced and everything was read again
+        """
+        from pysqm.common import format_value
+
+        st = os.stat(self.filename)
+        file_id = (st.st_dev, st.st_ino)
+        replaced = self.file_id is not None and (
+            file_id != self.file_id or st.st_size < self.offset
+        )
+        if replaced:
+            self.reset()
+        self.file_id = file_id
+        if st.st_size == self.offset:
+            return None if replaced else 0
+
+        sqm_file = open(self.filename, "rb")
+        sqm_file.seek(self.offset)
+        chunk = self.partial + sqm_file.read()
+        sqm_file.close()
+        self.offset += len(chunk) - len(self.partial)
+
+        # Keep an incomplete last line for the next call
+        cut = chunk.rfind(b"\n") + 1
+        self.partial = chunk[cut:]
+        lines = chunk[:cut].decode("utf-8", errors="replace").splitlines(True)
+
+        if self.serial_number is None:
+            serial_number_lines = [
+                line
+                for line in lines
+                if format_value(line)[:1] == "#" and "SQM serial number:" in line
+            ]
+            if serial_number_lines:
+                self.serial_number = format_value(
+                    serial_number_lines[0].split(":")[-1]
+                )
+
+        # Parse and locate only the new rows
+        counts = [
+            np.size(self.premidnight.localdates),
+            np.size(self.aftermidnight.localdates),
+        ]
+        self.raw_data = [line for line in lines if self.check_validdata(line) == True]
+        new_rows = len(self.raw_data)
+        self.process_rawdata(Ephem)
+        self.raw_data = []
+
+        for part, n in zip([self.premidnight, self.aftermidnight], counts):
+            part.series["localdates"].extend(mdates.date2num(part.localdates[n:]))
+            part.series["sun_altitude"].extend(part.sun_altitude[n:])
+            part.series["night_sbs"].extend(part.night_sbs[n:])
+
+        if self.Night is None:
+            self.check_number_of_nights()
+
+        return None if replaced else new_rows
+
+
 class Plot(object):
     def __init__(self, Data, Ephem):
-        plt.clf()  # plt.hold(True/False) is deprecated
+        # Drawn on a figure of its own (see make_figure), the night plot
+        # may be open meanwhile
         Data = self.prepare_plot(Data, Ephem)
 
         try:
@@ -625,7 +807,7 @@ class Plot(object):
             self.make_subplot_time(twinplot=2)
 
         # Adjust the space between plots
-        plt.subplots_adjust(hspace=0.35)
+        self.thefigure.subplots_adjust(hspace=0.35)
 
     def prepare_plot(self, Data, Ephem):
         """
@@ -780,37 +962,12 @@ class Plot(object):
         )
 
         # Set the xlimit for the time plot.
-        if np.size(Data.premidnight.filter) > 0:
-            begin_plot_dt = Data.premidnight.localdates[-1]
-            begin_plot_dt = datetime(
-                begin_plot_dt.year,
-                begin_plot_dt.month,
-                begin_plot_dt.day,
-                config.limits_time[0],
-                0,
-                0,
-            )
-            end_plot_dt = begin_plot_dt + timedelta(
-                hours=24 + config.limits_time[1] - config.limits_time[0]
-            )
-        elif np.size(Data.aftermidnight.filter) > 0:
-            end_plot_dt = Data.aftermidnight.localdates[-1]
-            end_plot_dt = datetime(
-                end_plot_dt.year,
-                end_plot_dt.month,
-                end_plot_dt.day,
-                config.limits_time[1],
-                0,
-                0,
-            )
-            begin_plot_dt = end_plot_dt - timedelta(
-                hours=24 + config.limits_time[1] - config.limits_time[0]
-            )
-        else:
+        limits = self.time_limits(Data)
+        if limits is None:
             print("Warning: Cannot calculate plot limits")
             return None
 
-        self.thegraph_time.set_xlim(begin_plot_dt, end_plot_dt)
+        self.thegraph_time.set_xlim(*limits)
         self.thegraph_time.set_ylim(config.limits_nsb)
 
         premidnight_label = (
@@ -852,6 +1009,41 @@ class Plot(object):
                 transform=self.thegraph_time.transAxes,
             )
 
+    def time_limits(self, Data):
+        """
+        Time range of the night, from config.limits_time
+        """
+        if np.size(Data.premidnight.localdates) > 0:
+            begin_plot_dt = Data.premidnight.localdates[-1]
+            begin_plot_dt = datetime(
+                begin_plot_dt.year,
+                begin_plot_dt.month,
+                begin_plot_dt.day,
+                config.limits_time[0],
+                0,
+                0,
+            )
+            end_plot_dt = begin_plot_dt + timedelta(
+                hours=24 + config.limits_time[1] - config.limits_time[0]
+            )
+        elif np.size(Data.aftermidnight.localdates) > 0:
+            end_plot_dt = Data.aftermidnight.localdates[-1]
+            end_plot_dt = datetime(
+                end_plot_dt.year,
+                end_plot_dt.month,
+                end_plot_dt.day,
+                config.limits_time[1],
+                0,
+                0,
+            )
+            begin_plot_dt = end_plot_dt - timedelta(
+                hours=24 + config.limits_time[1] - config.limits_time[0]
+            )
+        else:
+            return None
+
+        return begin_plot_dt, end_plot_dt
+
     def save_figure(self, output_filename):
         self.thefigure.savefig(output_filename, bbox_inches="tight", dpi=150)
 
@@ -859,19 +1051,194 @@ class Plot(object):
         plt.show(self.thefigure)
 
     def close_figure(self):
-        plt.close("all")
+        # Other plots may still be open
+        plt.close(self.thefigure)
 
 
-def save_stats_to_file(Night, NSBData, Ephem):
-    from pysqm.common import set_decimals
+class IncrementalPlot(Plot):
+    """
+    Plot of the night in progress. The figure is drawn once per night
+    with empty lines; refresh() then just gives the lines the arrays
+    of an IncrementalSQMData, instead of drawing everything again.
+    """
+
+    def __init__(self, Data, Ephem):
+        self.lines = {}
+        self.labels = []
+        Plot.__init__(self, Data, Ephem)
+        self.refresh(Data)
+
+    def prepare_plot(self, Data, Ephem):
+        # The current data file only holds the night in progress
+        return Data
+
+    def plot_data_sunalt(self, Data, Ephem):
+        """
+        Empty NSB vs Sun altitude lines, and the static parts of the graph
+        """
+        self.lines["sunalt"] = [
+            self.thegraph_sunalt.plot([], [], color="#2ca02c")[0],
+            self.thegraph_sunalt.plot([], [], color="#1f77b4")[0],
+        ]
+
+        self.thegraph_sunalt.set_xlim(
+            [
+                config.limits_sunalt[0] * np.pi / 180.0,
+                config.limits_sunalt[1] * np.pi / 180.0,
+            ]
+        )
+        self.thegraph_sunalt.set_ylim(config.limits_nsb)
+
+        self.thegraph_sunalt.text(
+            0.00,
+            1.015,
+            config._device_shorttype
+            + "-"
+            + config._observatory_name
+            + " " * 5
+            + "Serial #"
+            + str(Data.serial_number),
+            color="0.25",
+            fontsize="small",
+            fontname="monospace",
+            transform=self.thegraph_sunalt.transAxes,
+        )
+
+        # Filled in by refresh()
+        self.labels = [
+            self.thegraph_sunalt.text(
+                0.75,
+                0.92,
+                "",
+                color="#2ca02c",
+                fontsize="small",
+                transform=self.thegraph_sunalt.transAxes,
+            ),
+            self.thegraph_sunalt.text(
+                0.75,
+                0.84,
+                "",
+                color="#1f77b4",
+                fontsize="small",
+                transform=self.thegraph_sunalt.transAxes,
+            ),
+        ]
+
+    def plot_data_time(self, Data, Ephem):
+        """
+        Empty NSB vs time lines, and the static parts of the graph
+        """
+        # Lines get matplotlib date numbers, not datetimes
+        self.thegraph_time.xaxis_date()
+        self.lines["time"] = [
+            self.thegraph_time.plot([], [], color="#2ca02c")[0],
+            self.thegraph_time.plot([], [], color="#1f77b4")[0],
+        ]
+
+        # Vertical line to mark 0h
+        self.thegraph_time.axvline(
+            Data.Night + timedelta(days=1),
+            color="black",
+            alpha=0.75,
+            lw=1,
+            ls="solid",
+            clip_on=True,
+        )
+        self.thegraph_time.set_ylim(config.limits_nsb)
+
+        self.thegraph_time.text(
+            0.00,
+            1.015,
+            config._device_shorttype
+            + "-"
+            + config._observatory_name
+            + " " * 5
+            + "Serial #"
+            + str(Data.serial_number),
+            color="0.25",
+            fontsize="small",
+            fontname="monospace",
+            transform=self.thegraph_time.transAxes,
+        )
+
+        self.thegraph_time.text(
+            0.75,
+            1.015,
+            "Moon: %d%s (%d%s)"
+            % (
+                Ephem.moon_phase,
+                "%",
+                Ephem.moon_maxelev * 180.0 / np.pi,
+                "$^\mathbf{o}$",
+            ),
+            color="black",
+            fontsize="small",
+            fontname="monospace",
+            transform=self.thegraph_time.transAxes,
+        )
+
+    def refresh(self, Data):
+        """
+        Show the data read so far. Costs O(1) besides matplotlib's own
+        drawing: the lines share the arrays of Data
+        """
+        for k, TheData in enumerate([Data.premidnight, Data.aftermidnight]):
+            night_sbs = TheData.series["night_sbs"].view()
+            self.lines["time"][k].set_data(
+                TheData.series["localdates"].view(), night_sbs
+            )
+            if "sunalt" in self.lines:
+                self.lines["sunalt"][k].set_data(
+                    TheData.series["sun_altitude"].view(), night_sbs
+                )
+
+        if self.labels:
+            self.labels[0].set_text(
+                "PM: "
+                + str(Data.premidnight.label_dates).replace("[", "").replace("]", "")
+            )
+            self.labels[1].set_text(
+                "AM: "
+                + str(Data.aftermidnight.label_dates).replace("[", "").replace("]", "")
+            )
 
+        limits = self.time_limits(Data)
+        if limits is not None:
+            self.thegraph_time.set_xlim(*limits)
+
+
+class TemplatePlot(Plot):
     """
-    Save statistics to file
+    Plot that keeps its figure and axes (titles, labels, tick
+    formatters) from one night to the next and only replaces the
+    data, moon and twilight artists. Used to render many nights in a row
     """
 
-    Stat = NSBData.Statistics
+    def __init__(self):
+        try:
+            config.full_plot
+        except:
+            config.full_plot = False
+        self.make_figure(thegraph_altsun=config.full_plot, thegraph_time=True)
+
+    def draw(self, Data, Ephem):
+        for axis in self.thefigure.axes:
+            for artist in list(axis.lines) + list(axis.patches) + list(axis.texts):
+                artist.remove()
 
-    Header = (
+        Data = self.prepare_plot(Data, Ephem)
+        if config.full_plot:
+            self.plot_data_sunalt(Data, Ephem)
+        self.plot_data_time(Data, Ephem)
+        self.plot_moonphase(Ephem)
+        self.plot_twilight(Ephem)
+
+
+def stats_header():
+    """
+    Header of the statistics file
+    """
+    return (
         "# Summary statistics for "
         + str(config._device_shorttype + "_" + config._observatory_name)
         + "\n"
@@ -888,7 +1255,14 @@ def save_stats_to_file(Night, NSBData, Ephem):
     )
     #'# Col 6: Number of terms of the low-freq fourier model\n'+\
 
-    formatted_data = (
+
+def format_stats(Night, Stat):
+    """
+    Line of the statistics file for one night
+    """
+    from pysqm.common import set_decimals
+
+    return (
         str(Night)
         + ";"
         + str(Stat.number)
@@ -909,69 +1283,73 @@ def save_stats_to_file(Night, NSBData, Ephem):
         + "\n"
     )
 
-    statistics_filename = (
+
+def stats_filename():
+    """
+    Statistics file of this device and observatory
+    """
+    return (
         config.summary_data_directory
         + "/Statistics_"
         + str(config._device_shorttype + "_" + config._observatory_name)
         + ".dat"
     )
 
-    print("Writing statistics file")
-
-    def safe_create_file(filename):
-        if not os.path.exists(filename):
-            open(filename, "w").close()
-
-    def read_file(filename):
-        thefile = open(filename, "r")
-        content = thefile.read()
-        thefile.close()
-        return content
 
-    def write_file(filename, content):
-        thefile = open(filename, "w")
-        thefile.write(content)
-        thefile.close()
-
-    def append_file(filename, content):
-        thefile = open(filename, "a")
-        thefile.write(content)
-        thefile.close()
+def save_stats_to_file(Night, NSBData, Ephem):
+    """
+    Save statistics to the statistics store, replacing any previous
+    statistics of that night. The statistics file is exported from
+    it by python -m pysqm.statsdb, or here if config._statistics_csv
+    """
+    from pysqm.statsdb import StatsStore
 
-    # Create file if not exists
-    safe_create_file(statistics_filename)
+    print("Writing statistics file")
 
-    # Read the content
-    stat_file_content = read_file(statistics_filename)
+    Store = StatsStore()
+    Store.upsert(Night, NSBData.Statistics)
+    if config._statistics_csv:
+        Store.export_csv()
+    Store.close()
 
-    # If the file doesnt have a proper header, add it to the beginning
 
-    def valid_line(line):
-        if "#" in line:
-            return False
-        elif line.replace(" ", "") == "":
-            return False
-        else:
-            return True
+def current_data_filename():
+    """
+    Data file of the night in progress
+    """
+    return (
+        config.current_data_directory
+        + "/"
+        + config._device_shorttype
+        + "_"
+        + config._observatory_name
+        + ".dat"
+    )
 
-    if Header not in stat_file_content:
-        stat_file_content = [
-            line for line in stat_file_content.split("\n") if valid_line(line)
-        ]
-        stat_file_content = "\n".join(stat_file_content)
-        stat_file_content = Header + stat_file_content
-        write_file(statistics_filename, stat_file_content)
-
-    # Remove any previous statistic for the given Night in the file
-    if str(Night) in stat_file_content:
-        stat_file_content = [
-            line for line in stat_file_content.split("\n") if str(Night) not in line
-        ]
-        stat_file_content = "\n".join(stat_file_content)
-        write_file(statistics_filename, stat_file_content)
 
-    # Append to the end of the file
-    append_file(statistics_filename, formatted_data)
+def output_filenames(Night):
+    """
+    Where to save the plot of a night
+    """
+    return [
+        str(
+            "%s/%s_%s.png"
+            % (
+                config.current_data_directory,
+                config._device_shorttype,
+                config._observatory_name,
+            )
+        ),
+        str(
+            "%s/%s_120000_%s-%s.png"
+            % (
+                config.daily_graph_directory,
+                str(Night).replace("-", ""),
+                config._device_shorttype,
+                config._observatory_name,
+            )
+        ),
+    ]
 
 
 def make_plot(input_filename=None, send_emails=False, write_stats=False):
@@ -987,14 +1365,7 @@ def make_plot(input_filename=None, send_emails=False, write_stats=False):
     print("Plotting photometer data ...")
 
     if input_filename is None:
-        input_filename = (
-            config.current_data_directory
-            + "/"
-            + config._device_shorttype
-            + "_"
-            + config._observatory_name
-            + ".dat"
-        )
+        input_filename = current_data_filename()
 
     # Define the observatory in ephem
     Ephem = Ephemerids()
@@ -1016,27 +1387,7 @@ def make_plot(input_filename=None, send_emails=False, write_stats=False):
     # Plot the data and save the resulting figure
     NSBPlot = Plot(NSBData, Ephem)
 
-    output_filenames = [
-        str(
-            "%s/%s_%s.png"
-            % (
-                config.current_data_directory,
-                config._device_shorttype,
-                config._observatory_name,
-            )
-        ),
-        str(
-            "%s/%s_120000_%s-%s.png"
-            % (
-                config.daily_graph_directory,
-                str(NSBData.Night).replace("-", ""),
-                config._device_shorttype,
-                config._observatory_name,
-            )
-        ),
-    ]
-
-    for output_filename in output_filenames:
+    for output_filename in output_filenames(NSBData.Night):
         NSBPlot.save_figure(output_filename)
 
     # Close figure
@@ -1049,6 +1400,63 @@ def make_plot(input_filename=None, send_emails=False, write_stats=False):
         pysqm.email.send_emails(night_label=night_label, Stat=NSBData.Statistics)
 
 
+class NightPlotter(object):
+    """
+    Plots the night in progress every few measures. Keeps the data,
+    ephemerids and figure between calls, so each update only reads
+    and processes the rows measured since the previous one. A new
+    night (the current data file is replaced) starts everything again.
+    """
+
+    def __init__(self, input_filename=None):
+        if input_filename is None:
+            input_filename = current_data_filename()
+        self.input_filename = input_filename
+        self.NSBData = None
+        self.NSBPlot = None
+
+    def start_night(self):
+        """
+        Read the whole file and draw a new figure
+        """
+        if self.NSBPlot is not None:
+            self.NSBPlot.close_figure()
+            self.NSBPlot = None
+
+        self.Ephem = Ephemerids()
+        self.NSBData = IncrementalSQMData(self.input_filename, self.Ephem)
+        if self.NSBData.Night is None:
+            # Only the header so far
+            self.NSBData = None
+            return
+
+        # Moon and twilight ephemerids, once per night
+        self.Ephem.calculate_moon_ephems(thedate=self.NSBData.Night)
+        self.Ephem.calculate_twilight(thedate=self.NSBData.Night)
+        self.NSBPlot = IncrementalPlot(self.NSBData, self.Ephem)
+
+    def update(self):
+        print("Plotting photometer data ...")
+
+        if self.NSBData is None:
+            self.start_night()
+        else:
+            Night = self.NSBData.Night
+            new_rows = self.NSBData.update(self.Ephem)
+            if new_rows is None or self.NSBData.Night != Night:
+                self.start_night()
+            elif new_rows == 0:
+                return
+            else:
+                self.NSBPlot.refresh(self.NSBData)
+
+        if self.NSBPlot is None:
+            return
+
+        for output_filename in output_filenames(self.NSBData.Night):
+            self.NSBPlot.save_figure(output_filename)
+
+
 """
 The following code allows to execute plot.py as a standalone program.
 """
@@ -25,10 +25,8 @@ ____________________________
 '''
 
 import os,sys
-import inspect
 import time
 import datetime
-import numpy as np
 import struct
 import socket
 
@@ -38,19 +36,11 @@ _meta_len_ = None
 _data_len_ = None
 
 from pysqm.common import *
+from pysqm.writer import DataWriter
 
-'''
-This import section is only for software build purposes.
-Dont worry if some of these are missing in your setup.
-'''
-
-def relaxed_import(themodule):
-    try: exec('import '+str(themodule))
-    except: pass
-
-relaxed_import('serial')
-relaxed_import('_mysql')
-relaxed_import('pysqm.email')
+# Only needed once measures are taken (or errors reported)
+np = lazy_import('numpy')
+inspect = lazy_import('inspect')
 
 '''
 Read configuration
@@ -63,6 +53,12 @@ try:
 except:
     DEBUG=False
 
+# Optional settings, for config files that predate them
+try:
+    config._streaming_mean
+except AttributeError:
+    config._streaming_mean = False
+
 '''
 Conditional imports
 '''
@@ -74,40 +70,103 @@ if config._device_type == 'SQM-LE':
     import socket
 elif config._device_type == 'SQM-LU':
     import serial
-if config._use_mysql == True:
-    import _mysql
 
 
-def filtered_mean(array,sigma=3):
+def clip_ranges(samples,sigma=3):
     # Our data probably contains outliers, filter them
     # Notes:
     #   Median is more robust than mean
     #    Std increases if the outliers are far away from real values.
     #    We need to limit the amount of discrepancy we want in the data (20%?).
 
-    # We will use data masking and some operations with arrays. Convert to numpy.
-    array = np.array(array)
-
-    # Get the median and std.
-    data_median = np.median(array)
-    data_std    = np.std(array)
+    # Median and std of each channel (column), all at once.
+    data_median = np.median(samples,axis=0)
+    data_std    = np.std(samples,axis=0)
 
-    # Max discrepancy we allow.
+    # Max discrepancy we allow (10% flux + variable factor).
     fixed_max_dev  = 0.2*data_median
-    clip_deviation = np.min([fixed_max_dev,data_std*sigma+0.1])
-
-    # Create the filter (10% flux + variable factor)
-    filter_values_ok = np.abs(array-data_median)<=clip_deviation
-    filtered_values = array[filter_values_ok]
+    clip_deviation = np.minimum(fixed_max_dev,data_std*sigma+0.1)
+
+    return(data_median,clip_deviation)
+
+
+class SampleAccumulator(object):
+    '''
+    Collects the readings of one measure, one row per reading and one
+    column per channel (temperature, frequency, ticks, flux), and
+    returns the mean of each channel without its outliers.
+
+    Readings are kept in an array allocated once (and reused from one
+    measure to the next), filtered for all channels in one pass.
+
+    With streaming=True only the first `warmup` readings are kept:
+    they fix the median and the clipping range, and later readings
+    are just added to running sums if within range. Nothing is left
+    to do at the end, however many readings are taken. The result
+    only differs from the default when the first readings are not
+    representative of the rest.
+    '''
+    def __init__(self,channels=4,size=1,sigma=3,streaming=False,warmup=16):
+        self.sigma = sigma
+        self.streaming = streaming
+        self.samples = np.empty((warmup if streaming else max(1,size),channels))
+        self.reset()
+
+    def reset(self,size=None):
+        # Start a new measure (of size readings, if known)
+        if size is not None and not self.streaming and size>len(self.samples):
+            self.samples = np.empty((size,self.samples.shape[1]))
+        self.count = 0
+        self.reference = None   # (median, clip deviation) once fixed
+        self.sums = np.zeros(self.samples.shape[1])
+        self.accepted = np.zeros(self.samples.shape[1])
+
+    def add(self,values):
+        # Add one reading (one value per channel)
+        if self.reference is not None:
+            self.accumulate(np.asarray(values,dtype=float)[None,:])
+            return
+        if self.count==len(self.samples):
+            # More readings than expected
+            self.samples = np.concatenate([self.samples,np.empty_like(self.samples)])
+        self.samples[self.count] = values
+        self.count += 1
+        if self.streaming and self.count==len(self.samples):
+            self.fix_reference()
+
+    def fix_reference(self):
+        self.reference = clip_ranges(self.samples[:self.count],self.sigma)
+        self.accumulate(self.samples[:self.count])
+
+    def accumulate(self,rows):
+        data_median,clip_deviation = self.reference
+        filter_values_ok = np.abs(rows-data_median)<=clip_deviation
+        self.sums += np.where(filter_values_ok,rows,0).sum(axis=0)
+        self.accepted += filter_values_ok.sum(axis=0)
+
+    def means(self):
+        '''
+        Mean of the readings within range, per channel. The median
+        for a channel with none in range
+        '''
+        if self.count==0:
+            raise ValueError('No readings to average')
+        if self.reference is None:
+            self.fix_reference()
+        data_median = self.reference[0]
+        if np.any(self.accepted==0):
+            print('Warning: High dispersion found on last measures')
+        return(np.where(self.accepted>0,\
+         self.sums/np.maximum(self.accepted,1),data_median))
 
-    # Return the mean of filtered data or the median.
-    if np.size(filtered_values)==0:
-        print('Warning: High dispersion found on last measures')
-        filtered_mean = data_median
-    else:
-        filtered_mean = np.mean(filtered_values)
 
-    return(filtered_mean)
+def filtered_mean(array,sigma=3):
+    # Mean of array without its outliers (median if all are outliers)
+    array = np.asarray(array,dtype=float)
+    accumulator = SampleAccumulator(channels=1,size=len(array),sigma=sigma)
+    for value in array:
+        accumulator.add([value])
+    return(accumulator.means()[0])
 
 
 class device(observatory):
@@ -203,26 +262,27 @@ class device(observatory):
 
     def save_data(self,formatted_data):
         '''
-        Save data to file and duplicate to current
-        data file (the one that will be ploted)
+        Save data to file and keep the current
+        data file (the one that will be ploted) in step
         '''
-        for each_file in [self.monthly_datafile,self.daily_datafile]:
-            if not os.path.exists(each_file):
-                datafile = open(each_file,'w')
-                datafile.write(self.standard_file_header())
-                datafile.close()
-
-            datafile = open(each_file,'a+')
-            datafile.write(formatted_data)
-            datafile.close()
+        try:
+            self.writer
+        except AttributeError:
+            self.writer = DataWriter(self.standard_file_header)
 
-        self.copy_file(self.daily_datafile,self.current_datafile)
+        self.writer.write(self.monthly_datafile,self.daily_datafile,\
+         self.current_datafile,formatted_data)
 
 
     def save_data_datacenter(self,formatted_data):
         '''
         This function sends the data from this pysqm client to the central
         node @ UCM. It saves the data there (only the SQM data file contents)
+
+        Messages go through an outbox on disk (see pysqm.outbox), so
+        nothing is lost while the datacenter is unreachable or if
+        the program restarts. An empty formatted_data only sends
+        what is waiting.
         '''
 
         # Connection details (hardcoded to avoid user changes)
@@ -230,80 +290,53 @@ class device(observatory):
         DC_PORT = 8739
         DEV_ID = str(config._device_id)+"_"+str(self.serial_number)
 
-        def send_data(data):
-            try:
-                client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                client.connect((DC_HOST, DC_PORT))
-                client.sendall(data)
-                client.shutdown(socket.SHUT_RDWR)
-                client.close()
-            except:
-                return(0)
-            else:
-                return(1)
-
-        def write_buffer():
-            for data_line in self.DataBuffer[:]:
-                success = send_data(DEV_ID+";;D;;"+data_line)
-                if (success==1): self.DataBuffer.remove(data_line)
-
-            return(success)
-
-        '''
-        Send the new file initialization to the datacenter
-        Appends the header to the buffer (it will be sent later)
-        '''
+        try:
+            self.outbox
+        except AttributeError:
+            from pysqm.outbox import Outbox, Sender
+            self.outbox = Outbox()
+            self.outbox_sender = Sender(DC_HOST,DC_PORT)
 
         if (formatted_data=="NEWFILE"):
-            self.DataBuffer=[\
-                hl+"\n" for hl in self.standard_file_header().split("\n")[:-1]]
-
-            # Try to connect with the datacenter and send the header
-            success = send_data(DEV_ID+";;C;;")
-            success = write_buffer()
-            return(success)
-        else:
-
             '''
-            Send the data to the datacenter
+            Send the new file initialization to the datacenter,
+            followed by the header
             '''
+            self.outbox.append(DEV_ID+";;C;;")
+            for hl in self.standard_file_header().split("\n")[:-1]:
+                self.outbox.append(DEV_ID+";;D;;"+hl+"\n")
+        elif (formatted_data!=""):
+            '''
+            Send the data to the datacenter.
+            If the outbox is full, dont append more data.
+            '''
+            for data_line in formatted_data.splitlines():
+                self.outbox.append(DEV_ID+";;D;;"+data_line+"\n")
 
-            # If the buffer is full, dont append more data.
-            if (len(self.DataBuffer)<10000):
-                self.DataBuffer.append(formatted_data)
-
-            # Try to connect with the datacenter and send the data
-            success = write_buffer()
-            return(success)
+        # Try to connect with the datacenter and send what is waiting
+        success = self.outbox_sender.send(self.outbox)
+        return(int(success))
 
     def save_data_mysql(self,formatted_data):
         '''
-        Use the Python MySQL API to save the
-        data to a database
+        Send the data to the MySQL database. Rows are inserted in
+        batches over a connection kept open, and spooled to a local
+        file while the database cannot be reached (see pysqm.dbsink)
         '''
-        mydb = None
-        values = formatted_data.split(';')
         try:
-            ''' Start database connection '''
-            mydb = _mysql.connect(\
-             host = config._mysql_host,
-             user = config._mysql_user,
-             passwd = config._mysql_pass,
-             db = config._mysql_database,
-             port = config._mysql_port)
-
-            ''' Insert the data '''
-            mydb.query(\
-             "INSERT INTO "+str(config._mysql_dbtable)+" VALUES (NULL,'"+\
-             values[0]+"','"+values[1]+"',"+\
-             values[2]+","+values[3]+","+\
-             values[4]+","+values[5]+")")
-        except Exception as ex:
-            print((str(inspect.stack()[0][2:4][::-1])+\
-             ' DB Error. Exception: %s' % str(ex)))
-
-        if mydb != None:
-            mydb.close()
+            self.database
+        except AttributeError:
+            from pysqm.dbsink import DatabaseSink
+            self.database = DatabaseSink()
+        self.database.add(formatted_data)
+
+    def flush_data_mysql(self):
+        ''' Send the rows still queued and close the connection '''
+        try:
+            self.database
+        except AttributeError:
+            return
+        self.database.close()
 
     def data_cache(self,formatted_data,number_measures=1,niter=0):
         '''
@@ -324,22 +357,10 @@ class device(observatory):
             print((str(niter)+'\t'+formatted_data[:-1]))
 
     def flush_cache(self):
-        ''' Flush the data cache '''
+        ''' Flush the data cache and close the data files '''
         self.save_data(self.DataCache)
         self.DataCache = ""
-
-    def copy_file(self,source,destination):
-        # Copy file content from source to dest.
-        fichero_source = open(source,'r')
-        contenido_source = fichero_source.read()
-        fichero_source.close()
-        # Create file and truncate it
-        fichero_destination = open(destination,'w')
-        fichero_destination.close()
-        # Write content
-        fichero_destination = open(destination,'r+')
-        fichero_destination.write(contenido_source)
-        fichero_destination.close()
+        self.writer.close()
 
     def remove_currentfile(self):
         # Remove a file from the host
@@ -349,11 +370,13 @@ class device(observatory):
 
 class SQM(device):
     def read_photometer(self,Nmeasures=1,PauseMeasures=2):
-        # Initialize values
-        temp_sensor   = []
-        flux_sensor   = []
-        freq_sensor   = []
-        ticks_uC      = []
+        # Readings of temperature, frequency, ticks and flux,
+        # in an accumulator kept from one measure to the next
+        try:
+            self.accumulator.reset(Nmeasures)
+        except AttributeError:
+            self.accumulator = SampleAccumulator(channels=4,size=Nmeasures,\
+             streaming=config._streaming_mean)
         Nremaining = Nmeasures
 
         # Promediate N measures to remove jitter
@@ -366,10 +389,8 @@ class SQM(device):
             temp_sensor_i,freq_sensor_i,ticks_uC_i,sky_brightness_i = \
              self.data_process(raw_data)
 
-            temp_sensor += [temp_sensor_i]
-            freq_sensor += [freq_sensor_i]
-            ticks_uC    += [ticks_uC_i]
-            flux_sensor += [10**(-0.4*sky_brightness_i)]
+            self.accumulator.add((temp_sensor_i,freq_sensor_i,\
+             ticks_uC_i,10**(-0.4*sky_brightness_i)))
             Nremaining  -= 1
             DeltaSeconds = (datetime.datetime.now()-InitialDateTime).total_seconds()
 
@@ -387,10 +408,8 @@ class SQM(device):
         timelocal_mean = self.local_datetime(timeutc_mean)
 
         # Calculate the mean of the data.
-        temp_sensor = filtered_mean(temp_sensor)
-        freq_sensor = filtered_mean(freq_sensor)
-        flux_sensor = filtered_mean(flux_sensor)
-        ticks_uC    = filtered_mean(ticks_uC)
+        temp_sensor,freq_sensor,ticks_uC,flux_sensor = \
+         [float(value) for value in self.accumulator.means()]
         sky_brightness = -2.5*np.log10(flux_sensor)
 
         # Correct from offset (if cover is installed on the photometer)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+PySQM measure scheduler
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import sys
+import time
+import queue
+import threading
+
+
+class MeasureClock(object):
+    """
+    Ticks every interval seconds on a fixed grid, whatever the time
+    spent between ticks. A measure that overruns the interval
+    is followed by an immediate one, and missed ticks are skipped
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next = None  # monotonic time of the next tick
+
+    def wait(self):
+        """
+        Sleep until the next tick. Returns the number of ticks
+        missed since the previous one
+        """
+        now = time.monotonic()
+        missed = 0
+        if self.next is None:
+            self.next = now
+        elif now < self.next:
+            time.sleep(self.next - now)
+        elif now - self.next >= self.interval:
+            missed = int((now - self.next) // self.interval)
+            self.next += missed * self.interval
+        self.next += self.interval
+        return missed
+
+    def reset(self):
+        # Start again from the next wait(), eg. at the start of the night
+        self.next = None
+
+
+class SinkWorker(object):
+    """
+    Runs the tasks of one output (data files, database, datacenter,
+    plots) in its own thread, in the order they are submitted, so
+    a slow output never delays the measures. With maxsize, tasks
+    submitted while the queue is full are refused
+    """
+
+    def __init__(self, name, maxsize=0):
+        self.name = name
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue function(*args, **kwargs). Returns False if the
+        queue is full
+        """
+        try:
+            self.queue.put_nowait((function, args, kwargs))
+        except queue.Full:
+            return False
+        return True
+
+    def submit_wait(self, function, *args, **kwargs):
+        """
+        Queue function(*args, **kwargs), waiting for room if needed
+        """
+        self.queue.put((function, args, kwargs))
+
+    def run(self):
+        while True:
+            function, args, kwargs = self.queue.get()
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                print("Warning: Error in " + self.name + " output.")
+                print(sys.exc_info())
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        # Wait until all the submitted tasks are done
+        self.queue.join()
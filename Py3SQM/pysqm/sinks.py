@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+
+"""
+PySQM measure outputs
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import sys
+import time
+import importlib
+from abc import ABC, abstractmethod
+
+from pysqm.scheduler import SinkWorker
+
+# Read configuration
+import pysqm.settings as settings
+
+if __name__ != "__main__":
+    config = settings.GlobalConfig.config
+
+    # Optional settings, for config files that predate them
+    try:
+        config._sinks
+    except AttributeError:
+        config._sinks = None  # see default_sinks()
+
+
+class Sink(ABC):
+    """
+    An output of the measures. Each sink runs in its own thread
+    and receives the rows (formatted as in the data files) in
+    batches of batch_size. Up to maxsize rows wait in its queue
+    (0: no limit), more are dropped.
+
+    A sink that reads the data itself (needs_rows = False, eg. the
+    plot, which reads the data file) gets write([]) every batch_size
+    measures instead, counted as they are taken. An update that
+    finds the previous one still queued is skipped and tried again
+    at the next measure; no data is lost.
+
+    To add an output, subclass Sink, implement write() (and
+    start_night() / end_night() if needed) and list it in
+    config._sinks as "module.Class", or register_sink() it.
+    """
+
+    batch_size = 1
+    maxsize = 0
+    needs_rows = True
+
+    def __init__(self, device, name=None, batch_size=None, maxsize=None):
+        self.device = device
+        self.name = self.__class__.__name__ if name is None else name
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if maxsize is not None:
+            self.maxsize = maxsize
+
+    def start_night(self):
+        # Before the first measure of the night
+        pass
+
+    @abstractmethod
+    def write(self, rows):
+        # Output a batch of rows
+        pass
+
+    def end_night(self):
+        # After the last measure of the night, eg. flush and close
+        pass
+
+
+class FileSink(Sink):
+    """
+    Monthly, daily and current data files
+    """
+
+    niter = 0  # measures of the night, as printed
+
+    def start_night(self):
+        self.niter = 0
+
+    def write(self, rows):
+        for formatted_data in rows:
+            self.niter += 1
+            self.device.define_filenames()
+            self.device.data_cache(
+                formatted_data, number_measures=config._cache_measures, niter=self.niter
+            )
+
+    def end_night(self):
+        self.device.flush_cache()
+
+
+class MySQLSink(Sink):
+    """
+    MySQL table (batched by the database sink itself, see pysqm.dbsink)
+    """
+
+    def write(self, rows):
+        self.device.save_data_mysql("".join(rows))
+
+    def end_night(self):
+        self.device.flush_data_mysql()
+
+
+class DatacenterSink(Sink):
+    """
+    Datacenter at UCM, through the outbox (see pysqm.outbox)
+    """
+
+    def start_night(self):
+        self.device.save_data_datacenter("NEWFILE")
+
+    def write(self, rows):
+        self.device.save_data_datacenter("".join(rows))
+
+    def end_night(self):
+        # Send what is still waiting in the outbox
+        self.device.save_data_datacenter("")
+
+
+class PlotSink(Sink):
+    """
+    Night plot, updated every config._plot_each measures, and the
+    daily graph, statistics and e-mail at the end of the night.
+    Only one update waits while a plot is being made
+    """
+
+    maxsize = 1
+    needs_rows = False  # reads the current data file
+
+    def __init__(self, device, **options):
+        options.setdefault("batch_size", config._plot_each)
+        Sink.__init__(self, device, **options)
+        self.night_plotter = None  # keeps the plot between updates
+
+    def write(self, rows):
+        if self.night_plotter is None:
+            import pysqm.plot
+
+            self.night_plotter = pysqm.plot.NightPlotter()
+        self.night_plotter.update()
+
+    def end_night(self):
+        import pysqm.plot
+
+        pysqm.plot.make_plot(
+            send_emails=config._send_data_by_email == True, write_stats=True
+        )
+
+
+class SQLiteSink(Sink):
+    """
+    Local SQLite database, one table row per measure (eg. for a
+    history too long for the data files)
+    """
+
+    batch_size = 20
+
+    def __init__(self, device, path=None, table="measures", **options):
+        Sink.__init__(self, device, **options)
+        if path is None:
+            path = os.path.join(config.monthly_data_directory, "Measures.sqlite")
+        self.path = path
+        self.table = table
+        self.database = None
+
+    def connect(self):
+        import sqlite3
+
+        connection = sqlite3.connect(self.path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS "
+            + self.table
+            + " (id INTEGER PRIMARY KEY, utc TEXT, local TEXT, temperature REAL, "
+            "counts REAL, frequency REAL, nsb REAL)"
+        )
+        return connection
+
+    def write(self, rows):
+        if self.database is None:
+            from pysqm.dbsink import DatabaseSink
+
+            self.database = DatabaseSink(
+                connect=self.connect,
+                table=self.table,
+                batch_size=self.batch_size,
+                spool_path=self.path + ".spool",
+            )
+        self.database.add("".join(rows))
+
+    def end_night(self):
+        if self.database is not None:
+            self.database.close()
+
+
+SINKS = {
+    "file": FileSink,
+    "mysql": MySQLSink,
+    "datacenter": DatacenterSink,
+    "plot": PlotSink,
+    "sqlite": SQLiteSink,
+}
+
+
+def register_sink(name, sink_class):
+    """
+    Make a Sink subclass available by name in config._sinks
+    """
+    if not (isinstance(sink_class, type) and issubclass(sink_class, Sink)):
+        raise TypeError(repr(sink_class) + " is not a Sink subclass")
+    SINKS[name] = sink_class
+
+
+def default_sinks():
+    """
+    Sinks used when config._sinks is not set: data files and plots,
+    and the database and datacenter if enabled
+    """
+    sinks = ["file"]
+    if config._use_mysql == True:
+        sinks.append("mysql")
+    if config._send_to_datacenter == True:
+        sinks.append("datacenter")
+    sinks.append("plot")
+    return sinks
+
+
+def sink_class(name):
+    # Registered name, or "module.Class"
+    if name in SINKS:
+        return SINKS[name]
+    if "." not in name:
+        raise ValueError("Unknown sink " + repr(name))
+    module_name, class_name = name.rsplit(".", 1)
+    cls = getattr(importlib.import_module(module_name), class_name)
+    if not (isinstance(cls, type) and issubclass(cls, Sink)):
+        raise TypeError(repr(name) + " is not a Sink subclass")
+    return cls
+
+
+def load_sinks(device, entries=None):
+    """
+    Sinks listed in config._sinks. Each entry is a name, or a
+    (name, options) pair, options being passed to the sink, eg.
+    ("sqlite", {"path": "/data/sqm.sqlite", "batch_size": 100})
+    """
+    if entries is None:
+        entries = config._sinks
+    if entries is None:
+        entries = default_sinks()
+
+    sinks = []
+    for entry in entries:
+        if isinstance(entry, str):
+            name, options = entry, {}
+        else:
+            name, options = entry
+        options = dict(options)
+        options.setdefault("name", name)
+        sinks.append(sink_class(name)(device, **options))
+    return sinks
+
+
+class SinkRunner(object):
+    """
+    Runs one sink in its own thread: gathers rows into batches and
+    keeps count of rows, batches, failures, drops and write times
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.worker = SinkWorker(sink.name, sink.maxsize)
+        self.pending = []  # rows of the next batch
+        self.counted = 0  # measures not handed yet (needs_rows = False)
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.rows = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0  # rows lost, queue full
+        self.skipped = 0  # updates put off, previous one still queued
+        self.write_time = 0.0
+        self.max_write_time = 0.0
+
+    def call(self, function, *args):
+        # Run a sink method, counting its failures. Returns its duration
+        start = time.monotonic()
+        try:
+            function(*args)
+        except Exception:
+            self.failures += 1
+            print("Warning: Error in " + self.sink.name + " output.")
+            print(sys.exc_info())
+        return time.monotonic() - start
+
+    def add(self, formatted_data):
+        self.pending.append(formatted_data)
+        if len(self.pending) >= self.sink.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        rows = self.pending
+        self.pending = []
+        self.record(len(rows), self.call(self.sink.write, rows))
+
+    def update(self, count):
+        # Tell a sink that reads the data itself about count new measures
+        self.record(count, self.call(self.sink.write, []))
+
+    def record(self, count, elapsed):
+        self.rows += count
+        self.batches += 1
+        self.write_time += elapsed
+        self.max_write_time = max(self.max_write_time, elapsed)
+
+    def measure(self, formatted_data):
+        if self.sink.needs_rows:
+            # Queue the row, dropped if the queue is full
+            if not self.worker.submit(self.add, formatted_data):
+                self.dropped += 1
+            return
+
+        # Only queue an update, every batch_size measures
+        self.counted += 1
+        if self.counted < self.sink.batch_size:
+            return
+        if self.worker.submit(self.update, self.counted):
+            self.counted = 0
+        else:
+            self.skipped += 1
+
+    def start_night(self):
+        self.worker.submit_wait(self.call, self.sink.start_night)
+
+    def end_night(self):
+        # Write the last batch and close the night, then wait for it
+        self.worker.submit_wait(self.flush)
+        if self.counted > 0:
+            self.worker.submit_wait(self.update, self.counted)
+            self.counted = 0
+        self.worker.submit_wait(self.call, self.sink.end_night)
+        self.worker.join()
+
+    def metrics(self):
+        return {
+            "rows": self.rows,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "queued": self.worker.queue.qsize(),
+            "mean_write_time": self.write_time / max(1, self.batches),
+            "max_write_time": self.max_write_time,
+        }
+
+
+class Pipeline(object):
+    """
+    All the outputs of the measures, each fed through its own queue
+    """
+
+    def __init__(self, sinks):
+        self.runners = [SinkRunner(sink) for sink in sinks]
+
+    def start_night(self):
+        for runner in self.runners:
+            runner.start_night()
+
+    def measure(self, formatted_data):
+        for runner in self.runners:
+            runner.measure(formatted_data)
+
+    def end_night(self):
+        """
+        Close the night in each sink, in the order of config._sinks
+        (so the data files are complete before the daily graph)
+        """
+        for runner in self.runners:
+            runner.end_night()
+
+    def report(self):
+        # Print and reset the metrics of each sink
+        for runner in self.runners:
+            metrics = runner.metrics()
+            print(
+                "%s: %d rows in %d batches, %d failures, %d dropped, "
+                "%d skipped, write time %.1f ms mean, %.1f ms max"
+                % (
+                    runner.sink.name,
+                    metrics["rows"],
+                    metrics["batches"],
+                    metrics["failures"],
+                    metrics["dropped"],
+                    metrics["skipped"],
+                    1000 * metrics["mean_write_time"],
+                    1000 * metrics["max_write_time"],
+                )
+            )
+            runner.reset_metrics()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""
+PySQM statistics store
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import os
+import sqlite3
+
+# Read configuration
+import pysqm.settings as settings
+
+if __name__ != "__main__":
+    config = settings.GlobalConfig.config
+
+    # Optional settings, for config files that predate them
+    try:
+        config._statistics_db
+    except AttributeError:
+        config._statistics_db = None  # next to the statistics file
+    try:
+        config._statistics_csv
+    except AttributeError:
+        config._statistics_csv = False  # exported on demand, see __main__
+
+# Statistics columns and their types, in the order of the statistics file
+COLUMNS = [
+    "number",
+    "bests_number",
+    "bests_median",
+    "bests_err",
+    "model_nterm",
+    "data_model_abs_meandiff",
+    "min_temperature",
+    "max_temperature",
+]
+INTEGERS = ["number", "bests_number", "model_nterm"]
+
+
+def column_type(name):
+    return int if name in INTEGERS else float
+
+
+class NightStatistics(object):
+    """
+    Statistics of one night, as read back from the store
+    """
+
+    def __init__(self, values):
+        for name, value in zip(COLUMNS, values):
+            setattr(self, name, value)
+
+
+class StatsStore(object):
+    """
+    Statistics of each night in an SQLite table keyed by the night
+    date, so storing a night is a single upsert however long the
+    history is. The statistics file (CSV) is exported from it.
+    """
+
+    def __init__(self, path=None):
+        from pysqm.plot import stats_filename
+
+        if path is None:
+            path = config._statistics_db
+        if path is None:
+            path = os.path.splitext(stats_filename())[0] + ".sqlite"
+        self.path = path
+
+        new = not os.path.exists(path)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS statistics (night TEXT PRIMARY KEY, "
+            + ", ".join(
+                name + (" INTEGER" if name in INTEGERS else " REAL") for name in COLUMNS
+            )
+            + ")"
+        )
+        self.db.commit()
+        if new and os.path.exists(stats_filename()):
+            # Start from the statistics file written before the store existed
+            self.import_csv(stats_filename())
+
+    def upsert(self, Night, Stat):
+        """
+        Store (or replace) the statistics of one night
+        """
+        self.upsert_many([(Night, Stat)])
+
+    def upsert_many(self, results):
+        """
+        Store (or replace) the statistics of several nights,
+        results being (night, Statistics) pairs
+        """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO statistics VALUES ("
+            + ", ".join(["?"] * (len(COLUMNS) + 1))
+            + ")",
+            [
+                [str(Night)]
+                + [column_type(name)(getattr(Stat, name)) for name in COLUMNS]
+                for Night, Stat in results
+            ],
+        )
+        self.db.commit()
+
+    def nights(self):
+        """
+        (night, Statistics) of every night stored, in date order
+        """
+        cursor = self.db.execute(
+            "SELECT night, " + ", ".join(COLUMNS) + " FROM statistics ORDER BY night"
+        )
+        return [(row[0], NightStatistics(row[1:])) for row in cursor]
+
+    def import_csv(self, filename):
+        """
+        Add the nights of a statistics file
+        """
+        results = []
+        stats_file = open(filename, "r")
+        for line in stats_file:
+            fields = line.strip().split(";")
+            if line.startswith("#") or len(fields) != len(COLUMNS) + 1:
+                continue
+            try:
+                values = [
+                    column_type(name)(field) for name, field in zip(COLUMNS, fields[1:])
+                ]
+            except ValueError:
+                continue
+            results.append((fields[0], NightStatistics(values)))
+        stats_file.close()
+        self.upsert_many(results)
+
+    def export_csv(self, filename=None):
+        """
+        Write the statistics file, in the format of save_stats_to_file
+        """
+        from pysqm.plot import stats_header, format_stats, stats_filename
+
+        if filename is None:
+            filename = stats_filename()
+
+        content = stats_header() + "".join(
+            format_stats(Night, Stat) for Night, Stat in self.nights()
+        )
+        tmp = filename + ".tmp"
+        stats_file = open(tmp, "w")
+        stats_file.write(content)
+        stats_file.close()
+        os.replace(tmp, filename)
+
+    def close(self):
+        self.db.close()
+
+
+"""
+The following code exports the statistics file from the store:
+python -m pysqm.statsdb -c config.py
+"""
+if __name__ == "__main__":
+    InputArguments = settings.ArgParser()
+    settings.GlobalConfig.read_config_file(InputArguments.config)
+    import pysqm.statsdb
+
+    Store = pysqm.statsdb.StatsStore()
+    Store.export_csv()
+    Store.close()
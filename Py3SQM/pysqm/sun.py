@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+PySQM vectorized Sun position
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+"""
+
+import numpy as np
+
+# Unix epoch as a Julian date
+JD_UNIX_EPOCH = 2440587.5
+
+# Largest difference with pyephem allowed (degrees), see tests/test_sun.py
+TOLERANCE = 0.05
+
+
+def julian_dates(utc):
+    """
+    Julian dates of an array of UTC times (datetime64 or datetime)
+    """
+    utc = np.asarray(utc, dtype="datetime64[ms]")
+    days = (utc - np.datetime64(0, "ms")) / np.timedelta64(1, "D")
+    return days + JD_UNIX_EPOCH
+
+
+def sun_altitude(utc, lat, lon):
+    """
+    Apparent altitude of the Sun (radians, as ephem's Sun.alt) for a
+    whole array of UTC times at once, with the NOAA solar position
+    formulas and pyephem's refraction model. lat and lon are in
+    radians, as in ephem.Observer. Within TOLERANCE (0.05 degrees)
+    of pyephem, see compare_with_ephem()
+    """
+    jd = julian_dates(utc)
+    T = (jd - 2451545.0) / 36525.0
+
+    # Mean longitude and anomaly of the Sun, eccentricity of Earth's orbit
+    L0 = np.radians(np.mod(280.46646 + T * (36000.76983 + T * 0.0003032), 360))
+    M = np.radians(357.52911 + T * (35999.05029 - 0.0001537 * T))
+    e = 0.016708634 - T * (0.000042037 + 0.0000001267 * T)
+
+    # Equation of center, apparent longitude
+    C = (
+        np.sin(M) * (1.914602 - T * (0.004817 + 0.000014 * T))
+        + np.sin(2 * M) * (0.019993 - 0.000101 * T)
+        + np.sin(3 * M) * 0.000289
+    )
+    omega = np.radians(125.04 - 1934.136 * T)
+    apparent_longitude = L0 + np.radians(C - 0.00569 - 0.00478 * np.sin(omega))
+
+    # Obliquity of the ecliptic, declination
+    obliquity = np.radians(
+        23
+        + (26 + (21.448 - T * (46.815 + T * (0.00059 - T * 0.001813))) / 60) / 60
+        + 0.00256 * np.cos(omega)
+    )
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_longitude))
+
+    # Equation of time (radians of hour angle)
+    y = np.tan(obliquity / 2) ** 2
+    equation_of_time = (
+        y * np.sin(2 * L0)
+        - 2 * e * np.sin(M)
+        + 4 * e * y * np.sin(M) * np.cos(2 * L0)
+        - 0.5 * y * y * np.sin(4 * L0)
+        - 1.25 * e * e * np.sin(2 * M)
+    )
+
+    # Hour angle from the true solar time
+    day_fraction = np.mod(jd + 0.5, 1.0)
+    hour_angle = 2 * np.pi * day_fraction + equation_of_time + lon - np.pi
+
+    altitude = np.arcsin(
+        np.clip(
+            np.sin(lat) * np.sin(declination)
+            + np.cos(lat) * np.cos(declination) * np.cos(hour_angle),
+            -1,
+            1,
+        )
+    )
+    return altitude + refraction(altitude)
+
+
+def unrefraction(apparent, pressure=1010.0, temperature=15.0):
+    """
+    Refraction (radians) to subtract from an apparent altitude, as in
+    pyephem (libastro's unrefract): a low altitude formula below 14.5
+    degrees, a high altitude one above 15.5, blended in between.
+    Also used below the horizon, down to where it vanishes
+    """
+    h = np.degrees(np.asarray(apparent, dtype=float))
+
+    # Low altitude formula; none where it turns negative (about -8 deg)
+    a = ((2e-5 * h + 1.96e-2) * h + 1.594e-1) * pressure
+    b = (273 + temperature) * ((8.45e-2 * h + 5.05e-1) * h + 1)
+    low = np.radians(a / b)
+    low = np.where((h < 0) & (low < 0), 0.0, low)
+
+    # High altitude formula (tan kept away from 0 where it is not used)
+    t = np.tan(np.radians(np.clip(h, 14.5, 90)))
+    high = 7.888888e-5 * pressure / ((273 + temperature) * t)
+
+    blend = np.clip(h - 14.5, 0, 1)
+    return low + blend * (high - low)
+
+
+def refraction(altitude, iterations=8):
+    """
+    Atmospheric refraction (radians) at a given true altitude, for
+    pyephem's default pressure and temperature: the apparent
+    altitude a such that a - unrefraction(a) is the true one,
+    found with Newton's method (libastro uses the secant method)
+    """
+    altitude = np.asarray(altitude, dtype=float)
+    step = 1e-7
+    apparent = altitude + unrefraction(altitude)
+    for k in range(iterations):
+        correction = unrefraction(apparent)
+        slope = 1 - (unrefraction(apparent + step) - correction) / step
+        apparent = apparent - (apparent - correction - altitude) / slope
+    return apparent - altitude
+
+
+def compare_with_ephem(lat_deg=40.45, lon_deg=-3.73, days=365, step_hours=1):
+    """
+    Check sun_altitude against pyephem over a year, hour by hour.
+    Returns the largest difference in degrees, separately for the
+    Sun above -5 degrees (where refraction is largest) and below it
+    (where the night plots are made)
+    """
+    import ephem
+
+    Observatory = ephem.Observer()
+    Observatory.lat = np.radians(lat_deg)
+    Observatory.lon = np.radians(lon_deg)
+
+    start = np.datetime64("2024-01-01T00:00:00", "ms")
+    utc = start + np.arange(0, days * 24, step_hours) * np.timedelta64(1, "h")
+
+    reference = []
+    for t in utc.astype(object):
+        Observatory.date = ephem.date(t)
+        reference.append(float(ephem.Sun(Observatory).alt))
+    reference = np.degrees(reference)
+
+    computed = np.degrees(
+        sun_altitude(utc, float(Observatory.lat), float(Observatory.lon))
+    )
+    error = np.abs(computed - reference)
+    low = reference < -5
+    return np.max(error[~low]), np.max(error[low])
+
+
+# Sites the accuracy is checked at (latitude, longitude in degrees)
+SITES = [(40.45, -3.73), (42.45, -72.68), (-33.9, 18.4), (65.0, 25.0)]
+
+
+"""
+The following code prints the accuracy against pyephem:
+python -m pysqm.sun
+(python -m pytest tests/test_sun.py fails if it exceeds TOLERANCE)
+"""
+if __name__ == "__main__":
+    for lat_deg, lon_deg in SITES:
+        high, low = compare_with_ephem(lat_deg, lon_deg)
+        print(
+            "lat %6.2f lon %7.2f: max error %.4f deg (Sun above -5 deg), "
+            "%.4f deg (below)" % (lat_deg, lon_deg, high, low)
+        )
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+'''
+PySQM data file writer
+____________________________
+
+Copyright (c) Mireia Nievas <mnievas[at]ucm[dot]es>
+
+This file is part of PySQM.
+
+PySQM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PySQM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PySQM.  If not, see <http://www.gnu.org/licenses/>.
+____________________________
+'''
+
+import os
+import time
+import shutil
+
+'''
+Read configuration
+'''
+import pysqm.settings as settings
+config = settings.GlobalConfig.config
+
+# Optional settings, for config files that predate them
+try:
+    config._current_file_mode
+except AttributeError:
+    config._current_file_mode = 'hardlink'
+try:
+    config._fsync_interval
+except AttributeError:
+    config._fsync_interval = 60
+
+
+class DataWriter(object):
+    '''
+    Keeps the monthly and daily data files open between writes, so
+    each row is a single append. Rows are flushed to the OS straight
+    away (the plot and the radio sync read these files) and forced
+    to disk every config._fsync_interval seconds.
+
+    The current data file follows the daily one depending on
+    config._current_file_mode:
+      hardlink: current is another name for the daily file
+      symlink:  current points to the daily file
+      append:   current is a copy made once per night, then
+                receives the same rows as the daily file
+    If a link cannot be made (different filesystem, no permission)
+    the writer falls back to append.
+    '''
+    def __init__(self,header,mode=None,fsync_interval=None):
+        self.header = header    # function returning the file header
+        self.mode = config._current_file_mode if mode is None else mode
+        self.fsync_interval = config._fsync_interval \
+         if fsync_interval is None else fsync_interval
+        self.files = {}         # path -> open file
+        self.current_source = None  # daily file the current file follows
+        self.last_sync = time.time()
+
+    def _open(self,path):
+        # Open a data file for appending, writing the header if new
+        if path not in self.files:
+            new = not os.path.exists(path) or os.path.getsize(path)==0
+            datafile = open(path,'a')
+            if new:
+                datafile.write(self.header())
+            self.files[path] = datafile
+        return(self.files[path])
+
+    def _close(self,path):
+        # Flush, sync and close one data file
+        datafile = self.files.pop(path)
+        datafile.flush()
+        os.fsync(datafile.fileno())
+        datafile.close()
+
+    def _follow(self,daily,current):
+        '''
+        Make current follow daily. Only called when the daily file
+        changes (new night, or first write). Returns True if current
+        needs its own copy of each row
+        '''
+        if current in self.files:
+            self._close(current)
+        self.files[daily].flush()
+        tmp = current+'.tmp'
+        if self.mode in ('hardlink','symlink'):
+            try:
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                if self.mode=='hardlink':
+                    os.link(daily,tmp)
+                else:
+                    os.symlink(os.path.abspath(daily),tmp)
+                os.replace(tmp,current)
+                return(False)
+            except OSError as ex:
+                print(('Warning: cannot '+self.mode+' current data file ('+\
+                 str(ex)+'). Appending to a copy instead.'))
+                self.mode = 'append'
+        # Replace rather than overwrite, current may still be a link
+        shutil.copyfile(daily,tmp)
+        os.replace(tmp,current)
+        return(True)
+
+    def write(self,monthly,daily,current,data):
+        '''
+        Append data to the monthly and daily files and keep the
+        current file in step. File names may change between calls
+        (new night, new month); old files are closed
+        '''
+        keep = [monthly,daily]
+        for path in keep:
+            self._open(path)
+
+        if daily!=self.current_source or not os.path.lexists(current):
+            copy = self._follow(daily,current)
+            self.current_source = daily
+        else:
+            copy = self.mode=='append'
+        if copy:
+            keep.append(current)
+            self._open(current)
+
+        for path in list(self.files):
+            if path not in keep:
+                self._close(path)
+
+        for path in keep:
+            self.files[path].write(data)
+            self.files[path].flush()
+
+        if time.time()-self.last_sync>=self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        # Force everything written so far to disk
+        for datafile in list(self.files.values()):
+            datafile.flush()
+            os.fsync(datafile.fileno())
+        self.last_sync = time.time()
+
+    def close(self):
+        # Sync and close all files, eg. at the end of the night
+        for path in list(self.files):
+            self._close(path)
+        self.current_source = None
+        self.last_sync = time.time()
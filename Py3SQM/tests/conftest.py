@@ -0,0 +1,8 @@
+"""
+Makes the pysqm package importable when the tests are run from anywhere
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
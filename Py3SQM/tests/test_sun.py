@@ -0,0 +1,23 @@
+"""
+Accuracy of the vectorized Sun altitude against pyephem
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("ephem")
+
+from pysqm import sun
+
+
+@pytest.mark.parametrize("lat_deg, lon_deg", sun.SITES)
+def test_sun_altitude_matches_ephem(lat_deg, lon_deg):
+    high, low = sun.compare_with_ephem(lat_deg, lon_deg)
+    assert high < sun.TOLERANCE, "Sun above -5 deg: %.4f deg off" % high
+    assert low < sun.TOLERANCE, "Sun below -5 deg: %.4f deg off" % low
+
+
+def test_refraction_inverts_unrefraction():
+    altitude = np.radians(np.linspace(-5, 89, 200))
+    apparent = altitude + sun.refraction(altitude)
+    assert np.allclose(apparent - sun.unrefraction(apparent), altitude, atol=1e-9)
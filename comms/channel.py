@@ -0,0 +1,186 @@
+"""
+Length-prefixed framing over a long-lived TCP connection between host and RPi. Each message is a 4-byte big-endian length followed by that many UTF-8 bytes, so messages of any length survive intact and several can be in flight on one connection.
+"""
+
+import asyncio
+import select
+import socket
+import struct
+import threading
+import time
+
+# module imports
+import configs
+
+# text encoding
+utf8 = configs.utf8
+max_frame_len = configs.max_frame_len
+
+# retry settings
+tries = configs.tries
+backoff_max = configs.backoff_max
+
+# timing
+short_s = configs.short_s
+long_s = configs.long_s
+
+HEADER = struct.Struct("!I")  # frame length, network byte order
+
+
+def encode_frame(s: str) -> bytes:
+    """Turns a message into a frame
+
+    Args:
+        s (str): message to frame
+
+    Returns:
+        bytes: length header followed by message
+    """
+    b = s.encode(utf8)
+    return HEADER.pack(len(b)) + b
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes | None:
+    """Reads exactly n bytes from a socket
+
+    Args:
+        sock (socket.socket): connected socket
+        n (int): number of bytes to read
+
+    Returns:
+        bytes | None: the bytes, or None if the connection closed first
+    """
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        r = sock.recv_into(view[got:], n - got)
+        if r == 0:
+            return None
+        got += r
+    return bytes(buf)
+
+
+def recv_frame(sock: socket.socket) -> str | None:
+    """Reads one whole frame from a socket
+
+    Args:
+        sock (socket.socket): connected socket
+
+    Raises:
+        ValueError: if the frame is longer than max_frame_len
+
+    Returns:
+        str | None: message, or None if the connection closed
+    """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    (n,) = HEADER.unpack(header)
+    if n > max_frame_len:
+        raise ValueError(f"Frame of {n} bytes exceeds max_frame_len {max_frame_len}")
+    body = _recv_exactly(sock, n)
+    if body is None:
+        return None
+    return body.decode(utf8)
+
+
+async def read_frame(reader: asyncio.StreamReader) -> str | None:
+    """Reads one whole frame from an asyncio stream
+
+    Args:
+        reader (asyncio.StreamReader): connected stream
+
+    Raises:
+        ValueError: if the frame is longer than max_frame_len
+
+    Returns:
+        str | None: message, or None if the connection closed
+    """
+    try:
+        (n,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if n > max_frame_len:
+            raise ValueError(
+                f"Frame of {n} bytes exceeds max_frame_len {max_frame_len}"
+            )
+        return (await reader.readexactly(n)).decode(utf8)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class Channel:
+    """Outgoing connection that stays open between messages and reconnects with exponential backoff"""
+
+    def __init__(self, addr: str, port: int) -> None:
+        """
+        Args:
+            addr (str): address to connect to
+            port (int): port number of the server
+        """
+        self.addr = addr
+        self.port = port
+        self.sock: socket.socket | None = None
+        self.lock = threading.Lock()  # one writer at a time keeps frames whole
+        self.backoff = short_s
+
+    def _connect(self) -> None:
+        """Opens the connection"""
+        sock = socket.create_connection((self.addr, self.port), timeout=long_s)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        self.sock = sock
+        self.backoff = short_s  # connected, so reset backoff
+
+    def _peer_closed(self) -> bool:
+        """Checks, without waiting, whether the other end closed the connection. The kernel still accepts a write after the peer closes or restarts, so a frame sent then would be lost
+
+        Returns:
+            bool: whether the connection is closed or broken
+        """
+        assert self.sock is not None
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:  # nothing to read, not even EOF
+                return False
+            return self.sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def close(self) -> None:
+        """Closes the connection. The next send reconnects"""
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+    def send(self, s: str, tries: int = tries) -> bool:
+        """Sends one message without waiting for a reply, so several commands can be in flight at once. Reconnects if needed
+
+        Args:
+            s (str): message to send
+            tries (int, optional): reconnection attempts before giving up. Defaults to tries.
+
+        Returns:
+            bool: whether the message was sent
+        """
+        frame = encode_frame(s)
+        with self.lock:
+            for attempt in range(tries + 1):
+                try:
+                    if self.sock is not None and self._peer_closed():
+                        print(f"{self.addr}:{self.port} closed, reconnecting", flush=True)
+                        self.close()
+                    if self.sock is None:
+                        self._connect()
+                    assert self.sock is not None
+                    self.sock.sendall(frame)
+                    return True
+                except OSError as e:
+                    print(f"{self.addr}:{self.port} attempt {attempt}: {e}", flush=True)
+                    self.close()
+                    if attempt < tries:
+                        time.sleep(self.backoff)
+                        self.backoff = min(self.backoff * 2, backoff_max)
+        return False
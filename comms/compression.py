@@ -0,0 +1,282 @@
+"""
+Compression for messages sent over the LoRa link. Every message starts with one codec byte followed by the (possibly compressed) payload. Each message is compressed on its own, so a lost or restarted peer never leaves the other side with a stale compression state.
+
+zlib uses a preset dictionary made from a Py3SQM .dat header and typical data rows and sensor replies, so even short messages compress well. lzma has no preset dictionary but wins on long file chunks. Each message is sent with whichever of raw, zlib or lzma is smallest.
+
+At startup each side sends a hello listing the codecs it can decode. Until the peer's hello arrives, everything is sent raw.
+"""
+
+import math
+import random
+import zlib
+from typing import Callable
+
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+# module imports
+import configs
+import lora_link
+
+# settings
+lora_codecs = configs.lora_codecs
+rsync_chunk = configs.rsync_chunk
+lora_payload = configs.lora_payload
+max_frame_len = configs.max_frame_len
+
+# codec bytes
+RAW = 0x00
+ZLIB = 0x01
+LZMA = 0x02
+HELLO = 0xFF  # not a codec: payload is the list of codecs the sender can decode
+NAMES = {"zlib": ZLIB, "lzma": LZMA}
+
+# preset dictionary for zlib. Most common strings go last, where they are cheapest to reference
+ZDICT = b"""# Definition of the community standard for skyglow observations 1.0
+# URL: http://www.darksky.org/NSBM/sdf1.0.pdf
+# Number of header lines: 35
+# This data is released under the following license: ODbL 1.0 http://opendatacommons.org/licenses/odbl/summary/
+# Device type: SQM-LU
+# Instrument ID:
+# Data supplier:
+# Location name:
+# Position:
+# Local timezone: UTC-5
+# Time Synchronization: NTP
+# Moving / Stationary position: STATIONARY
+# Moving / Fixed look direction: FIXED
+# Number of channels: 1
+# Filters per channel: HOYA CM-500
+# Measurement direction per channel: 0., 0.
+# Field of view: 20
+# Number of fields per line: 6
+# SQM serial number:
+# SQM firmware version:
+# SQM cover offset value:
+# SQM readout test ix: i,00000004,00000003,00000023,00002142
+# SQM readout test rx: r, 19.29m,0000005915Hz,0000000000c,0000000.000s, 027.0C
+# SQM readout test cx: c,00000019.84m,0000151.517s, 022.2C,00000008.71m, 023.2C
+# Comment:
+# Comment:
+# Comment:
+# Comment:
+# Comment: Capture program: PySQM
+# blank line 30
+# blank line 31
+# blank line 32
+# UTC Date & Time, Local Date & Time, Temperature, Counts, Frequency, MSAS
+# YYYY-MM-DDTHH:mm:ss.fff;YYYY-MM-DDTHH:mm:ss.fff;Celsius;number;Hz;mag/arcsec^2
+# END OF HEADER
+rsync chunk
+r, 19.23m,0000005915Hz,0000000000c,0000000.000s, 027.0C
+r, 20.51m,0000000012Hz,0000000000c,0000000.000s, 015.4C
+2024-05-01T03:00:00.000;2024-04-30T22:00:00.000;15.36;0.000;25.341;19.234
+2024-05-01T03:01:00.000;2024-04-30T22:01:00.000;15.34;0.000;25.117;19.243
+"""
+
+
+class Compressor:
+    """Negotiates codecs with the peer and packs/unpacks messages"""
+
+    def __init__(self, send: Callable[[bytes], None]) -> None:
+        """
+        Args:
+            send (Callable[[bytes], None]): sends one message to the peer, eg. Link.send
+        """
+        self.send = send
+        self.offered = {NAMES[n] for n in lora_codecs if n in NAMES}
+        if lzma is None:
+            self.offered.discard(LZMA)
+        self.agreed: set[int] = set()  # codecs the peer can decode
+
+    def start(self) -> None:
+        """Tells the peer which codecs we can decode and asks for its list"""
+        self.send(self._hello(ask=True))
+
+    def _hello(self, ask: bool) -> bytes:
+        """Builds a hello message
+
+        Args:
+            ask (bool): whether the peer should answer with its own hello
+
+        Returns:
+            bytes: hello message
+        """
+        return bytes([HELLO, int(ask)]) + bytes(sorted(self.offered))
+
+    def encode(self, payload: bytes) -> bytes:
+        """Compresses a message with whichever agreed codec makes it smallest
+
+        Args:
+            payload (bytes): message to send
+
+        Returns:
+            bytes: codec byte followed by the encoded message
+        """
+        best = bytes([RAW]) + payload
+        for codec in self.agreed:
+            packed = bytes([codec]) + compress(codec, payload)
+            if len(packed) < len(best):
+                best = packed
+        return best
+
+    def decode(self, message: bytes) -> bytes | None:
+        """Unpacks a message from the peer. Hellos are handled here
+
+        Args:
+            message (bytes): message as delivered by the link
+
+        Returns:
+            bytes | None: original message, or None if there is nothing to pass on
+        """
+        if not message:
+            return None
+        codec = message[0]
+        if codec == HELLO:
+            self.agreed = self.offered & set(message[2:])
+            names = [n for n, c in NAMES.items() if c in self.agreed]
+            p(f"Radio compression: {', '.join(names) or 'none'}")
+            if message[1:2] == b"\x01":  # peer (re)started and wants our list
+                self.send(self._hello(ask=False))
+            return None
+        try:
+            return decompress(codec, message[1:])
+        except Exception as e:  # zlib.error, lzma.LZMAError or unknown codec
+            p(f"Dropping message that could not be decompressed: {e}")
+            return None
+
+
+def compress(codec: int, data: bytes) -> bytes:
+    """Compresses with one codec
+
+    Args:
+        codec (int): ZLIB or LZMA
+        data (bytes): data to compress
+
+    Returns:
+        bytes: compressed data, without codec byte
+    """
+    if codec == ZLIB:  # raw deflate: no zlib header or checksum, the link has a CRC
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zdict=ZDICT)
+        return c.compress(data) + c.flush()
+    if codec == LZMA and lzma is not None:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_lzma_filters())
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress(codec: int, data: bytes) -> bytes:
+    """Undoes compress
+
+    Args:
+        codec (int): RAW, ZLIB or LZMA
+        data (bytes): data after the codec byte
+
+    Raises:
+        ValueError: if the codec is unknown or the result is longer than max_frame_len
+
+    Returns:
+        bytes: original data
+    """
+    if codec == RAW:
+        return data
+    if codec == ZLIB:
+        d = zlib.decompressobj(-15, zdict=ZDICT)
+        out = d.decompress(data, max_frame_len)
+    elif codec == LZMA and lzma is not None:
+        d = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=_lzma_filters())
+        out = d.decompress(data, max_frame_len)
+    else:
+        raise ValueError(f"Unknown codec {codec}")
+    if len(out) >= max_frame_len:
+        raise ValueError(f"Message expands past max_frame_len {max_frame_len}")
+    return out
+
+
+def _lzma_filters() -> list[dict]:
+    """LZMA2 settings. A small dictionary keeps memory use low on the RPi; messages are only a few KB anyway
+
+    Returns:
+        list[dict]: filter chain for lzma
+    """
+    return [{"id": lzma.FILTER_LZMA2, "preset": 9, "dict_size": 1 << 16}]  # type: ignore
+
+
+def _on_air(n: int) -> int:
+    """Bytes transmitted to deliver an n-byte message, counting frame overhead and one ACK per frame
+
+    Args:
+        n (int): message length
+
+    Returns:
+        int: bytes on air
+    """
+    frames = max(math.ceil(n / lora_payload), 1)
+    return n + frames * 2 * lora_link.OVERHEAD
+
+
+def sample_month(days: int = 30) -> bytes:
+    """Makes a synthetic month of Py3SQM .dat rows: one reading a minute, ten hours a night
+
+    Args:
+        days (int, optional): nights to generate. Defaults to 30.
+
+    Returns:
+        bytes: rows as they appear in a .dat file
+    """
+    rng = random.Random(0)
+    rows: list[str] = []
+    for day in range(days):
+        msas, temp = 19.5 + rng.uniform(-1, 1), 15 + rng.uniform(-5, 5)
+        for minute in range(600):
+            t = 22 * 60 + minute
+            d, h, m = 1 + day + t // 1440, (t // 60) % 24, t % 60
+            utc = f"2024-05-{d + (h + 5) // 24:02d}T{(h + 5) % 24:02d}:{m:02d}:00.000"
+            msas += rng.gauss(0, 0.02)
+            temp += rng.gauss(0, 0.01)
+            freq = 10 ** ((19.0 - msas) / 2.5) * 25
+            rows.append(
+                f"{utc};2024-05-{d:02d}T{h:02d}:{m:02d}:00.000;{temp:.2f};0.000;{freq:.3f};{msas:.3f}\n"
+            )
+    return "".join(rows).encode(configs.utf8)
+
+
+def benchmark(days: int = 30) -> None:
+    """Prints bytes on air for syncing a month of .dat rows and for batched sensor replies, raw and with each codec
+
+    Args:
+        days (int, optional): nights of data to simulate. Defaults to 30.
+    """
+    month = sample_month(days)
+    chunks = [month[i : i + rsync_chunk] for i in range(0, len(month), rsync_chunk)]
+    header = b"rsync chunk 2024-05/20240501_macleish.dat 0\n"
+    chunks = [header + c for c in chunks]
+    rx = b"r, 19.23m,0000005915Hz,0000000000c,0000000.000s, 027.0C\r\n"
+    batches = [rx * 5] * (days * 120)  # a batch of 5 replies every 5 minutes
+
+    for label, messages in (("month of .dat rows", chunks), ("rx batches", batches)):
+        raw = sum(_on_air(len(m) + 1) for m in messages)
+        p(f"{label}: {len(messages)} messages, raw {raw} bytes on air")
+        for name, codec in NAMES.items():
+            if codec == LZMA and lzma is None:
+                continue
+            packed = sum(_on_air(len(compress(codec, m)) + 1) for m in messages)
+            p(f"  {name}: {packed} bytes, {100 * (1 - packed / raw):.1f}% saved")
+        best = Compressor(lambda b: None)
+        best.agreed = best.offered
+        packed = sum(_on_air(len(best.encode(m))) for m in messages)
+        p(f"  smallest per message: {packed} bytes, {100 * (1 - packed / raw):.1f}% saved")
+
+
+def p(s: str) -> None:
+    """Flushes buffer and prints. Enables print in threads
+
+    Args:
+        s (str): string to print
+    """
+    print(s, flush=True)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -20,6 +20,17 @@ R_ADDR = "/dev/ttyUSB_LORA"  # main RPi's port to the LoRa device
 R_BAUD = 115200  # baud rate
 
 
+"""LoRa link framing"""
+lora_payload = 200  # largest payload per radio frame in bytes
+lora_window = 8  # frames in flight before waiting for acknowledgements
+lora_ack_timeout = 3  # seconds to wait for an acknowledgement before resending
+rsync_chunk = 4096  # bytes of a data file sent per radio message when syncing
+manifest_name = ".rsync_manifest.json"  # index of data files, kept in the data directory
+sync_state_name = ".rsync_child.json"  # last child file list fully synced, kept in the main RPi's data directory
+rsync_page = 1000  # largest page of the file list sent over radio, in bytes
+lora_codecs = ("zlib", "lzma")  # compression the radio may use; empty sends raw
+
+
 """Info about accessory RPi, if it exists"""
 acc_repo = "/home/pi1/MotheterRemote/comms"  # path to this repo directory
 acc_data_path = "/home/pi1/mothdata"  # where sensor stores its data (NOT in repo)
@@ -32,6 +43,7 @@ device_type = "SQM-LU"  # must be SQM-LU or SQM-LE
 device_addr = "/dev/ttyUSB_SQMsensor"  # port on RPi that connects to the sensor
 debug = True  # whether to raise exceptions if something goes a little sideways
 tries = 3  # how many reconnection attempts to make
+event_reader = True  # wake on incoming bytes instead of polling the sensor
 
 
 """Sensor connection for LU only"""
@@ -48,7 +60,8 @@ LE_SOCK_BUF = 256  # socket buffer size for SQM-LE connections
 """Socket info"""
 host_server = 12345  # host server port
 rpi_server = 54321  # rpi server port
-msg_len = 1024  # length of message to send through socket
+max_frame_len = 1048576  # largest message accepted through socket, in bytes
+backoff_max = 60  # longest wait between reconnection attempts in seconds
 
 
 """Text/byte formatting"""
@@ -66,3 +79,5 @@ short_s = 0.1  # time to wait for short tasks (eg. between sending messages in a
 
 """Miscellaneous"""
 remote_start = False  # whether to start rpi_wifi remotely
+buffer_size = 1000  # most sensor/radio lines held before the oldest are dropped
+asyncio_mode = False  # run rpi_wifi on a single asyncio event loop instead of threads
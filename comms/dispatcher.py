@@ -0,0 +1,101 @@
+"""
+Ties sensor replies to the commands that caused them. Each command gets a future that resolves as soon as a line with the matching reply prefix arrives. Reply prefixes follow the formats handled in parse_response.sort_response.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+def expected_prefix(command: str) -> str | tuple[str, ...] | None:
+    """Gets the start of the reply that a command produces
+
+    Example: rx -> "r,", L40000000000x -> "L4,", zcal5...x -> "z,5"
+
+    Args:
+        command (str): command sent to the sensor
+
+    Returns:
+        str | tuple[str, ...] | None: reply prefix(es), or None if the command produces no reply
+    """
+    c = command.strip()
+    if c == "":
+        return None
+    match c[0]:
+        case "r" | "c" | "i" | "I" | "s" | "S":  # rx, cx, ix, Ix, sx, S,...x
+            return f"{c[0]},"
+        case "p" | "P":  # set interval period or threshold, replies with Ix format
+            return "I,"
+        case "z":
+            if c.startswith("zcal") and c[4:5].isdigit():  # manual calibration
+                return f"z,{c[4]}"
+            return "z"  # arm/disarm calibration, eg. zAaL
+        case "L":
+            match c[1:2]:
+                case "2" | "s":  # erase flash chip and sleep don't reply
+                    return None
+                case "m":  # Lmx reads the trigger mode, reply is LM
+                    return "LM,"
+                case "P":  # LPS, LPM, LPT set logging interval, reply is LI
+                    return "LI,"
+                case "C" | "c":  # clock read is Lc, clock set is acknowledged as LC
+                    return ("Lc,", "LC,")
+                case _:
+                    return f"L{c[1:2]},"
+        case _:
+            return c[0]
+
+
+class Dispatcher:
+    """Matches incoming lines against commands waiting for a reply"""
+
+    def __init__(self) -> None:
+        # commands waiting for a reply, oldest first
+        self.pending: list[tuple[str | tuple[str, ...], Future[str]]] = []
+        self.lock = threading.Lock()
+
+    def submit(self, command: str) -> Future[str]:
+        """Registers a command before it is sent
+
+        Args:
+            command (str): command about to be sent
+
+        Returns:
+            Future[str]: resolves with the matching reply line
+        """
+        f: Future[str] = Future()
+        prefix = expected_prefix(command)
+        if prefix is None:
+            f.set_result("")  # nothing will come back
+            return f
+        with self.lock:
+            self.pending.append((prefix, f))
+        return f
+
+    def feed(self, line: str) -> bool:
+        """Resolves the oldest command waiting for this kind of reply
+
+        Args:
+            line (str): complete line from the sensor
+
+        Returns:
+            bool: True if the line answered a pending command
+        """
+        with self.lock:
+            for i, (prefix, f) in enumerate(self.pending):
+                if line.startswith(prefix):
+                    del self.pending[i]
+                    break
+            else:
+                return False
+        f.set_result(line)
+        return True
+
+    def cancel(self, f: Future[str]) -> None:
+        """Stops waiting for a reply, eg. after a timeout
+
+        Args:
+            f (Future[str]): future returned by submit
+        """
+        with self.lock:
+            self.pending = [(p, g) for (p, g) in self.pending if g is not f]
+        f.cancel()
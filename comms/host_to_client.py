@@ -11,6 +11,7 @@ import time
 # python module imports
 import ui_commands
 import configs
+import channel
 import parse_response
 
 # WiFi/Ethernet connection info
@@ -31,7 +32,6 @@ rpi_repo = configs.rpi_repo
 utf8 = configs.utf8
 EOF = configs.EOF
 EOL = configs.EOL
-msg_len = configs.msg_len
 
 # timing
 long_s = configs.long_s
@@ -55,9 +55,10 @@ class Server:
 
         # start TCP server
         try:
-            self.server = socketserver.TCPServer(
+            self.server = ThreadedTCPServer(
                 (host_addr, host_server), ThreadedTCPRequestHandler
             )
+            self.server.daemon_threads = True  # connections persist
         except Exception as e:
             print(e)
             self.server.server_close()
@@ -68,29 +69,25 @@ class Server:
         server_thread.start()
         print("Server loop running in", server_thread.name)
 
+        # persistent connection to RPi, opened on first message
+        self.rpi = channel.Channel(rpi_addr, rpi_server)
+
     def send_to_rpi(self, s: str) -> None:
-        """simple socket connection that forwards a single message to the host, then dies
+        """Forwards a message to the RPi over the persistent connection. Doesn't wait for a reply, so several commands can be in flight
 
         Args:
             s (str): message to send
         """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        try:
-            sock.connect((rpi_addr, rpi_server))  # connect to server
-            sock.sendall(f"{s}".encode(utf8))  # send everything
+        if self.rpi.send(s):
             print(f"Sent: {s}")
-        except Exception as e:
-            print(e)  # print error without halting
-            print("Client RPi might not be running rpi_wifi.py")
-            print(f"rpi_addr: {rpi_addr}, rpi_server: {rpi_server}")
-            if remote_start:
-                _start_listener()  # force RPi to run rpi_wifi.py
-                time.sleep(long_s)  # give time for program to start before continuing
-            else:
-                print("Wait approx. 1 minute before trying again.")
-        finally:
-            sock.close()  # die
+            return
+        print("Client RPi might not be running rpi_wifi.py")
+        print(f"rpi_addr: {rpi_addr}, rpi_server: {rpi_server}")
+        if remote_start:
+            _start_listener()  # force RPi to run rpi_wifi.py
+            time.sleep(long_s)  # give time for program to start before continuing
+        else:
+            print("Wait approx. 1 minute before trying again.")
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
@@ -103,19 +100,26 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
     """overwrites BaseRequestHandler with custom handler"""
 
     def handle(self):
-        """custom request handler for TCP threaded server"""
+        """custom request handler for TCP threaded server. Reads frames until the RPi closes the connection"""
         # ensure request is socket
         if not isinstance(self.request, socket.socket):
             print("ThreadedTCPRequestHandler: self.request not socket")
             return
 
-        # when request comes in, decode and format it
-        self.data = self.request.recv(msg_len).decode(utf8).strip()
         cur_thread = threading.current_thread()
-        print(
-            f"Received from {self.client_address[0]} in {cur_thread.name}: {self.data}"
-        )
-        _print_formatted(self.data)  # print formatted data to terminal
+        while True:
+            try:
+                m = channel.recv_frame(self.request)
+            except (OSError, ValueError) as e:
+                print(f"Dropping connection from {self.client_address[0]}: {e}")
+                return
+            if m is None:  # RPi closed connection
+                return
+            self.data = m.strip()
+            print(
+                f"Received from {self.client_address[0]} in {cur_thread.name}: {self.data}"
+            )
+            _print_formatted(self.data)  # print formatted data to terminal
 
 
 def _start_listener() -> None:
@@ -0,0 +1,136 @@
+"""
+Event-driven reader for serial ports and sockets. Sleeps in select() until bytes arrive, then splits complete lines out of a reusable buffer and hands them to a consumer straight away.
+"""
+
+import selectors
+import socket
+import threading
+from typing import Any, Callable
+
+# module imports
+import configs
+
+# text encoding
+EOL = configs.EOL
+utf8 = configs.utf8
+
+
+class LineReader:
+    """Wakes only when the source is readable. Works on anything with a fileno(), so pyserial ports on POSIX and sockets both qualify."""
+
+    def __init__(
+        self,
+        source: Any,
+        read: Callable[[], bytes],
+        on_line: Callable[[str], None],
+        delimiter: str = EOL,
+        strip: bool = True,
+        on_chunk: Callable[[bytes], None] | None = None,
+    ) -> None:
+        """
+        Args:
+            source (Any): serial port or socket to watch
+            read (Callable[[], bytes]): reads whatever is available from source without blocking for long
+            on_line (Callable[[str], None]): called with each complete line
+            delimiter (str, optional): where to split the stream. Defaults to EOL.
+            strip (bool, optional): whether to strip whitespace and skip blank lines. Defaults to True.
+            on_chunk (Callable[[bytes], None] | None, optional): if given, receives raw bytes as they arrive instead of splitting lines, eg. for a binary framing layer. Defaults to None.
+        """
+        self.source = source
+        self.read = read
+        self.on_line = on_line
+        self.delimiter = delimiter.encode(utf8)
+        self.strip = strip
+        self.on_chunk = on_chunk
+        self.buf = bytearray()  # reused between reads, holds partial line
+        self.live = False
+        self.t: threading.Thread | None = None
+        self._wake_r: socket.socket | None = None  # lets stop() interrupt select(), made in start()
+        self._wake_w: socket.socket | None = None
+
+    def fileno(self) -> int:
+        """File descriptor being watched
+
+        Returns:
+            int: source's file descriptor
+        """
+        return self.source.fileno()
+
+    def feed(self, chunk: bytes) -> None:
+        """Adds bytes to the buffer and passes on every complete line
+
+        Args:
+            chunk (bytes): newly received bytes
+        """
+        if self.on_chunk is not None:
+            self.on_chunk(chunk)
+            return
+        self.buf.extend(chunk)
+        start = 0
+        while True:
+            end = self.buf.find(self.delimiter, start)
+            if end == -1:
+                break
+            line = self.buf[start:end].decode(utf8, errors="replace")
+            start = end + len(self.delimiter)
+            if self.strip:
+                line = line.strip()
+                if line == "":  # skip blank lines, e.g. the \n of \r\n
+                    continue
+            self.on_line(line)
+        del self.buf[:start]  # keep only the partial line
+
+    def on_readable(self) -> bool:
+        """Reads once from the source. Call when select() says the source is readable
+
+        Returns:
+            bool: False if the source has closed
+        """
+        try:
+            chunk = self.read()
+        except Exception as e:
+            print(f"LineReader: {e}", flush=True)
+            return False
+        if isinstance(self.source, socket.socket) and chunk == b"":
+            return False  # readable socket with no data means peer closed it
+        if chunk:
+            self.feed(chunk)
+        return True
+
+    def start(self) -> None:
+        """Starts reading in a dedicated thread"""
+        self._wake_r, self._wake_w = socket.socketpair()  # closed when the thread exits
+        self.live = True
+        self.t = threading.Thread(target=self._run)
+        self.t.daemon = True
+        self.t.start()
+
+    def stop(self) -> None:
+        """Stops the reader thread and waits for it to exit"""
+        self.live = False
+        if self._wake_w is None:  # never started
+            return
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:  # thread already exited and closed it
+            pass
+        if self.t is not None and self.t is not threading.current_thread():
+            self.t.join()
+
+    def _run(self) -> None:
+        """Select loop. Runs in dedicated thread"""
+        assert self._wake_r is not None and self._wake_w is not None
+        sel = selectors.DefaultSelector()
+        sel.register(self.source, selectors.EVENT_READ, "source")
+        sel.register(self._wake_r, selectors.EVENT_READ, "wake")
+        try:
+            while self.live:
+                for key, _ in sel.select():
+                    if key.data == "wake":
+                        self._wake_r.recv(64)  # drain, then re-check self.live
+                    elif not self.on_readable():
+                        self.live = False
+        finally:
+            sel.close()
+            self._wake_r.close()
+            self._wake_w.close()
@@ -8,11 +8,16 @@ import threading
 import os
 
 # module imports
+import compression
 import configs
+import line_reader
+import lora_link
+import manifest
 import sensor
 
 # where to store data
 acc_data_path = configs.acc_data_path
+rsync_chunk = configs.rsync_chunk
 
 # radio connection
 ADDR = configs.R_ADDR
@@ -20,7 +25,6 @@ BAUD = configs.R_BAUD
 
 # text encoding
 EOL = configs.EOL
-EOF = configs.EOF
 utf8 = configs.utf8
 
 # device info
@@ -48,30 +52,41 @@ class Ser:
         except Exception as e:
             p(f"{e}")  # if device not connected, quit
             exit()
+        self.manifest = manifest.Manifest(acc_data_path)  # index of data files
         self.device.start_continuous_read()  # start device listener
         time.sleep(mid_s)  # wait for setup
-        self.radio = threading.Thread(target=self._listen_radio)  #  radio listener
+        self.link = lora_link.Link(self.s.write, self._on_radio_message)
+        self.codec = compression.Compressor(self.link.send)
+        self.radio = line_reader.LineReader(  #  radio listener
+            self.s,
+            lambda: self.s.read(self.s.in_waiting or 1),
+            p,
+            on_chunk=self.link.feed,  # link reassembles messages
+        )
         self.sensor = threading.Thread(target=self._listen_sensor)  #  sensor listener
         self.radio.start()
+        self.link.start()  # announce to parent, start retransmission timer
+        self.codec.start()  # agree on compression with parent
         self.sensor.start()
 
-    def _listen_radio(self) -> None:
-        """Get incoming radio messages, send them to device"""
-        p(f"Radio listener running in {threading.current_thread().name}")
-        while True:
+    def _on_radio_message(self, payload: bytes) -> None:
+        """Handles one message from the parent, delivered by the link layer
+
+        Args:
+            payload (bytes): complete message
+        """
+        payload = self.codec.decode(payload)
+        if payload is None:  # compression hello, or undecodable
+            return
+        msg_arr = payload.decode(utf8, errors="replace").split(EOL)  # decode and split
+        for msg in msg_arr:  # go through each message
+            m = msg.strip()  # strip whitespace
+            p(f"Received over radio: {m}")
             try:
-                time.sleep(mid_s)  # wait
-                full_msg = self.s.read_until(EOF.encode(utf8))  # get message
-                msg_arr = full_msg.decode(utf8).split(EOL)  # decode and split
-
-                for msg in msg_arr:  # go through each message
-                    time.sleep(short_s)
-                    m = msg.strip()  # strip whitespace
-                    p(f"Received over radio: {m}")
-                    if "rsync" in m:
-                        self._rsync(m)  # deal with rsync
-                    else:
-                        self.device.rpi_to_client(m)  # send command
+                if "rsync" in m:
+                    self._rsync(m)  # deal with rsync
+                else:
+                    self.device.rpi_to_client(m)  # send command
             except Exception as e:
                 print(e)
 
@@ -79,8 +94,7 @@ class Ser:
         """Get incoming sensor messages, send them over radio"""
         p(f"Listener loop running in {threading.current_thread().name}")
         while True:
-            time.sleep(mid_s)
-            resp = self.device.client_to_rpi()  # get response from device
+            resp = self.device.client_to_rpi(timeout=None)  # wait for device
             if len(resp) != 0:  # if response has data
                 p(f"Received from sensor: {resp}")
                 self._send(resp)
@@ -96,7 +110,7 @@ class Ser:
         else:
             m = msg
         p(f"Sending over radio: {m}")
-        self.s.write((m + EOF).encode(utf8))
+        self.link.send(self.codec.encode(m.encode(utf8)))
 
     def _send_loop(self) -> None:
         """Ui for debugging only. Sends message over radio"""
@@ -111,70 +125,55 @@ class Ser:
             s (str): request to handle
         """
         p("Handling rsync")
-        if "list" in s:  # file list requested
-            p("Sending file list")
-            self._send(self._get_file_list())
-        else:  # must be asking for specific file
-            name = s.replace("rsync ", "").strip()  # rest of request is path
-            if not os.path.isfile(name):  # if wrong, ignore
+        if s.startswith("rsync list"):  # file list requested
+            parts = s.split()  # rsync list <manifest id> <version>
+            if len(parts) == 4 and parts[3].isdigit():
+                pages = self._get_file_list(parts[2], int(parts[3]))
+            else:
+                pages = self._get_file_list()
+            for page in pages:  # parent acts on each page as it arrives
+                self.link.send(self.codec.encode(page))
+        else:  # must be asking for specific file, optionally from an offset
+            name, offset = s.replace("rsync ", "", 1).strip(), 0
+            if " " in name and name.rsplit(" ", 1)[1].isdigit():
+                name, at = name.rsplit(" ", 1)
+                offset = int(at)
+            path = os.path.normpath(os.path.join(acc_data_path, name))
+            inside = path.startswith(os.path.normpath(acc_data_path) + os.sep)
+            if not inside or not os.path.isfile(path):  # if wrong, ignore
                 p(f"Path {name} not found")
                 return
 
-            p(f"Reading file {name}")
-            short = name.rfind("/")  # find where name starts at right of path
-            short_name = name[short + 1 :]  # get name
-            b = bytearray(f"rsync {short_name} {EOL}", utf8)  # prepend file name
-
-            with open(name, "rb") as file:
-                text = file.read()  # get text from file as bytes
-                b.extend(text)  # append to bytearray
-                b.extend(EOF.encode(utf8))  # EOF to finish
-                p(f"File to send: {b.decode()}")
+            name = os.path.relpath(path, acc_data_path)  # parent stores it under this
+            p(f"Sending {name} from byte {offset}")
+            with open(path, "rb") as file:
+                file.seek(offset)  # parent already has everything before this
+                while True:
+                    chunk = file.read(rsync_chunk)
+                    if not chunk:
+                        break
+                    header = f"rsync chunk {name} {offset}\n".encode(utf8)
+                    msg = self.codec.encode(header + chunk)
+                    self.link.send(msg)  # queued, sent as acks come in
+                    offset += len(chunk)
+
+    def _get_file_list(self, peer_id: str = "-", since: int = 0) -> list[bytes]:
+        """Gets the manifest entries of .dat files in the data directory on this RPi that changed since the parent's last list
 
-            self.s.write(b)  # send bytearray
-
-    def _get_file_list(self) -> str:
-        """Gets string list of all .dat files in the data directory on this RPi, with the corresponding date of modification
+        Args:
+            peer_id (str, optional): manifest id the parent's version refers to. Defaults to "-", which gets every file.
+            since (int, optional): last manifest version the parent has seen. Defaults to 0.
 
         Returns:
-            str: name and modified date for each file, concatenated
+            list[bytes]: list pages from manifest.encode_list, each prefixed with "rsync files "
         """
-
-        def _all_file_list(path: str = "") -> list[str]:
-            """Recursively finds all .dat files in the RPi data directory.
-
-            Args:
-                path (str, optional): current path to search. Defaults to current working directory.
-
-            Returns:
-                list[str]: all .dat files in current directory
-            """
-            to_return: list[str] = []
-            try:
-                file_list = os.listdir(path)  # get list of files
-            except:
-                print(f"Cannot find directory {path}, returning")
-                return []  # something went wrong, stop recursing
-
-            for entry in file_list:
-                fullPath = os.path.join(path, entry)
-                if os.path.isdir(fullPath):  # if directory, recurse on it
-                    to_return.extend(_all_file_list(fullPath))
-                if fullPath.endswith(".dat"):  # if .dat file, add to list
-                    to_return.append(fullPath)
-            return to_return
-
-        l = _all_file_list(acc_data_path)
-        a: list[str] = []
-        a.append("rsync files")  # prepend header for parent processing
-        for file in l:
-            if file.endswith(".dat"):  # filter for dat files
-                ctime = os.path.getmtime(file)  # seconds since 1970
-                s = f"{file};{ctime}"  # entry with name and time
-                a.append(s)
-        c = str(a)  # convert array to string
-        p(f"TO SEND: {c}")
-        return c
+        self.manifest.refresh()
+        self.manifest.save()
+        changed = self.manifest.since(peer_id, since)
+        pages = manifest.encode_list(self.manifest.id, self.manifest.version, changed)
+        n = len(self.manifest.entries)
+        p(f"Sending {len(changed)} changed files of {n} in {len(pages)} pages")
+        return [b"rsync files " + page for page in pages]
 
 
 def p(s: str) -> None:
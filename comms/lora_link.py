@@ -0,0 +1,265 @@
+"""
+Binary framing and selective-repeat retransmission for the LoRa link between lora_parent and lora_child.
+
+Frame layout (big-endian):
+    preamble (2 bytes, A5 5A) | type (1) | sequence number (2) | payload length (2) | payload | CRC-16/CCITT (2)
+
+The CRC covers everything from the type byte to the end of the payload. Messages longer than lora_payload are split into several DATA frames; the first fragment has the START bit and every fragment but the last has the MORE bit set in its type byte. Each DATA frame is acknowledged on its own, so only lost or corrupted frames are sent again.
+
+Before sending DATA, each side announces the sequence number its stream continues from with a SYNC frame. A side that has just started sets the payload of its SYNC to 1, which asks the peer to announce its own stream again, so either end can restart without the other losing its place.
+"""
+
+import binascii
+import struct
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+# module imports
+import configs
+
+# link settings
+lora_payload = configs.lora_payload
+lora_window = configs.lora_window
+lora_ack_timeout = configs.lora_ack_timeout
+
+# timing
+short_s = configs.short_s
+
+PREAMBLE = b"\xa5\x5a"
+HEADER = struct.Struct("!BHH")  # type, sequence number, payload length
+CRC = struct.Struct("!H")
+OVERHEAD = len(PREAMBLE) + HEADER.size + CRC.size  # bytes added to every payload
+SEQ_MOD = 1 << 16
+
+# frame types
+DATA = 0x01  # carries (part of) a message
+ACK = 0x02  # acknowledges one DATA frame
+SYNC = 0x03  # announces the sequence number the sender's stream continues from
+SYNC_ACK = 0x04  # acknowledges SYNC
+MORE = 0x80  # flag: another fragment of this message follows
+START = 0x40  # flag: first fragment of a message
+FLAGS = MORE | START
+
+
+def encode_frame(kind: int, seq: int = 0, payload: bytes = b"") -> bytes:
+    """Builds one frame
+
+    Args:
+        kind (int): frame type, optionally with MORE set
+        seq (int, optional): sequence number. Defaults to 0.
+        payload (bytes, optional): frame payload. Defaults to b"".
+
+    Returns:
+        bytes: frame ready to write to the radio
+    """
+    body = HEADER.pack(kind, seq, len(payload)) + payload
+    return PREAMBLE + body + CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+
+class Link:
+    """Reliable, in-order message delivery over the radio's serial stream"""
+
+    def __init__(
+        self, write: Callable[[bytes], object], on_message: Callable[[bytes], None]
+    ) -> None:
+        """
+        Args:
+            write (Callable[[bytes], object]): writes bytes to the radio
+            on_message (Callable[[bytes], None]): called with each complete message, in order
+        """
+        self.write = write
+        self.on_message = on_message
+        self.lock = threading.Lock()
+        self.buf = bytearray()  # received bytes not yet parsed into frames
+
+        # sending side
+        self.synced = False  # whether peer has acknowledged our SYNC
+        self.sync_sent = 0.0
+        self.sync_flag = b"\x01"  # 1 until the first SYNC_ACK: we just started
+        self.next_seq = 0
+        self.backlog: deque[tuple[int, bytes]] = deque()  # (flags, payload) not yet sent
+        self.unacked: dict[int, list] = {}  # seq -> [flags, payload, last sent]
+
+        # receiving side
+        self.announced = False  # whether peer has told us where its stream starts
+        self.expected = 0  # next sequence number to deliver
+        self.received: dict[int, tuple[int, bytes]] = {}  # out-of-order frames
+        self.fragments = bytearray()  # message being reassembled
+        self.skipping = False  # dropping the tail of a message whose start we missed
+
+        # statistics
+        self.retransmits = 0
+        self.bad_frames = 0
+
+        self.stopped = False  # set by stop(), nothing is written after it
+
+    def start(self) -> None:
+        """Announces this side to the peer and starts the retransmission timer"""
+        with self.lock:
+            self._send_sync()
+        t = threading.Thread(target=self._timer)
+        t.daemon = True
+        t.start()
+
+    def stop(self) -> None:
+        """Stops the retransmission timer and drops anything not yet sent, eg. before the radio port is closed"""
+        with self.lock:
+            self.stopped = True
+            self.backlog.clear()
+            self.unacked.clear()
+
+    def send(self, payload: bytes) -> None:
+        """Queues a message for reliable delivery. Never blocks: frames beyond the window wait until earlier ones are acknowledged
+
+        Args:
+            payload (bytes): message to send
+        """
+        parts = [
+            payload[i : i + lora_payload]
+            for i in range(0, max(len(payload), 1), lora_payload)
+        ]
+        with self.lock:
+            if self.stopped:
+                return  # the radio port is closed
+            for i, part in enumerate(parts):
+                flags = (START if i == 0 else 0) | (MORE if i < len(parts) - 1 else 0)
+                self.backlog.append((flags, part))
+            self._pump()
+
+    def feed(self, chunk: bytes) -> None:
+        """Parses bytes from the radio. Corrupted frames are dropped, valid ones handled
+
+        Args:
+            chunk (bytes): newly received bytes
+        """
+        messages: list[bytes] = []
+        with self.lock:
+            if self.stopped:
+                return  # would answer with ACKs on a closed port
+            self.buf.extend(chunk)
+            while True:
+                i = self.buf.find(PREAMBLE)
+                if i == -1:
+                    del self.buf[:-1]  # last byte may be the start of PREAMBLE
+                    break
+                del self.buf[:i]
+                if len(self.buf) < len(PREAMBLE) + HEADER.size:
+                    break
+                kind, seq, n = HEADER.unpack_from(self.buf, len(PREAMBLE))
+                if n > lora_payload:  # length is garbage, resync
+                    self.bad_frames += 1
+                    del self.buf[:1]
+                    continue
+                end = len(PREAMBLE) + HEADER.size + n + CRC.size
+                if len(self.buf) < end:
+                    break
+                body = bytes(self.buf[len(PREAMBLE) : end - CRC.size])
+                (crc,) = CRC.unpack_from(self.buf, end - CRC.size)
+                if crc != binascii.crc_hqx(body, 0xFFFF):  # corrupted, resync
+                    self.bad_frames += 1
+                    del self.buf[:1]
+                    continue
+                del self.buf[:end]
+                self._handle(kind, seq, body[HEADER.size :], messages)
+        for m in messages:  # deliver outside the lock so handlers can send
+            self.on_message(m)
+
+    def _handle(self, kind: int, seq: int, payload: bytes, out: list[bytes]) -> None:
+        """Acts on one valid frame. Caller must hold the lock
+
+        Args:
+            kind (int): frame type, with flags
+            seq (int): sequence number
+            payload (bytes): frame payload
+            out (list[bytes]): completed messages are appended here
+        """
+        base = kind & ~FLAGS
+        if base == DATA:
+            if not self.announced:
+                return  # unknown numbering, peer resends after our SYNC is answered
+            self.write(encode_frame(ACK, seq))
+            if (seq - self.expected) % SEQ_MOD >= lora_window:
+                return  # already delivered, our ACK was lost
+            self.received.setdefault(seq, (kind & FLAGS, payload))
+            while self.expected in self.received:  # deliver in order
+                flags, part = self.received.pop(self.expected)
+                self.expected = (self.expected + 1) % SEQ_MOD
+                if flags & START:
+                    self.fragments.clear()
+                    self.skipping = False
+                if self.skipping:
+                    self.skipping = bool(flags & MORE)
+                    continue
+                self.fragments.extend(part)
+                if not flags & MORE:
+                    out.append(bytes(self.fragments))
+                    self.fragments.clear()
+        elif base == ACK:
+            self.unacked.pop(seq, None)
+            self._pump()
+        elif base == SYNC:  # peer's stream continues from seq
+            restarted = payload == b"\x01"
+            if restarted or not self.announced:  # otherwise numbering is unchanged
+                self.announced = True
+                self.expected = seq
+                self.received.clear()
+                self.fragments.clear()
+                self.skipping = True  # until the next START, in case seq is mid-message
+            self.write(encode_frame(SYNC_ACK, seq))
+            if restarted and self.synced:  # peer lost track of our stream, announce again
+                self.synced = False
+                self._send_sync()
+        elif base == SYNC_ACK and not self.synced:
+            if seq != self._base():  # ACKs arrived since we sent SYNC, announce again
+                self._send_sync()
+                return
+            self.synced = True
+            self.sync_flag = b"\x00"
+            self._pump()
+
+    def _base(self) -> int:
+        """Oldest sequence number not yet acknowledged. Caller must hold the lock
+
+        Returns:
+            int: first unacknowledged sequence number, or the next one if all are acknowledged
+        """
+        return next(iter(self.unacked), self.next_seq)
+
+    def _send_sync(self) -> None:
+        """Sends SYNC. Caller must hold the lock"""
+        self.write(encode_frame(SYNC, self._base(), self.sync_flag))
+        self.sync_sent = time.monotonic()
+
+    def _pump(self) -> None:
+        """Sends queued fragments while the window has room. Caller must hold the lock"""
+        while (
+            self.synced
+            and self.backlog
+            and (self.next_seq - self._base()) % SEQ_MOD < lora_window
+        ):
+            flags, part = self.backlog.popleft()
+            seq = self.next_seq
+            self.next_seq = (self.next_seq + 1) % SEQ_MOD
+            self.unacked[seq] = [flags, part, time.monotonic()]
+            self.write(encode_frame(DATA | flags, seq, part))
+
+    def _timer(self) -> None:
+        """Resends anything not acknowledged in time. Runs in dedicated thread"""
+        while True:
+            time.sleep(short_s)
+            now = time.monotonic()
+            with self.lock:
+                if self.stopped:
+                    return
+                if not self.synced:
+                    if now - self.sync_sent > lora_ack_timeout:
+                        self._send_sync()
+                    continue
+                for seq, entry in self.unacked.items():
+                    flags, part, sent = entry
+                    if now - sent > lora_ack_timeout:
+                        self.write(encode_frame(DATA | flags, seq, part))
+                        entry[2] = now
+                        self.retransmits += 1
@@ -2,14 +2,19 @@
 Handles LoRa communications for the main RPi.
 """
 
-import time
 import serial
-import threading
+import json
 import os
+import compression
 import configs
+import line_reader
+import lora_link
+import manifest
+import ring_buffer
 
 # where to store data
 rpi_data_path = configs.rpi_data_path
+sync_state_path = os.path.join(rpi_data_path, configs.sync_state_name)
 
 # radio connection
 ADDR = configs.R_ADDR
@@ -17,7 +22,6 @@ BAUD = configs.R_BAUD
 
 # text encoding
 EOL = configs.EOL
-EOF = configs.EOF
 utf8 = configs.utf8
 
 # timing
@@ -29,32 +33,77 @@ short_s = configs.short_s
 class Radio:
     """Runs radio on serial"""
 
-    def __init__(self):
-        self.data: list[str] = []
+    def __init__(self, listen: bool = True):
+        """
+        Args:
+            listen (bool, optional): whether to start the listener thread. Pass False to drive make_reader() from an event loop instead. Defaults to True.
+        """
+        self.data = ring_buffer.RingBuffer()
+        self.resuming: dict[str, int] = {}  # file name -> offset re-requested after a gap
+        self.manifest = manifest.Manifest(rpi_data_path)  # index of data files
+        self.child_id, self.child_version = self._load_sync_state()  # last child list fully synced
+        self.listing = ("-", 0)  # child manifest id and version of the list being synced
+        self.listed = False  # whether every page of that list has been seen
+        self.wanted: dict[str, int] = {}  # file name -> size it must reach here
         self.s = serial.Serial(ADDR, BAUD, timeout=None)
-        self.l = threading.Thread(target=self._listen)  # listener in background
-        self.l.daemon = True
-        self.l.start()
+        self.link = lora_link.Link(self.s.write, self._on_message)
+        self.codec = compression.Compressor(self.link.send)
+        self.l = self.make_reader()  # listener in background
+        if listen:
+            self.l.start()
+        self.link.start()  # announce to child, start retransmission timer
+        self.codec.start()  # agree on compression with child
 
     def _start_listen(self) -> None:
         """Tries to start listener, if not already running"""
-        try:
-            self.l.start()
-        except RuntimeError:
+        if self.l.live:
             p("Listener already running")
+            return
+        self.l.start()
 
-    def _listen(self) -> None:
-        """Radio listener that runs continuously"""
-        while True:
-            time.sleep(short_s)  # wait
-            full_msg = self.s.read_until(EOF.encode(utf8))  # get message
+    def close(self) -> None:
+        """Stops the listener and the link's retransmissions, then closes the radio port"""
+        self.link.stop()
+        self.l.stop()
+        self.s.close()
+
+    def make_reader(self) -> line_reader.LineReader:
+        """Creates an event-driven reader that passes radio bytes to the link layer, without starting it
+
+        Returns:
+            line_reader.LineReader: reader for the radio port
+        """
+        return line_reader.LineReader(
+            self.s,
+            lambda: self.s.read(self.s.in_waiting or 1),
+            self._listen,
+            on_chunk=self.link.feed,  # link reassembles messages, calls _on_message
+        )
+
+    def _on_message(self, payload: bytes) -> None:
+        """Handles one message delivered by the link layer
+
+        Args:
+            payload (bytes): complete message
+        """
+        payload = self.codec.decode(payload)
+        if payload is None:  # compression hello, or undecodable
+            return
+        if payload.startswith(b"rsync chunk "):  # file bytes, keep undecoded
+            self._save_chunk(payload)
+        elif payload.startswith(b"rsync files "):  # page of child's file list
+            self._compare_files(payload[len(b"rsync files ") :])
+        else:
+            self._listen(payload.decode(utf8, errors="replace"))
 
-            if "rsync".encode(utf8) in full_msg:  # if rsync, handle separately
-                self._rsync_from_radio(full_msg.decode(utf8))
-            else:
-                msg_arr = full_msg.decode(utf8).split(EOL)  # decode and split
-                for msg in msg_arr:
-                    self.data.append(msg)  # put into buffer to be sent
+    def _listen(self, full_msg: str) -> None:
+        """Handles one complete radio message
+
+        Args:
+            full_msg (str): message
+        """
+        msg_arr = full_msg.split(EOL)  # split
+        self.data.extend(msg_arr)  # put into buffer to be sent
 
     def _send(self, msg: str | list[str] = "rx") -> None:
         """Sends message to child RPi over radio
@@ -66,17 +115,18 @@ class Radio:
             m = EOL.join(msg)
         else:
             m = msg
-        self.s.write((m + EOF).encode(utf8))
+        self.link.send(self.codec.encode(m.encode(utf8)))
 
-    def return_collected(self) -> list[str]:
+    def return_collected(self, timeout: float | None = 0) -> list[str]:
         """Returns all data gathered since last collection
 
+        Args:
+            timeout (float | None, optional): seconds to wait for data. 0 returns immediately, None waits forever. Defaults to 0.
+
         Returns:
             list[str]: messages to send
         """
-        d = self.data[:]  # pass by value, not reference
-        self.data.clear()  # clear buffer
-        return d
+        return self.data.drain(timeout=timeout)
 
     def send_loop(self) -> None:
         """ui for debugging only"""
@@ -92,123 +142,143 @@ class Radio:
         """
         if m == "rsync":  # filter out rsync requests
             p("Got rsync request.")
-            self._send("rsync list")  # ask child for list of dat files
+            s = f"rsync list {self.child_id} {self.child_version}"
+            self._send(s)  # ask child for dat files changed since last list
             return
         p(f"Sending to radio: {m}")
         self._send(m)
 
-    def client_to_rpi(self) -> str:
+    def client_to_rpi(self, timeout: float | None = 0) -> str:
         """Returns messages waiting in buffer
 
+        Args:
+            timeout (float | None, optional): seconds to wait for data. 0 returns immediately, None waits forever. Defaults to 0.
+
         Returns:
             str: messages to send, concatenated
         """
-        msg_arr = self.return_collected()  # get data from buffer
+        msg_arr = self.return_collected(timeout)  # get data from buffer
         if len(msg_arr) != 0:  # if there's data to send
             p(f"Received over radio: {msg_arr}")
         return EOL.join(msg_arr)  # return to be sent
 
-    def _rsync_from_radio(self, m: str) -> None:
-        """Called when child RPi returns rsync data"""
+    def _save_chunk(self, payload: bytes) -> None:
+        """Writes one chunk of a synced file at the offset the child read it from. Chunks that overlap what is already here replace it, so a resent chunk is harmless. A chunk past the end of the local copy means one went missing, so the rest of the file is asked for again.
 
-        if "rsync files" in m:  # got child RPi's file list
-            self._compare_files(m)
+        Args:
+            payload (bytes): "rsync chunk <name> <offset>" line, then the file bytes
+        """
+        split = payload.index(b"\n")  # get where header ends
+        header = payload[len(b"rsync chunk ") : split].decode(utf8)
+        name, at = header.rsplit(" ", 1)  # name may contain spaces
+        offset = int(at)
+        data = payload[split + 1 :]
+        path = os.path.normpath(os.path.join(rpi_data_path, name))
+        if not path.startswith(os.path.normpath(rpi_data_path) + os.sep):
+            p(f"Refusing to save {name} outside {rpi_data_path}")
+            return
+        have = os.path.getsize(path) if os.path.isfile(path) else 0
+
+        if offset > have:  # gap: resume from what we have
+            if self.resuming.get(name) != have:  # ask only once per gap
+                self.resuming[name] = have
+                self._ask_child_for_file(name, have)
+            return
+        self.resuming.pop(name, None)
 
-        elif m.startswith("[rsync files"):  # different format, just in case
-            self._compare_files(m)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "r+b" if have else "wb") as file:
+            file.seek(offset)
+            file.truncate()  # child's copy is the reference from here on
+            file.write(data)
+        p(f"Saved {len(data)} bytes of {name} at offset {offset}")
 
-        else:  # must be file/data to store
-            s = m.replace("rsync", "")  # remove trigger
-            split = s.index("\n")  # get where first line ends
-            name = rpi_data_path + s[:split].strip()  # get name
-            s = s[split + 1 :]  # separate rest of fie
-            p(f"Saving file at {name}")
-            with open(name, "w+") as file:
-                file.write(s)
+        if name in self.wanted and os.path.getsize(path) >= self.wanted[name]:
+            del self.wanted[name]  # caught up with the child's listed size
+            self._check_synced()
 
-    def _ask_child_for_file(self, filename: str) -> None:
+    def _ask_child_for_file(self, filename: str, offset: int = 0) -> None:
         """Get file from child for rsync
 
         Args:
-            s (str): file name
+            filename (str): file name, relative to the data directory
+            offset (int, optional): bytes of the file already here. Defaults to 0.
         """
-        p(f"Asking for file {filename}")
-        s = f"rsync {filename}"
+        p(f"Asking for file {filename} from byte {offset}")
+        s = f"rsync {filename} {offset}"
         self._send(s)
 
-    def _compare_files(self, m: str) -> None:
-        """List which files to get from child. If parent (this RPi) doesn't have a file, or has an outdated version, send a request to the child to return the file.
+    def _compare_files(self, page: bytes) -> None:
+        """List which files to get from child. If parent (this RPi) doesn't have a file, or has less of it, ask the child for everything past what is here. A local copy that is longer than the child's, or the same size with different contents, means the file was rewritten, so it is fetched from the start.
 
         Args:
-            m (str): list of all .dat files from child with last modified date
+            page (bytes): one page of the child's changed .dat files, from manifest.encode_list
         """
-        # dict of all .dat files from this RPi with dates
-        parent = self._get_file_list()
-        # get rid of brackets and quotes
-        m.replace("[", "").replace("]", "").replace("'", "")
-        c1 = m.split(",")  # list of all child .dat files with dates
-
-        c_list = [s.strip() for s in c1]  # strip whitespace
-
-        for i in c_list:  # get rid of rsync header
-            if "rsync" in i:
-                c_list.remove(i)
-
-        child: dict[str, float] = {}  # format child list as dict
-        for i in c_list:
-            j = i.split(";")
-            child.update({j[0].strip(): float(j[1].strip())})
-
-        for c in child.keys():
-            p_date = parent.get(c)
-            c_date = child.get(c)
-            if c_date == None:  # something must have broken somewhere
-                continue
-            elif p_date == None:  # no match in parent dict
-                p(f"No match for file {c}")
-                self._ask_child_for_file(c)  # send request
-            elif p_date <= c_date:  # if child file more recent
-                p(f"More recent version of {c} found")
-                self._ask_child_for_file(c)  # send request
-
-    def _get_file_list(self) -> dict[str, int]:
-        """Gets dict of all .dat files in the data directory on this RPi, with the corresponding date of modification
+        try:
+            child_id, version, index, count, entries = manifest.decode_page(page)
+        except ValueError as e:
+            p(f"Bad file list page: {e}")
+            return
+        if index == 0:
+            self.manifest.refresh()  # what this RPi has now
+            self.manifest.save()
+            self.listing, self.listed, self.wanted = (child_id, version), False, {}
+        parent = self.manifest.entries
+
+        for c, c_size, c_hash in entries:
+            mine = parent.get(c)
+            p_size = mine[manifest.SIZE] if mine else 0
+            if p_size < c_size:  # child file has grown
+                p(f"{c} has {c_size - p_size} new bytes")
+                self._ask_child_for_file(c, p_size)  # send request
+                self.wanted[c] = c_size
+            elif mine and (p_size > c_size or mine[manifest.HASH] != c_hash):
+                p(f"{c} was rewritten on child, fetching again")
+                self._ask_child_for_file(c, 0)  # send request
+                self.wanted[c] = c_size
+
+        if index == count - 1 and self.listing == (child_id, version):
+            self.listed = True  # whole list seen
+            self._check_synced()
+
+    def _check_synced(self) -> None:
+        """Once the whole list has been seen and every file it asked for has arrived, the next list only needs changes after it. Until then the child keeps listing those files, so a lost request or a restart doesn't skip them"""
+        if not self.listed or self.wanted:
+            return
+        self.listed = False
+        self.child_id, self.child_version = self.listing
+        self._save_sync_state()
+        p(f"Synced with child up to version {self.child_version}")
+
+    def _load_sync_state(self) -> tuple[str, int]:
+        """Reads the last child list fully synced. It only holds for the data directory it was synced into, so if this RPi's manifest is new (eg. the data was deleted), the child is asked for the full list
 
         Returns:
-            dict[str, int]: file name and modified date
+            tuple[str, int]: child manifest id and version, or ("-", 0) for the full list
         """
-
-        def _all_file_list(path: str = os.getcwd()) -> list[str]:
-            """Recursively finds all .dat files in the RPi data directory.
-
-            Args:
-                path (str, optional): current path to search. Defaults to current working directory.
-
-            Returns:
-                list[str]: all .dat files in current directory
-            """
-            to_return: list[str] = []
-            try:
-                file_list = os.listdir(path)  # get list of files
-            except:
-                p(f"Cannot find directory {path}, returning")
-                return []  # something went wrong, stop recursing
-
-            for entry in file_list:
-                fullPath = os.path.join(path, entry)
-                if os.path.isdir(fullPath):  # if directory, recurse on it
-                    to_return.extend(_all_file_list(fullPath))
-                if fullPath.endswith(".dat"):  # if .dat file, add to list
-                    to_return.append(fullPath)
-            return to_return
-
-        l = _all_file_list(rpi_data_path)
-        d: dict[str, int] = {}
-        for file in l:
-            if file.endswith(".dat"):  # filter for dat files
-                ctime = os.path.getctime(file)  # seconds since 1970
-                d.update({file: int(ctime)})  # new dict entry for name and date
-        return d
+        try:
+            with open(sync_state_path) as file:
+                saved = json.load(file)
+            if saved["manifest"] == self.manifest.id:
+                return saved["child_id"], int(saved["version"])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # missing or unreadable
+        return "-", 0
+
+    def _save_sync_state(self) -> None:
+        """Writes the last child list fully synced, next to the data. Written to a temporary file first, so a crash never leaves half of it"""
+        self.manifest.save()  # keeps the id the state is checked against
+        tmp = sync_state_path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(
+                {
+                    "manifest": self.manifest.id,
+                    "child_id": self.child_id,
+                    "version": self.child_version,
+                },
+                file,
+            )
+        os.replace(tmp, sync_state_path)
 
 
 def p(s: str) -> None:
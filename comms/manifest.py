@@ -0,0 +1,274 @@
+"""
+Persistent index of the .dat files under a data directory, used by rsync over radio. For each file it keeps the size, modification time and a content hash, and saves them in a JSON file in the data directory. refresh() rescans with os.scandir, which gets file types from the directory listing itself, and only rehashes files whose size or mtime changed.
+
+Every change bumps the manifest's version number, and each entry remembers the version it last changed in, so a peer that knows the last version it saw can ask for just the entries changed since then. Each manifest also has a random id. A peer holding a version from a different id (eg. the manifest file was deleted) gets the full list instead.
+
+Lists sent over radio use a compact binary format, split into pages of at most rsync_page bytes so each can be acted on as it arrives:
+    manifest id (4 bytes) | version | page index | page count | entries...
+and each entry, sorted by name:
+    bytes shared with previous name | length of rest | rest of name (UTF-8) | size | hash (8 bytes)
+Numbers are unsigned LEB128 varints. Names are front-coded against the previous name on the same page, so the long common directory prefixes cost a byte or two.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+# module imports
+import configs
+
+# manifest settings
+manifest_name = configs.manifest_name
+rsync_page = configs.rsync_page
+utf8 = configs.utf8
+
+# entry fields
+SIZE, MTIME, HASH, VERSION = range(4)
+HASH_LEN = 8  # bytes in a file hash
+
+
+def file_hash(path: str) -> str:
+    """Hashes a file's contents
+
+    Args:
+        path (str): file to hash
+
+    Returns:
+        str: short hex digest
+    """
+    h = hashlib.blake2b(digest_size=HASH_LEN)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(65536), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    """Size, mtime and hash of every .dat file under root, with a version number for each change"""
+
+    def __init__(self, root: str, path: str | None = None) -> None:
+        """
+        Args:
+            root (str): data directory to index
+            path (str | None, optional): where to keep the manifest file. Defaults to manifest_name inside root.
+        """
+        self.root = root
+        self.path = path or os.path.join(root, manifest_name)
+        self.id = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.entries: dict[str, list] = {}  # name -> [size, mtime_ns, hash, version]
+        self._load()
+
+    def _load(self) -> None:
+        """Reads the manifest file, if there is a usable one"""
+        try:
+            with open(self.path) as file:
+                saved = json.load(file)
+            self.id, self.version = saved["id"], saved["version"]
+            self.entries = saved["entries"]
+        except (OSError, ValueError, KeyError):
+            pass  # missing or unreadable, start a new manifest
+
+    def save(self) -> None:
+        """Writes the manifest file. Written to a temporary file first, so a crash never leaves half a manifest"""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(
+                {"id": self.id, "version": self.version, "entries": self.entries}, file
+            )
+        os.replace(tmp, self.path)
+
+    def refresh(self) -> list[str]:
+        """Rescans the data directory and records what changed
+
+        Returns:
+            list[str]: names of files that are new or changed since the last refresh
+        """
+        changed: list[str] = []
+        seen: set[str] = set()
+        for name, st in self._scan(self.root):
+            seen.add(name)
+            old = self.entries.get(name)
+            if old and old[SIZE] == st.st_size and old[MTIME] == st.st_mtime_ns:
+                continue  # unchanged, skip hashing
+            try:
+                digest = file_hash(os.path.join(self.root, name))
+            except OSError:
+                continue  # removed since scan
+            if old and old[SIZE] == st.st_size and old[HASH] == digest:
+                old[MTIME] = st.st_mtime_ns  # touched but not changed
+                continue
+            self.version += 1
+            self.entries[name] = [st.st_size, st.st_mtime_ns, digest, self.version]
+            changed.append(name)
+        for name in set(self.entries) - seen:  # removed files
+            del self.entries[name]
+        return changed
+
+    def since(self, peer_id: str, version: int) -> dict[str, list]:
+        """Entries changed after a version the peer has already seen
+
+        Args:
+            peer_id (str): manifest id the peer's version refers to
+            version (int): last version the peer has seen
+
+        Returns:
+            dict[str, list]: changed entries, or all of them if peer_id is not this manifest's id
+        """
+        if peer_id != self.id:
+            version = 0
+        return {n: e for n, e in self.entries.items() if e[VERSION] > version}
+
+    def _scan(self, path: str):
+        """Recursively yields .dat files under path
+
+        Args:
+            path (str): directory to search
+
+        Yields:
+            tuple[str, os.stat_result]: name relative to root, and stat result
+        """
+        try:
+            it = os.scandir(path)
+        except OSError:
+            print(f"Cannot find directory {path}, skipping", flush=True)
+            return
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._scan(entry.path)
+                elif entry.name.endswith(".dat"):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue  # removed since listing
+                    yield os.path.relpath(entry.path, self.root), st
+
+
+def _put_varint(out: bytearray, n: int) -> None:
+    """Appends an unsigned LEB128 varint
+
+    Args:
+        out (bytearray): buffer to append to
+        n (int): non-negative number
+    """
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data: bytes, i: int) -> tuple[int, int]:
+    """Reads an unsigned LEB128 varint
+
+    Args:
+        data (bytes): buffer to read from
+        i (int): where the varint starts
+
+    Raises:
+        ValueError: if data ends in the middle of the varint
+
+    Returns:
+        tuple[int, int]: the number, and where the next field starts
+    """
+    n = shift = 0
+    while True:
+        if i >= len(data):
+            raise ValueError("Truncated varint")
+        b = data[i]
+        i += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+
+def _record(prev: bytes, name: bytes, e: list) -> bytearray:
+    """Packs one entry, front-coded against the previous name
+
+    Args:
+        prev (bytes): previous name on the page, or b"" at the start of a page
+        name (bytes): this entry's name
+        e (list): manifest entry
+
+    Returns:
+        bytearray: packed entry
+    """
+    shared = len(os.path.commonprefix([prev, name]))
+    rec = bytearray()
+    _put_varint(rec, shared)
+    _put_varint(rec, len(name) - shared)
+    rec += name[shared:]
+    _put_varint(rec, e[SIZE])
+    rec += bytes.fromhex(e[HASH])
+    return rec
+
+
+def encode_list(
+    manifest_id: str, version: int, entries: dict[str, list]
+) -> list[bytes]:
+    """Packs manifest entries into pages for sending over radio
+
+    Args:
+        manifest_id (str): id of the manifest the entries come from
+        version (int): manifest version the entries are current as of
+        entries (dict[str, list]): entries to send, eg. from Manifest.since
+
+    Returns:
+        list[bytes]: pages, in order. There is always at least one, even if empty
+    """
+    bodies: list[bytearray] = []
+    body, prev = bytearray(), b""
+    for name in sorted(entries):
+        n = name.encode(utf8)
+        rec = _record(prev, n, entries[name])
+        if body and len(body) + len(rec) > rsync_page:  # page full, start next
+            bodies.append(body)
+            body = bytearray()
+            rec = _record(b"", n, entries[name])  # each page decodes on its own
+        body += rec
+        prev = n
+    bodies.append(body)
+
+    pages: list[bytes] = []
+    for index, body in enumerate(bodies):
+        head = bytearray(bytes.fromhex(manifest_id))
+        for n in (version, index, len(bodies)):
+            _put_varint(head, n)
+        pages.append(bytes(head + body))
+    return pages
+
+
+def decode_page(page: bytes) -> tuple[str, int, int, int, list[tuple[str, int, str]]]:
+    """Unpacks one page made by encode_list
+
+    Args:
+        page (bytes): page as received
+
+    Raises:
+        ValueError: if the page is truncated or malformed
+
+    Returns:
+        tuple[str, int, int, int, list[tuple[str, int, str]]]: manifest id, version, page index, page count, and (name, size, hash) of each entry
+    """
+    manifest_id = page[:4].hex()
+    i = 4
+    version, i = _get_varint(page, i)
+    index, i = _get_varint(page, i)
+    count, i = _get_varint(page, i)
+    out: list[tuple[str, int, str]] = []
+    prev = b""
+    while i < len(page):
+        shared, i = _get_varint(page, i)
+        rest, i = _get_varint(page, i)
+        name = prev[:shared] + page[i : i + rest]
+        i += rest
+        size, i = _get_varint(page, i)
+        digest = page[i : i + HASH_LEN]
+        i += HASH_LEN
+        if len(digest) != HASH_LEN:
+            raise ValueError("Truncated manifest page")
+        out.append((name.decode(utf8), size, digest.hex()))
+        prev = name
+    return manifest_id, version, index, count, out
@@ -0,0 +1,102 @@
+"""
+Thread-safe, fixed-capacity buffer for lines collected from the sensor or radio. When full, the oldest line is dropped and counted.
+"""
+
+import threading
+
+# module imports
+import configs
+
+# default capacity
+buffer_size = configs.buffer_size
+
+
+class RingBuffer:
+    """Lock-protected ring buffer with batch drain and optional blocking waits"""
+
+    def __init__(self, capacity: int = buffer_size) -> None:
+        """
+        Args:
+            capacity (int, optional): most items held at once. Defaults to buffer_size.
+        """
+        self.capacity = capacity
+        self.items: list[str | None] = [None] * capacity  # preallocated slots
+        self.head = 0  # index of oldest item
+        self.size = 0
+        self.overflow = 0  # number of items dropped because buffer was full
+        self.cond = threading.Condition()
+
+    def __len__(self) -> int:
+        with self.cond:
+            return self.size
+
+    def append(self, item: str) -> None:
+        """Adds an item, dropping the oldest if full
+
+        Args:
+            item (str): item to add
+        """
+        with self.cond:
+            self._put(item)
+            self.cond.notify_all()
+
+    def extend(self, items: list[str]) -> None:
+        """Adds several items at once
+
+        Args:
+            items (list[str]): items to add, in order
+        """
+        with self.cond:
+            for item in items:
+                self._put(item)
+            self.cond.notify_all()
+
+    def _put(self, item: str) -> None:
+        """Adds one item. Caller must hold the lock
+
+        Args:
+            item (str): item to add
+        """
+        tail = (self.head + self.size) % self.capacity
+        self.items[tail] = item
+        if self.size == self.capacity:  # overwrote oldest
+            self.head = (self.head + 1) % self.capacity
+            self.overflow += 1
+        else:
+            self.size += 1
+
+    def drain(
+        self, max_items: int | None = None, timeout: float | None = 0
+    ) -> list[str]:
+        """Removes and returns items, oldest first, in a single locked step
+
+        Args:
+            max_items (int | None, optional): most items to return. Defaults to all.
+            timeout (float | None, optional): seconds to wait for at least one item. 0 returns immediately, None waits forever. Defaults to 0.
+
+        Returns:
+            list[str]: items removed from the buffer
+        """
+        with self.cond:
+            if timeout != 0:
+                self.cond.wait_for(lambda: self.size > 0, timeout)
+            n = self.size if max_items is None else min(max_items, self.size)
+            out: list[str] = []
+            for _ in range(n):
+                out.append(self.items[self.head])  # type: ignore
+                self.items[self.head] = None
+                self.head = (self.head + 1) % self.capacity
+            self.size -= n
+            return out
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Blocks until the buffer has data
+
+        Args:
+            timeout (float | None, optional): seconds to wait. None waits forever. Defaults to None.
+
+        Returns:
+            bool: whether data is available
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: self.size > 0, timeout)
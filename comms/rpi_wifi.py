@@ -4,11 +4,13 @@ Handles WiFi communication for the RPi. Forwards messages from host to radio/sen
 
 import socket
 import time
+import asyncio
 import threading
 import socketserver
 
 # module imports
 import configs
+import channel
 import sensor
 import lora_parent
 
@@ -27,15 +29,20 @@ device_type = configs.device_type
 utf8 = configs.utf8
 EOL = configs.EOL
 EOF = configs.EOF
-msg_len = configs.msg_len
 
 # timing
 long_s = configs.long_s
 mid_s = configs.mid_s
 short_s = configs.short_s
+backoff_max = configs.backoff_max
+
+# run on one asyncio event loop instead of threads
+asyncio_mode = configs.asyncio_mode
 
 # global
-output: lora_parent.Radio | sensor.SQMLE | sensor.SQMLU
+output: lora_parent.Radio | sensor.SQMLE | sensor.SQMLU | None = None
+device_fd: int | None = None  # device file descriptor watched by the event loop, asyncio mode only
+attach_retry: asyncio.TimerHandle | None = None  # pending retry when no device was found, asyncio mode only
 
 
 class Server:
@@ -45,10 +52,14 @@ class Server:
         p(f"Creating RPi server {rpi_addr}:{rpi_server}")
         socketserver.TCPServer.allow_reuse_address = True  # allows reconnecting
 
-        # start TCP server
-        self.server = socketserver.TCPServer(
+        # start TCP server, one thread per connection since connections persist
+        self.server = ThreadedTCPServer(
             (rpi_addr, rpi_server), ThreadedTCPRequestHandler
         )
+        self.server.daemon_threads = True
+
+        # persistent connection to host, opened on first message
+        self.host = channel.Channel(host_addr, host_server)
 
         # run server in designated thread
         server_thread = threading.Thread(target=self.server.serve_forever)
@@ -57,20 +68,15 @@ class Server:
         p(f"Server loop running in {server_thread.name}")
 
     def send_to_host(self, s: str) -> None:
-        """Simple socket connection that forwards a single message to the host, then dies
+        """Forwards a message to the host over the persistent connection
 
         Args:
             s (str): message to send
         """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        try:
-            sock.connect((host_addr, host_server))  # connect to server
-            sock.sendall(f"{s}".encode(utf8))  # send everything
+        if self.host.send(s):
             p(f"Sent: {s}")  # for debugging
-        finally:
-            print(f"host_addr: {host_addr}, host_server: {host_server}")
-            sock.close()  # die
+        else:
+            p(f"Could not reach host_addr: {host_addr}, host_server: {host_server}")
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
@@ -83,26 +89,33 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
     """overwrites BaseRequestHandler with custom handler"""
 
     def handle(self):
-        """custom request handler for TCP threaded server"""
+        """custom request handler for TCP threaded server. Reads frames until the host closes the connection"""
 
         # ensure request is socket
         if not isinstance(self.request, socket.socket):
             p("ThreadedTCPRequestHandler: self.request not socket")
             return
 
-        # when request comes in, decode and format it
-        self.data = self.request.recv(msg_len).decode(utf8).strip()
-        p(
-            f"Received from {self.client_address[0]} in {threading.current_thread().name}: {self.data}"
-        )
-        global output
-        try:
-            output.rpi_to_client(self.data)  # forward message to radio/sensor
-        except Exception as e:
-            p(str(e))
-            p("Resetting output device")  # probably lost connection
-            _device_search()  # reconnect if possible
-            time.sleep(long_s)
+        while True:
+            try:
+                m = channel.recv_frame(self.request)
+            except (OSError, ValueError) as e:
+                p(f"Dropping connection from {self.client_address[0]}: {e}")
+                return
+            if m is None:  # host closed connection
+                return
+            self.data = m.strip()
+            p(
+                f"Received from {self.client_address[0]} in {threading.current_thread().name}: {self.data}"
+            )
+            global output
+            try:
+                output.rpi_to_client(self.data)  # forward message to radio/sensor
+            except Exception as e:
+                p(str(e))
+                p("Resetting output device")  # probably lost connection
+                _device_search()  # reconnect if possible
+                time.sleep(long_s)
 
 
 def _loop() -> None:
@@ -113,17 +126,21 @@ def _loop() -> None:
         time.sleep(mid_s)
         s = output.client_to_rpi()  # get messages from child
         if isinstance(s, list):  # message is list, convert to string
-            m = EOL.join(s)
-            p(f"Sending to host: {m}")
-            conn.send_to_host(EOL.join(m))
-            return
+            s = EOL.join(s)
         if len(s) > 0:  # message is non-empty string
             p(f"Sending to host: {s}")
             conn.send_to_host(s)
 
 
-def _device_search() -> None:
-    """Determines whether a radio or sensor is connected by trying to create each device"""
+def _device_search(listen: bool = True) -> bool:
+    """Determines whether a radio or sensor is connected by trying to create each device
+
+    Args:
+        listen (bool, optional): whether to start the device's listener thread. Defaults to True.
+
+    Returns:
+        bool: whether a device was found
+    """
     global output
 
     try:
@@ -133,21 +150,158 @@ def _device_search() -> None:
             output = sensor.SQMLE()
         else:
             output = sensor.SQMLU()  # default
-        output.start_continuous_read()
-        return
+        if listen:
+            output.start_continuous_read()
+        return True
     except Exception as e:
         p(str(e))
         p(f"SQM-LU or SQM-LE sensor not found.")
         p("Trying radio connection...")
 
     try:
-        output = lora_parent.Radio()
-        return
+        output = lora_parent.Radio(listen)
+        return True
     except Exception as e:
         p(str(e))
         p(f"No radio found at port {configs.R_ADDR}")
 
     p("No radio or sensor found. Please check connection!")
+    return False
+
+
+def _detach_device() -> None:
+    """Stops watching the current sensor or radio and closes its port or socket, so searching again doesn't leak it. A radio's link also stops resending to the closed port"""
+    global output, device_fd
+    if device_fd is not None:
+        asyncio.get_running_loop().remove_reader(device_fd)
+        device_fd = None
+    if output is not None:
+        try:
+            if isinstance(output, lora_parent.Radio):
+                output.close()
+            else:
+                output.s.close()
+        except Exception as e:
+            p(f"Could not close old device: {e}")
+        output = None
+
+
+def _attach_device(outbox: asyncio.Queue[str]) -> None:
+    """Finds the sensor or radio and reads it from the running event loop. Replies are queued for the host as soon as they arrive
+
+    Args:
+        outbox (asyncio.Queue[str]): messages waiting to be sent to host
+    """
+    global output, device_fd, attach_retry
+    loop = asyncio.get_running_loop()
+    if attach_retry is not None:  # called again before the retry ran
+        attach_retry.cancel()
+        attach_retry = None
+    _detach_device()
+    try:
+        if not _device_search(listen=False):
+            raise OSError("no device found")
+        reader = output.make_reader()
+        fd = device_fd = reader.fileno()
+    except Exception as e:
+        p(f"Could not attach device ({e}), retrying in {long_s} s")
+        _detach_device()
+        attach_retry = loop.call_later(long_s, _attach_device, outbox)
+        return
+
+    def _on_readable() -> None:
+        """Called by the event loop whenever the device has bytes"""
+        global device_fd, attach_retry
+        if not reader.on_readable():
+            p(f"Device connection closed, searching again in {long_s} s")
+            loop.remove_reader(fd)
+            device_fd = None  # the fd number may be reused before the retry
+            attach_retry = loop.call_later(long_s, _attach_device, outbox)
+            return
+        s = output.client_to_rpi()  # whatever the bytes completed
+        if isinstance(s, list):  # message is list, convert to string
+            s = EOL.join(s)
+        if len(s) > 0:
+            outbox.put_nowait(s)
+
+    loop.add_reader(fd, _on_readable)
+    p(f"Reading device on fd {fd} in event loop")
+
+
+async def _handle_host(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    outbox: asyncio.Queue[str],
+) -> None:
+    """Reads frames from one host connection and forwards them to the device
+
+    Args:
+        reader (asyncio.StreamReader): incoming stream
+        writer (asyncio.StreamWriter): outgoing stream, unused except to close
+        outbox (asyncio.Queue[str]): messages waiting to be sent to host
+    """
+    addr = writer.get_extra_info("peername")
+    try:
+        while (m := await channel.read_frame(reader)) is not None:
+            m = m.strip()
+            p(f"Received from {addr[0]}: {m}")
+            if output is None:  # search failed, a retry is scheduled
+                p("No device attached, message dropped")
+                continue
+            try:
+                output.rpi_to_client(m)  # forward message to radio/sensor
+            except Exception as e:
+                p(str(e))
+                p("Resetting output device")  # probably lost connection
+                _attach_device(outbox)  # reconnect if possible
+    except (OSError, ValueError) as e:
+        p(f"Dropping connection from {addr[0]}: {e}")
+    finally:
+        writer.close()
+
+
+async def _send_to_host(outbox: asyncio.Queue[str]) -> None:
+    """Sends queued messages to host over one persistent connection, reconnecting with backoff
+
+    Args:
+        outbox (asyncio.Queue[str]): messages waiting to be sent to host
+    """
+    writer: asyncio.StreamWriter | None = None
+    backoff = short_s
+    while True:
+        m = await outbox.get()
+        while True:  # don't drop the message if the host is unreachable
+            try:
+                if writer is None:
+                    _, writer = await asyncio.open_connection(host_addr, host_server)
+                    backoff = short_s
+                writer.write(channel.encode_frame(m))
+                await writer.drain()
+                p(f"Sent: {m}")
+                break
+            except OSError as e:
+                p(f"Could not reach host {host_addr}:{host_server}: {e}")
+                if writer is not None:
+                    writer.close()
+                    writer = None
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, backoff_max)
+
+
+async def _main_async() -> None:
+    """Runs the host server, the device reader and the host connection as coroutines on one event loop"""
+    outbox: asyncio.Queue[str] = asyncio.Queue()
+    _attach_device(outbox)
+
+    server = await asyncio.start_server(
+        lambda r, w: _handle_host(r, w, outbox),
+        rpi_addr,
+        rpi_server,
+        reuse_address=True,
+    )
+    p(f"Created RPi server {rpi_addr}:{rpi_server} on event loop")
+    async with server:
+        await asyncio.gather(server.serve_forever(), _send_to_host(outbox))
 
 
 def p(s: str) -> None:
@@ -165,13 +319,17 @@ def main():
 
     global output, conn
 
+    if asyncio_mode:
+        asyncio.run(_main_async())
+        return
+
     _device_search()
 
+    conn = Server()  # start TCP server
+
     l = threading.Thread(target=_loop)
     l.start()
 
-    conn = Server()  # start TCP server
-
 
 if __name__ == "__main__":
     main()
@@ -13,6 +13,9 @@ import threading
 
 # module import
 import configs
+import line_reader
+import dispatcher
+import ring_buffer
 
 # device info
 device_type = configs.device_type.replace("_", "-")
@@ -21,6 +24,7 @@ device_addr = configs.device_addr
 # debugging and retry settings
 DEBUG = configs.debug
 tries = configs.tries
+event_reader = configs.event_reader
 
 # LU-specific
 LU_BAUD = configs.LU_BAUD
@@ -51,11 +55,18 @@ elif device_type == "SQM-LU":
 class SQM:
     """Shared methods for SQM devices"""
 
+    reader: line_reader.LineReader | None = None  # set while event-driven listener runs
+
     def _reset_device(self) -> None:
         """Connection reset"""
+        reading = getattr(self, "live", False)  # listener watches the old connection
+        if reading:
+            self.stop_continuous_read()
         self._close_connection()
         time.sleep(short_s)
         self.start_connection()
+        if reading:
+            self.start_continuous_read()
 
     def _clear_buffer(self) -> None:
         """Clears buffer and prints to console"""
@@ -63,10 +74,39 @@ class SQM:
         print(self._read_buffer(), "| ... DONE")
 
     def send_and_receive(self, s: str, tries: int = tries) -> str:
-        """Sends and receives a single command. called from main
+        """Sends a single command and returns its reply. If the listener is running, returns as soon as the matching reply arrives; otherwise falls back to _send_and_wait.
 
         Args:
-            command (str): command to send
+            s (str): command to send
+            tries (int, optional): how many attempts to make
+
+        Returns:
+            str: sensor response
+        """
+        if not getattr(self, "live", False):
+            return self._send_and_wait(s, tries)
+
+        f = self.dispatcher.submit(s)  # register first so reply can't be missed
+        self._send_command(s)
+        try:
+            return f.result(timeout=long_s)
+        except Exception:  # no matching reply in time
+            self.dispatcher.cancel(f)
+            if tries <= 0:
+                print(("ERR. No reply from the photometer to: %s" % s))
+                if DEBUG:
+                    raise
+                return ""
+            time.sleep(mid_s)
+            self._reset_device()
+            time.sleep(mid_s)
+            return self.send_and_receive(s, tries - 1)
+
+    def _send_and_wait(self, s: str, tries: int = tries) -> str:
+        """Old way of sending a command: waits long_s and takes whatever is in the buffer. There's no way to guarantee that the response originated from the command that was sent, so only used when no listener is running.
+
+        Args:
+            s (str): command to send
             tries (int, optional): how many attempts to make
 
         Returns:
@@ -88,21 +128,33 @@ class SQM:
             time.sleep(mid_s)
             self._reset_device()
             time.sleep(mid_s)
-            m = self.send_and_receive(s, tries - 1)
+            m = self._send_and_wait(s, tries - 1)
             print(("Sensor info: " + str(m)), end=" ")
         return m
 
     def start_continuous_read(self) -> None:
-        """Starts listener"""
-        self.data: list[str] = []
+        """Starts listener. Uses the event-driven reader if enabled and the connection has a file descriptor, otherwise polls"""
         self.live = True
+        if event_reader:
+            try:
+                r = self.make_reader()
+                r.fileno()  # serial ports on Windows have no fd to select on
+                r.start()
+                self.reader = r
+                return
+            except Exception as e:
+                print(f"Event reader unavailable ({e}), polling instead")
         self.t1 = threading.Thread(target=self._listen)  # listener in background
         self.t1.start()
 
     def stop_continuous_read(self) -> None:
         """Stops listener"""
         self.live = False
-        self.t1.join()
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+        else:
+            self.t1.join()
 
     def _listen(self):
         """Listener. Runs in dedicated thread"""
@@ -111,15 +163,33 @@ class SQM:
             time.sleep(short_s)
             self._read_buffer()  # this stores the data
 
-    def _return_collected(self) -> list[str]:
-        """Clears data array, returns contents
+    def make_reader(self) -> line_reader.LineReader:
+        """Creates an event-driven reader for this connection without starting it. Lines it reads are stored as usual
+
+        Returns:
+            line_reader.LineReader: reader for the current connection
+        """
+        return line_reader.LineReader(self.s, self._read_available, self._store)
+
+    def _store(self, line: str) -> None:
+        """Hands a complete line to whichever command is waiting for it, otherwise stores it
+
+        Args:
+            line (str): sensor response
+        """
+        if not self.dispatcher.feed(line):
+            self.data.append(line)
+
+    def _return_collected(self, timeout: float | None = 0) -> list[str]:
+        """Empties data buffer, returns contents
+
+        Args:
+            timeout (float | None, optional): seconds to wait for data. 0 returns immediately, None waits forever. Defaults to 0.
 
         Returns:
             list[str]: data to return
         """
-        d = self.data[:]  # pass by value, not reference
-        self.data.clear()  # clear buffer
-        return d
+        return self.data.drain(timeout=timeout)
 
     def rpi_to_client(self, s: str) -> None:
         """Sends a command to the sensor
@@ -130,13 +200,16 @@ class SQM:
         print(f"Sending to sensor: {s}")
         self._send_command(s)
 
-    def client_to_rpi(self) -> list[str]:
+    def client_to_rpi(self, timeout: float | None = 0) -> list[str]:
         """Returns responses from sensor
 
+        Args:
+            timeout (float | None, optional): seconds to wait for a response. 0 returns immediately, None waits forever. Defaults to 0.
+
         Returns:
             list[str]: responses
         """
-        m_arr = self._return_collected()
+        m_arr = self._return_collected(timeout)
         return m_arr
 
     def start_connection(self) -> None: ...
@@ -145,6 +218,8 @@ class SQM:
 
     def _read_buffer(self) -> bytes | None: ...
 
+    def _read_available(self) -> bytes: ...
+
     def _send_command(self, s: str) -> None: ...
 
 
@@ -153,7 +228,8 @@ class SQMLE(SQM):
 
     def __init__(self) -> None:
         """Search the photometer in the network and read its metadata"""
-        self.data: list[str] = []
+        self.data = ring_buffer.RingBuffer()
+        self.dispatcher = dispatcher.Dispatcher()
         try:
             self.addr = device_addr
             self.start_connection()
@@ -228,11 +304,15 @@ class SQMLE(SQM):
             m = self.s.recv(SOCK_BUF)
             if m.decode(utf8) == "":
                 return
-            self.data.append(m.decode(utf8).strip())
+            self._store(m.decode(utf8).strip())
         except:
             pass
         return m
 
+    def _read_available(self) -> bytes:
+        """Reads whatever has arrived on the socket. Only called once select() reports data"""
+        return self.s.recv(SOCK_BUF)
+
     def _send_command(self, s: str) -> None:
         """SQM_LE sends a command to the sensor
 
@@ -245,7 +325,8 @@ class SQMLE(SQM):
 class SQMLU(SQM):
     def __init__(self) -> None:
         """Search for the photometer and read its metadata"""
-        self.data: list[str] = []
+        self.data = ring_buffer.RingBuffer()
+        self.dispatcher = dispatcher.Dispatcher()
         try:
             print(f"Trying fixed device address {device_addr}")
             self.addr = device_addr
@@ -312,11 +393,15 @@ class SQMLU(SQM):
             m = self.s.readline()
             if m.decode(utf8) == "":
                 return
-            self.data.append(m.decode(utf8).strip())
+            self._store(m.decode(utf8).strip())
         except:
             pass
         return m
 
+    def _read_available(self) -> bytes:
+        """Reads whatever has arrived on the serial port, without waiting for a full line"""
+        return self.s.read(self.s.in_waiting or 1)
+
     def _send_command(self, s: str) -> None:
         """SQM_LU sends a command to the sensor
 
@@ -325,36 +410,6 @@ class SQMLU(SQM):
         """
         self.s.write(s.encode(utf8))
 
-    def send_and_receive(self, s: str, tries: int = tries) -> str:
-        """Deprecated way of sending a command and waiting for a response. However, there's no way to guarantee that the given response originated from the command that was sent.
-
-        Args:
-            s (str): command to send
-            tries (int, optional): number of attempts to make. Defaults to tries.
-
-        Returns:
-            str: _description_
-        """
-        m: str = ""
-        self._send_command(s)
-        time.sleep(long_s)
-        byte_m = self._read_buffer()
-        try:  # Sanity check
-            assert byte_m != None
-            m = byte_m.decode(utf8)
-        except:
-            if tries <= 0:
-                print(("ERR. Reading the photometer!: %s" % str(byte_m)))
-                if DEBUG:
-                    raise
-                return ""
-            time.sleep(mid_s)
-            self._reset_device()
-            time.sleep(mid_s)
-            m = self.send_and_receive(s, tries - 1)
-            print(("Sensor info: " + str(m)), end=" ")
-        return m
-
 
 if __name__ == "__main__":
     """For debugging purposes. Parses command line arguments."""
@@ -384,5 +439,7 @@ if __name__ == "__main__":
         d = SQMLU()  # default
 
     time.sleep(long_s)
+    d.start_continuous_read()
     resp = d.send_and_receive(command)
+    d.stop_continuous_read()
     print(f"Sensor response: {resp}")
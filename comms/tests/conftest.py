@@ -0,0 +1,8 @@
+"""
+The comms modules import each other by name, as when run from the comms directory
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,97 @@
+"""
+Checks the host<->RPi framing and reconnection over local sockets, without an RPi
+"""
+
+import socket
+import threading
+import time
+
+import channel
+
+
+class FrameServer:
+    """Local stand-in for the receiving end, collecting the messages it reads"""
+
+    def __init__(self, port: int = 0) -> None:
+        """
+        Args:
+            port (int, optional): port to listen on. Defaults to 0, any free port.
+        """
+        self.listener = socket.create_server(("127.0.0.1", port))
+        self.port = self.listener.getsockname()[1]
+        self.conns: list[socket.socket] = []
+        self.received: list[str] = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self) -> None:
+        """Accepts connections until killed"""
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            threading.Thread(target=self._read, args=(conn,), daemon=True).start()
+
+    def _read(self, conn: socket.socket) -> None:
+        """Reads frames until the connection closes"""
+        try:
+            while (m := channel.recv_frame(conn)) is not None:
+                self.received.append(m)
+        except OSError:
+            pass
+
+    def kill(self) -> None:
+        """Stops listening and drops every connection, as a restarting program would"""
+        for s in [self.listener] + self.conns:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            s.close()
+
+    def wait_for(self, n: int, timeout: float = 2) -> list[str]:
+        """Waits until n messages arrived
+
+        Args:
+            n (int): number of messages
+            timeout (float, optional): longest wait in seconds. Defaults to 2.
+
+        Returns:
+            list[str]: messages received so far
+        """
+        end = time.monotonic() + timeout
+        while len(self.received) < n and time.monotonic() < end:
+            time.sleep(0.01)
+        return self.received
+
+
+def test_frames_arrive_whole_and_in_order():
+    server = FrameServer()
+    c = channel.Channel("127.0.0.1", server.port)
+    messages = ["rx", "x" * 100000, "", "cx\nwith lines\n"]
+    try:
+        for m in messages:
+            assert c.send(m)
+        assert server.wait_for(len(messages)) == messages
+    finally:
+        c.close()
+        server.kill()
+
+
+def test_send_after_server_restart_reconnects():
+    server = FrameServer()
+    c = channel.Channel("127.0.0.1", server.port)
+    try:
+        assert c.send("before")
+        assert server.wait_for(1) == ["before"]
+
+        server.kill()
+        time.sleep(0.1)  # let the FIN reach the client
+        server = FrameServer(server.port)
+
+        assert c.send("after")
+        assert server.wait_for(1) == ["after"]
+    finally:
+        c.close()
+        server.kill()
@@ -0,0 +1,74 @@
+"""
+Checks the radio compression: round trips, codec negotiation and savings on .dat rows
+"""
+
+import pytest
+
+import compression
+
+CODECS = [compression.ZLIB] + ([compression.LZMA] if compression.lzma else [])
+
+
+def connected():
+    """Two compressors whose messages go straight to each other
+
+    Returns:
+        tuple[compression.Compressor, compression.Compressor]: both ends, after the hello exchange
+    """
+    ends: list[compression.Compressor] = []
+    a = compression.Compressor(lambda m: ends[1].decode(m))
+    b = compression.Compressor(lambda m: ends[0].decode(m))
+    ends.extend([a, b])
+    a.start()
+    return a, b
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize(
+    "data", [b"", b"rx", compression.sample_month(1)[:4096], bytes(range(256)) * 8]
+)
+def test_round_trip(codec, data):
+    assert compression.decompress(codec, compression.compress(codec, data)) == data
+
+
+def test_hello_agrees_on_common_codecs():
+    a, b = connected()
+    assert a.agreed == b.agreed == a.offered
+    rows = compression.sample_month(1)[:4096]
+    packed = a.encode(rows)
+    assert packed[0] in a.agreed and len(packed) < len(rows) // 3
+    assert b.decode(packed) == rows
+
+
+def test_raw_until_peer_hello():
+    a = compression.Compressor(lambda m: None)
+    packed = a.encode(b"r, 19.23m,0000005915Hz,0000000000c,0000000.000s, 027.0C")
+    assert packed[0] == compression.RAW
+
+
+def test_peer_without_codecs_gets_raw():
+    a = compression.Compressor(lambda m: None)
+    a.decode(bytes([compression.HELLO, 0]))  # peer decodes nothing but raw
+    assert a.agreed == set()
+    assert a.encode(b"x" * 1000)[0] == compression.RAW
+
+
+def test_restarted_peer_is_answered():
+    sent: list[bytes] = []
+    a = compression.Compressor(sent.append)
+    a.decode(bytes([compression.HELLO, 1, compression.ZLIB]))
+    assert sent and sent[0][:2] == bytes([compression.HELLO, 0])
+
+
+def test_undecodable_message_is_dropped():
+    a = compression.Compressor(lambda m: None)
+    assert a.decode(bytes([compression.ZLIB]) + b"not deflate") is None
+    assert a.decode(bytes([0x7E]) + b"unknown codec") is None
+    assert a.decode(b"") is None
+
+
+def test_bomb_is_refused(monkeypatch):
+    monkeypatch.setattr(compression, "max_frame_len", 1000)
+    bomb = compression.compress(compression.ZLIB, bytes(100000))
+    with pytest.raises(ValueError):
+        compression.decompress(compression.ZLIB, bomb)
@@ -0,0 +1,72 @@
+"""
+Checks that sensor replies resolve the command that caused them, without a sensor
+"""
+
+import threading
+
+import pytest
+
+import dispatcher
+
+
+@pytest.mark.parametrize(
+    "command, prefix",
+    [
+        ("rx", "r,"),
+        ("cx", "c,"),
+        ("ix", "i,"),
+        ("p0000000300x", "I,"),
+        ("zcal5x", "z,5"),
+        ("zcalAx", "z"),
+        ("L40000000000x", "L4,"),
+        ("Lmx", "LM,"),
+        ("LPS0000000300x", "LI,"),
+        ("Lcx", ("Lc,", "LC,")),
+        ("L2x", None),
+        ("", None),
+    ],
+)
+def test_expected_prefix(command, prefix):
+    assert dispatcher.expected_prefix(command) == prefix
+
+
+def test_replies_match_their_commands_in_any_order():
+    d = dispatcher.Dispatcher()
+    r = d.submit("rx")
+    c = d.submit("cx")
+    assert not d.feed("unrelated line")
+    assert d.feed("c, 00000019.84m,0000151800s,")
+    assert c.result(timeout=0).startswith("c,") and not r.done()
+    assert d.feed("r, 19.23m,0000005915Hz")
+    assert r.result(timeout=0).startswith("r,")
+    assert d.pending == []
+
+
+def test_same_command_twice_resolves_oldest_first():
+    d = dispatcher.Dispatcher()
+    first, second = d.submit("rx"), d.submit("rx")
+    d.feed("r, 1")
+    d.feed("r, 2")
+    assert (first.result(timeout=0), second.result(timeout=0)) == ("r, 1", "r, 2")
+
+
+def test_command_without_reply_resolves_at_once():
+    d = dispatcher.Dispatcher()
+    assert d.submit("L2x").result(timeout=0) == ""
+    assert d.pending == []
+
+
+def test_cancelled_command_does_not_take_a_reply():
+    d = dispatcher.Dispatcher()
+    late = d.submit("rx")
+    d.cancel(late)
+    waiting = d.submit("rx")
+    assert d.feed("r, 19.23m")
+    assert late.cancelled() and waiting.result(timeout=0) == "r, 19.23m"
+
+
+def test_reply_from_another_thread_wakes_waiter():
+    d = dispatcher.Dispatcher()
+    f = d.submit("ix")
+    threading.Timer(0.05, d.feed, args=("i,00000004,00000003",)).start()
+    assert f.result(timeout=2) == "i,00000004,00000003"
@@ -0,0 +1,114 @@
+"""
+Checks line splitting in LineReader on a socketpair and on a pipe standing in for a serial port, without a sensor
+"""
+
+import os
+import socket
+import time
+
+import line_reader
+
+
+class FakeSerial:
+    """Pipe with the parts of a pyserial port that LineReader uses"""
+
+    def __init__(self) -> None:
+        self.r, self.w = os.pipe()
+
+    def fileno(self) -> int:
+        return self.r
+
+    def read(self) -> bytes:
+        return os.read(self.r, 64)
+
+    def write(self, b: bytes) -> None:
+        os.write(self.w, b)
+
+    def close(self) -> None:
+        os.close(self.r)
+        os.close(self.w)
+
+
+def wait_for(lines: list[str], n: int, timeout: float = 2) -> list[str]:
+    """Waits until n lines were read
+
+    Args:
+        lines (list[str]): lines collected by the reader
+        n (int): number of lines
+        timeout (float, optional): longest wait in seconds. Defaults to 2.
+
+    Returns:
+        list[str]: lines read so far
+    """
+    end = time.monotonic() + timeout
+    while len(lines) < n and time.monotonic() < end:
+        time.sleep(0.01)
+    return lines
+
+
+def test_feed_splits_lines_across_chunks():
+    lines: list[str] = []
+    r = line_reader.LineReader(None, bytes, lines.append)
+    for chunk in (b"r, 19.2", b"3m,0000005915Hz\r\n\r\nc, 00", b"\r\n", b"i, 0"):
+        r.feed(chunk)
+    assert lines == ["r, 19.23m,0000005915Hz", "c, 00"]
+    assert bytes(r.buf) == b"i, 0"  # partial line waits for the rest
+
+
+def test_feed_keeps_whitespace_without_strip():
+    lines: list[str] = []
+    r = line_reader.LineReader(None, bytes, lines.append, delimiter="\r", strip=False)
+    r.feed(b" a \r\rb\r")
+    assert lines == [" a ", "", "b"]
+
+
+def test_on_chunk_gets_raw_bytes():
+    chunks: list[bytes] = []
+    r = line_reader.LineReader(None, bytes, print, on_chunk=chunks.append)
+    r.feed(b"\xa5\x5a\n")
+    assert chunks == [b"\xa5\x5a\n"] and len(r.buf) == 0
+
+
+def test_socket_reader_stops_when_peer_closes():
+    a, b = socket.socketpair()
+    lines: list[str] = []
+    r = line_reader.LineReader(a, lambda: a.recv(64), lines.append)
+    r.start()
+    try:
+        b.sendall(b"r, 19.23m\n")
+        b.sendall(b"r, 19.")
+        b.sendall(b"24m\n")
+        assert wait_for(lines, 2) == ["r, 19.23m", "r, 19.24m"]
+        b.close()
+        assert r.t is not None
+        r.t.join(timeout=2)
+        assert not r.t.is_alive() and not r.live
+    finally:
+        r.stop()
+        a.close()
+
+
+def test_serial_reader_stop_closes_wake_sockets():
+    port = FakeSerial()
+    lines: list[str] = []
+    r = line_reader.LineReader(port, port.read, lines.append)
+    before = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+    r.start()
+    try:
+        port.write(b"x" * 100 + b"\n")
+        assert wait_for(lines, 1) == ["x" * 100]
+    finally:
+        r.stop()
+    assert r.t is not None and not r.t.is_alive()
+    if before is not None:
+        assert len(os.listdir("/proc/self/fd")) == before
+    port.close()
+
+
+def test_unstarted_reader_opens_nothing():
+    a, b = socket.socketpair()
+    r = line_reader.LineReader(a, lambda: a.recv(64), print)
+    r.stop()  # never started, nothing to wake
+    assert r.t is None
+    a.close()
+    b.close()
@@ -0,0 +1,131 @@
+"""
+Checks the framed LoRa link over an in-memory radio that loses and corrupts frames, without a radio
+"""
+
+import queue
+import random
+import threading
+import time
+
+import pytest
+
+import lora_link
+
+
+class Air:
+    """One direction of the radio. Frames are delivered from a thread of their own, some lost or corrupted"""
+
+    def __init__(self, loss: float = 0.0, corrupt: float = 0.0, seed: int = 1) -> None:
+        self.loss = loss
+        self.corrupt = corrupt
+        self.random = random.Random(seed)
+        self.q: queue.Queue[bytes] = queue.Queue()
+        self.to: lora_link.Link | None = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def write(self, frame: bytes) -> None:
+        if self.random.random() < self.loss:
+            return
+        if self.random.random() < self.corrupt:
+            b = bytearray(frame)
+            b[self.random.randrange(len(b))] ^= 0xFF
+            frame = bytes(b)
+        self.q.put(frame)
+
+    def _run(self) -> None:
+        while True:
+            frame = self.q.get()
+            if self.to is not None:
+                self.to.feed(frame)
+
+
+def pair(loss: float = 0.0, corrupt: float = 0.0):
+    """Two links talking over the air
+
+    Returns:
+        tuple: both links, and the messages each one received
+    """
+    ab, ba = Air(loss, corrupt, 1), Air(loss, corrupt, 2)
+    got_a: list[bytes] = []
+    got_b: list[bytes] = []
+    a = lora_link.Link(ab.write, got_a.append)
+    b = lora_link.Link(ba.write, got_b.append)
+    ab.to, ba.to = b, a
+    return a, b, got_a, got_b, ab, ba
+
+
+def wait_for(got: list, n: int, timeout: float = 10) -> list:
+    end = time.monotonic() + timeout
+    while len(got) < n and time.monotonic() < end:
+        time.sleep(0.01)
+    return got
+
+
+@pytest.fixture(autouse=True)
+def fast_timers(monkeypatch):
+    monkeypatch.setattr(lora_link, "lora_ack_timeout", 0.1)
+    monkeypatch.setattr(lora_link, "short_s", 0.02)
+
+
+def test_frame_round_trip_and_crc():
+    frame = lora_link.encode_frame(lora_link.DATA | lora_link.START, 7, b"rx")
+    got: list[bytes] = []
+    link = lora_link.Link(lambda b: None, got.append)
+    link.announced = True
+    link.expected = 7
+    bad = bytearray(frame)
+    bad[-3] ^= 1
+    link.feed(b"noise" + bytes(bad) + frame[:4])
+    link.feed(frame[4:])
+    assert got == [b"rx"] and link.bad_frames == 1
+
+
+def test_messages_arrive_in_order_over_a_bad_radio():
+    a, b, got_a, got_b, _, _ = pair(loss=0.2, corrupt=0.1)
+    messages = [bytes([k]) * (k * 37 % 700 + 1) for k in range(20)]
+    a.start()
+    b.start()
+    try:
+        for m in messages:
+            a.send(m)
+        b.send(b"reply")
+        assert wait_for(got_b, len(messages)) == messages
+        assert wait_for(got_a, 1) == [b"reply"]
+        assert a.retransmits > 0
+    finally:
+        a.stop()
+        b.stop()
+
+
+def test_restarted_side_resyncs_without_loss():
+    a, b, _, got_b, ab, ba = pair()
+    a.start()
+    b.start()
+    try:
+        a.send(b"before")
+        assert wait_for(got_b, 1) == [b"before"]
+
+        b.stop()  # child restarts: new link, numbering from 0
+        got_b.clear()
+        b = lora_link.Link(ba.write, got_b.append)
+        ab.to = b
+        b.start()
+        a.send(b"after 1")
+        a.send(b"after 2")
+        assert wait_for(got_b, 2) == [b"after 1", b"after 2"]
+    finally:
+        a.stop()
+        b.stop()
+
+
+def test_stopped_link_writes_nothing():
+    written: list[bytes] = []
+    link = lora_link.Link(written.append, lambda m: None)
+    link.start()
+    link.send(b"x")
+    link.stop()
+    n = len(written)
+    link.send(b"y")
+    link.feed(lora_link.encode_frame(lora_link.SYNC, 0, b"\x01"))
+    time.sleep(0.3)
+    assert len(written) == n
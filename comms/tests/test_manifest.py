@@ -0,0 +1,84 @@
+"""
+Checks the data file manifest and the paged binary file list sent over radio
+"""
+
+import os
+
+import pytest
+
+import manifest
+
+
+def write(root, name: str, data: bytes) -> None:
+    path = os.path.join(root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def decode_all(pages: list[bytes]) -> dict[str, tuple[int, str]]:
+    """Joins the entries of every page
+
+    Returns:
+        dict[str, tuple[int, str]]: name -> size, hash
+    """
+    out = {}
+    for index, page in enumerate(pages):
+        _, _, i, count, entries = manifest.decode_page(page)
+        assert (i, count) == (index, len(pages))
+        out.update({name: (size, digest) for name, size, digest in entries})
+    return out
+
+
+def test_list_round_trip_over_several_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest, "rsync_page", 200)
+    m = manifest.Manifest(str(tmp_path))
+    for k in range(40):
+        write(tmp_path, f"2024-05/202405{k:02d}_120000_SQM-macleish.dat", b"r" * k)
+    m.refresh()
+
+    pages = manifest.encode_list(m.id, m.version, m.entries)
+    assert len(pages) > 1 and all(len(page) <= 200 + 16 for page in pages)
+    assert decode_all(pages) == {
+        n: (e[manifest.SIZE], e[manifest.HASH]) for n, e in m.entries.items()
+    }
+    assert manifest.decode_page(pages[0])[:2] == (m.id, m.version)
+
+
+def test_empty_list_is_one_page(tmp_path):
+    m = manifest.Manifest(str(tmp_path))
+    pages = manifest.encode_list(m.id, m.version, {})
+    assert len(pages) == 1 and decode_all(pages) == {}
+
+
+def test_truncated_page_is_rejected(tmp_path):
+    m = manifest.Manifest(str(tmp_path))
+    write(tmp_path, "a.dat", b"rows")
+    m.refresh()
+    page = manifest.encode_list(m.id, m.version, m.entries)[0]
+    with pytest.raises(ValueError):
+        manifest.decode_page(page[:-3])
+
+
+def test_since_lists_only_changes(tmp_path):
+    m = manifest.Manifest(str(tmp_path))
+    write(tmp_path, "a.dat", b"1")
+    write(tmp_path, "b.dat", b"2")
+    write(tmp_path, "notes.txt", b"not data")
+    assert sorted(m.refresh()) == ["a.dat", "b.dat"]
+    seen = m.version
+
+    write(tmp_path, "b.dat", b"22")
+    assert m.refresh() == ["b.dat"]
+    assert list(m.since(m.id, seen)) == ["b.dat"]
+    assert sorted(m.since("-", seen)) == ["a.dat", "b.dat"]  # other id: full list
+
+
+def test_saved_manifest_keeps_id_and_version(tmp_path):
+    m = manifest.Manifest(str(tmp_path))
+    write(tmp_path, "a.dat", b"1")
+    m.refresh()
+    m.save()
+    again = manifest.Manifest(str(tmp_path))
+    assert (again.id, again.version, again.entries) == (m.id, m.version, m.entries)
+    assert again.refresh() == []  # nothing changed, nothing rehashed